@@ -0,0 +1,135 @@
+"""
+Micro-benchmark of the JSON decoders.
+
+Compares the time and peak memory of decoding a Selver catalog response with the stdlib json module,
+as the scrapers did before etc.decoding, against every installed backend, with and without the
+Selver schema.
+
+Usage:
+    python -m benchmarks.bench_decode [--payload FILE] [--hits N] [--rounds N]
+"""
+
+import json
+import random
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from etc.decoding import get_decoder, msgspec, orjson
+
+
+def payload(hits: int) -> bytes:
+    """
+    Builds a Selver catalog response, with the fields a real one has that the parser doesn't use.
+
+    :param hits: The number of products in the response.
+
+    :returns: The response body.
+    """
+
+    rng = random.Random(42)
+    return json.dumps(
+        {
+            "took": 12,
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {
+                "total": hits,
+                "max_score": None,
+                "hits": [
+                    {
+                        "_index": "vue_storefront_catalog_et_product",
+                        "_type": "_doc",
+                        "_id": str(index),
+                        "_score": None,
+                        "_source": {
+                            "sku": f"T{index:09d}",
+                            "product_main_ean": str(4740000000000 + index),
+                            "name": f"Piim {rng.choice(['2,5%', '3,5%'])} {rng.choice(['1 l', '0,5 l'])}",
+                            "product_other_ean": "",
+                            "final_price": round(rng.uniform(0.5, 20), 2),
+                            "final_price_incl_tax": round(rng.uniform(0.5, 20), 2),
+                            "product_age_restricted": False,
+                            "product_volume": "1 l",
+                            "unit_price": round(rng.uniform(0.5, 20), 2),
+                            "url_key": f"piim-{index}",
+                            "prices": [
+                                {"is_discount": rng.random() < 0.2, "customer_group_id": group, "price": 1.0}
+                                for group in range(4)
+                            ],
+                            "category": [
+                                {"category_id": category, "name": "Piimatooted", "slug": "piimatooted", "path": "1/2/3"}
+                                for category in range(3)
+                            ],
+                            "media_gallery": [
+                                {"image": f"/p/i/{index}-{image}.jpg", "pos": image, "typ": "image", "lab": None}
+                                for image in range(3)
+                            ],
+                            "description": "Lorem ipsum dolor sit amet. " * 20,
+                        },
+                    }
+                    for index in range(hits)
+                ],
+            },
+        }
+    ).encode()
+
+
+def measure(label: str, function, body: bytes, rounds: int) -> None:
+    """
+    Prints the per-response time and the peak memory of decoding the body.
+
+    :param label: The name of the measurement.\n
+    :param function: The function decoding the body.\n
+    :param body: The response body.\n
+    :param rounds: The number of times the body is decoded.
+
+    :returns: None
+    """
+
+    t1 = time.perf_counter()
+    for _ in range(rounds):
+        function(body)
+    t2 = time.perf_counter()
+
+    tracemalloc.start()
+    function(body)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<24} {(t2 - t1) / rounds * 1e3:8.3f} ms per response {peak / 1024:10.1f} KiB peak")
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("--payload", help="A file with a saved catalog response", required=False)
+    argparser.add_argument("--hits", help="The number of products in the response", type=int, default=250)
+    argparser.add_argument("--rounds", help="The number of times every decoder runs", type=int, default=200)
+    args = argparser.parse_args()
+
+    if args.payload is not None:
+        with open(args.payload, "rb") as f:
+            body = f.read()
+    else:
+        body = payload(args.hits)
+
+    # The store modules connect to the database when imported, the schema is left out without one.
+    try:
+        from selver import SCHEMA  # pylint: disable=import-outside-toplevel
+    except Exception as e:  # pylint: disable=broad-except
+        print(f"Selver schema unavailable: {e!r}")
+        SCHEMA = None
+
+    print(f"{len(body) / 1024:.1f} KiB response")
+    measure("json, text then loads", lambda body: json.loads(body.decode()), body, args.rounds)
+    for backend in ("json", "orjson", "msgspec"):
+        if backend == "orjson" and orjson is None or backend == "msgspec" and msgspec is None:
+            print(f"{backend:<24} not installed")
+            continue
+        measure(backend, get_decoder(backend).decode, body, args.rounds)
+    if msgspec is not None and SCHEMA is not None:
+        measure("msgspec, Selver schema", get_decoder("msgspec", SCHEMA).decode, body, args.rounds)
+
+
+if __name__ == "__main__":
+    main()
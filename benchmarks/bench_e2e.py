@@ -0,0 +1,126 @@
+"""
+Offline end-to-end benchmark of the scraping tasks.
+
+Runs the same coordinator main.py runs against the replay server in benchmarks.replay and the
+in-memory database, so no network or MySQL is needed. The fixture archive has to be recorded with
+the same id files, `python main.py --record FILE`. Reports the items per second, the p50 and p99
+request latency, the database time and the peak RSS.
+
+Usage:
+    python -m benchmarks.bench_e2e FILE [--stores NAME ...] [--latency S] [--error-rate P] [--rate N]
+"""
+
+import multiprocessing
+import os
+import resource
+import socket
+import sys
+import time
+from argparse import ArgumentParser
+
+from benchmarks.replay import serve
+
+
+def wait_for_port(host: str, port: int, timeout: float = 10.0) -> None:
+    """
+    Waits until a server accepts connections.
+
+    :param host: The host of the server.\n
+    :param port: The port of the server.\n
+    :param timeout: The time in seconds to wait.
+
+    :returns: None
+    """
+
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            with socket.create_connection((host, port), timeout=1):
+                return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("path", help="The fixture archive recorded with main.py --record")
+    argparser.add_argument("--stores", help="The stores to scrape, defaults to every store", nargs="+")
+    argparser.add_argument("--port", help="The port of the replay server", type=int, default=8089)
+    argparser.add_argument("--latency", help="The mean latency in seconds", type=float, default=0.05)
+    argparser.add_argument("--jitter", help="The maximum random latency added or taken", type=float, default=0.02)
+    argparser.add_argument("--error-rate", help="The share of requests failing with a 503", type=float, default=0.0)
+    argparser.add_argument("--rate", help="Requests per second before throttling with 429s", type=float, default=0.0)
+    argparser.add_argument("--decoder", help="The JSON decoder of the responses", default="auto")
+    argparser.add_argument("--report", help="Also write the JSON run report to this file", required=False)
+    args = argparser.parse_args()
+
+    # The stand-in database has to be chosen before DB_CONNECTOR is first used.
+    os.environ["DATABASE_BACKEND"] = "memory"
+    # pylint: disable=import-outside-toplevel
+    from etc.coordinator import Coordinator
+    from etc.data import DB_CONNECTOR
+    from etc.metrics import METRICS
+    from etc.scraper import STORES
+    import prisma  # noqa: F401  pylint: disable=unused-import
+    import selver  # noqa: F401  pylint: disable=unused-import
+
+    server = multiprocessing.Process(
+        target=serve,
+        args=(args.path,),
+        kwargs={
+            "port": args.port,
+            "latency": args.latency,
+            "jitter": args.jitter,
+            "error_rate": args.error_rate,
+            "rate": args.rate,
+        },
+        daemon=True,
+    )
+    server.start()
+    try:
+        wait_for_port("127.0.0.1", args.port)
+
+        tasks = {
+            STORES[store].store: STORES[store](decoder=args.decoder, replay=f"http://127.0.0.1:{args.port}")
+            for store in args.stores or sorted(STORES)
+        }
+
+        METRICS.reset()
+        t1 = time.perf_counter()
+        finished = Coordinator(tasks).start()
+        with METRICS.timer("finish"):
+            DB_CONNECTOR.finish_run(finished)
+        with METRICS.timer("match"):
+            DB_CONNECTOR.match_products()
+        with METRICS.timer("index"):
+            DB_CONNECTOR.build_search_index()
+        t2 = time.perf_counter()
+    finally:
+        server.terminate()
+        server.join()
+
+    latencies = METRICS.histogram()
+    written = METRICS.total("items")
+    database_time = sum(METRICS.seconds(stage) for stage in ("upsert", "mark_seen", "commit", "finish", "match"))
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 if sys.platform != "darwin" else 1024**2)
+
+    print(f"stores          {', '.join(finished)}")
+    print(f"items           {written}")
+    print(f"items/s         {written / (t2 - t1):.1f}")
+    print(f"requests        {latencies.count}")
+    print(f"latency p50     {latencies.quantile(0.5) * 1e3:.1f} ms")
+    print(f"latency p99     {latencies.quantile(0.99) * 1e3:.1f} ms")
+    print(f"database time   {database_time:.2f} s")
+    print(f"total time      {t2 - t1:.2f} s")
+    print(f"peak RSS        {peak_rss:.1f} MiB")
+    METRICS.log_summary()
+    if args.report is not None:
+        METRICS.write_report(args.report, stores=finished, peak_rss_mib=round(peak_rss, 1))
+
+
+if __name__ == "__main__":
+    main()
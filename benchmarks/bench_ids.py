@@ -0,0 +1,100 @@
+"""
+Micro-benchmark of the product id reader.
+
+Compares reading the whole id file into a list, the way the tasks did before etc.ids, against the
+streaming IdSource with and without EAN validation. Reports the time until the first id, the
+total time and the peak memory, over a generated file of EANs with duplicates.
+
+Usage:
+    python -m benchmarks.bench_ids [--ids FILE] [--size N]
+"""
+
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from argparse import ArgumentParser
+
+from etc.ids import IdSource, valid_ean
+
+
+def generate(path: str, size: int) -> None:
+    """
+    Writes a file of comma separated EANs, a tenth of them repeated.
+
+    :param path: The path of the file.\n
+    :param size: The number of EANs.
+
+    :returns: None
+    """
+
+    rng = random.Random(42)
+    eans = []
+    for _ in range(size):
+        code = "474" + "".join(rng.choices("0123456789", k=9))
+        total = sum(int(digit) * (3 if i % 2 == 0 else 1) for i, digit in enumerate(reversed(code)))
+        eans.append(code + str((10 - total % 10) % 10))
+    eans += rng.sample(eans, size // 10)
+    rng.shuffle(eans)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(",".join(eans))
+
+
+def read_list(path: str) -> list:
+    """
+    The reader the tasks used before etc.ids, kept here as the baseline.
+    """
+
+    with open(path, encoding="utf-8") as f:
+        return f.read().split(",")
+
+
+def measure(label: str, ids) -> None:
+    """
+    Prints the time until the first id, the total time and the peak memory of iterating the ids.
+
+    :param label: The name of the measurement.\n
+    :param ids: Returns the iterable of ids.
+
+    :returns: None
+    """
+
+    t1 = time.perf_counter()
+    first = None
+    count = 0
+    for _ in ids():
+        if first is None:
+            first = time.perf_counter() - t1
+        count += 1
+    t2 = time.perf_counter()
+
+    # Tracing slows every allocation down, so the memory is measured in a second pass.
+    tracemalloc.start()
+    for _ in ids():
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<24} {count:>9} ids   first {first * 1e3:8.2f} ms   total {t2 - t1:6.2f} s   peak {peak / 1024**2:7.1f} MiB")
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("--ids", help="A file of comma or newline separated ids", required=False)
+    argparser.add_argument("--size", help="The number of generated EANs", type=int, default=1_000_000)
+    args = argparser.parse_args()
+
+    path = args.ids
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), "eans.txt")
+        generate(path, args.size)
+    print(f"{path}, {os.path.getsize(path) / 1024**2:.1f} MiB")
+
+    measure("list", lambda: read_list(path))
+    measure("IdSource", lambda: IdSource(path))
+    measure("IdSource, valid_ean", lambda: IdSource(path, validator=valid_ean))
+
+
+if __name__ == "__main__":
+    main()
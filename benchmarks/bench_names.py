@@ -0,0 +1,103 @@
+"""
+Micro-benchmark of the product name normalizer.
+
+Compares the per-item cost of the shared normalizer in etc.names, with a cold and a warm cache,
+against the name parser Prisma used before, over a corpus of product names.
+
+Usage:
+    python -m benchmarks.bench_names [--names FILE] [--size N] [--unique N]
+"""
+
+import random
+import re
+import time
+from argparse import ArgumentParser
+
+from etc.names import parse_name
+
+WORDS = [
+    "Piim", "Jogurt", "Juust", "Leib", "Sai", "Õlu", "Siider", "Kohv", "Tee", "Šokolaad", "Jäätis",
+    "Vorst", "Sink", "Kana", "Mahl", "Vesi", "Kartul", "Tomat", "Ben &amp; Jerry´s", "Alma", "Tere",
+    "Saku", "A. Le Coq", "Premium", "Mahe", "Rimi", "Laktoosivaba", "Kreeka", "Maasika", "Vanilje",
+]
+SIZES = ["1 l", "0,5L", "500g", "2,5% 1 l", "10 tk", "3x110ml", "400 g", "1,5 kg", "", "330 ml"]
+
+
+def corpus(size: int, unique: int) -> list:
+    """
+    Builds a corpus of product names, repeating unique names like a real catalogue does.
+
+    :param size: The number of names.\n
+    :param unique: The number of distinct names.
+
+    :returns: The list of names.
+    """
+
+    rng = random.Random(42)
+    names = [
+        f"{' '.join(rng.sample(WORDS, rng.randint(1, 4)))} {rng.choice(SIZES)}".strip()
+        for _ in range(unique)
+    ]
+    return [rng.choice(names) for _ in range(size)]
+
+
+def old_name_parser(product_name: str) -> str:
+    """
+    The name parser Prisma used before etc.names, kept here as the baseline.
+    """
+
+    regex: str = r",? \d{1,4}?\d? ?(g|kg|ml|l|/|tk|€|x|×|,)"
+    invalid_chars: dict = {"´": "'", "`": "'", "  ": " ", "amp;": ""}
+
+    for char, replacement in invalid_chars.items():
+        product_name: str = product_name.replace(char, replacement)
+
+    if re.search(regex, product_name, flags=re.IGNORECASE):
+        product_name: str = re.split(regex, product_name, flags=re.IGNORECASE)[0]
+
+    return product_name.title()
+
+
+def measure(label: str, function, names: list) -> None:
+    """
+    Prints the per-item cost of running the function over the names.
+
+    :param label: The name of the measurement.\n
+    :param function: The function to measure.\n
+    :param names: The names to run it over.
+
+    :returns: None
+    """
+
+    t1 = time.perf_counter()
+    for name in names:
+        function(name)
+    t2 = time.perf_counter()
+    print(f"{label:<24} {(t2 - t1) / len(names) * 1e6:8.3f} µs per item")
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("--names", help="A file with one product name per line", required=False)
+    argparser.add_argument("--size", help="The number of names in the corpus", type=int, default=200_000)
+    argparser.add_argument("--unique", help="The number of distinct names in the corpus", type=int, default=20_000)
+    args = argparser.parse_args()
+
+    if args.names is not None:
+        with open(args.names, encoding="utf-8") as f:
+            names = [line.strip() for line in f if line.strip()]
+    else:
+        names = corpus(args.size, args.unique)
+
+    print(f"{len(names)} names, {len(set(names))} distinct")
+    measure("old parser", old_name_parser, names)
+    parse_name.cache_clear()
+    measure("parse_name, cold cache", parse_name, names)
+    measure("parse_name, warm cache", parse_name, names)
+    parse_name.cache_clear()
+    measure("parse_name, no cache", parse_name.__wrapped__, names)
+
+
+if __name__ == "__main__":
+    main()
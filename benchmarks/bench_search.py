@@ -0,0 +1,115 @@
+"""
+Micro-benchmark of the product search index.
+
+Builds the index in etc.search over a corpus of product names, saves and loads it and times
+queries with exact words, prefixes, missing diacritics and typos. The names are generated from a
+vocabulary of made-up words, drawn with a Zipf distribution like the words of a real catalogue,
+unless a file of names is given.
+
+Usage:
+    python -m benchmarks.bench_search [--names FILE] [--size N] [--queries N]
+"""
+
+import os
+import random
+import statistics
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from etc.search import SearchIndex, fold
+
+SYLLABLES = ["ka", "le", "mi", "so", "tu", "põ", "rä", "ši", "kü", "ja", "vo", "nu", "ör", "sa", "pe", "ži", "lo", "ta"]
+BRANDS = ["Alma", "Tere", "Farmi", "Saku", "A. Le Coq", "Rimi", "Selver", "Kalev", "Balsnack", "N/A"]
+
+
+def corpus(size: int, vocabulary: int) -> list:
+    """
+    Builds a corpus of product names from made-up words, common words are used far more often.
+
+    :param size: The number of names.\n
+    :param vocabulary: The number of distinct words.
+
+    :returns: The list of names.
+    """
+
+    rng = random.Random(42)
+    dictionary = list(
+        dict.fromkeys(
+            "".join(rng.choices(SYLLABLES, k=rng.randint(2, 5))).capitalize() for _ in range(vocabulary * 2)
+        )
+    )[:vocabulary]
+    weights = [1 / rank for rank in range(1, len(dictionary) + 1)]
+    return [" ".join(rng.choices(dictionary, weights, k=rng.randint(2, 5))) for _ in range(size)]
+
+
+def queries(names: list, size: int) -> list:
+    """
+    Builds queries from the words of the names, some cut short, folded or misspelled.
+
+    :param names: The product names.\n
+    :param size: The number of queries.
+
+    :returns: The list of queries.
+    """
+
+    rng = random.Random(7)
+    built = []
+    for _ in range(size):
+        query_words = rng.choice(names).split()[: rng.randint(1, 2)]
+        word = query_words[-1]
+        kind = rng.random()
+        if kind < 0.25 and len(word) > 3:
+            query_words[-1] = word[: rng.randint(2, len(word) - 1)]
+        elif kind < 0.5:
+            query_words[-1] = fold(word)
+        elif kind < 0.75 and len(word) > 4:
+            i = rng.randrange(1, len(word) - 1)
+            query_words[-1] = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+        built.append(" ".join(query_words))
+    return built
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("--names", help="A file with one product name per line", required=False)
+    argparser.add_argument("--size", help="The number of generated products", type=int, default=20_000)
+    argparser.add_argument("--vocabulary", help="The number of distinct generated words", type=int, default=8_000)
+    argparser.add_argument("--queries", help="The number of queries", type=int, default=5_000)
+    args = argparser.parse_args()
+
+    if args.names is not None:
+        with open(args.names, encoding="utf-8") as f:
+            names = [line.strip() for line in f if line.strip()]
+    else:
+        names = corpus(args.size, args.vocabulary)
+    rng = random.Random(42)
+    products = [(i, name, rng.choice(BRANDS), rng.uniform(0, 40)) for i, name in enumerate(names)]
+
+    t1 = time.perf_counter()
+    index = SearchIndex.build(products)
+    t2 = time.perf_counter()
+    path = os.path.join(tempfile.mkdtemp(), "search.pickle")
+    index.save(path)
+    t3 = time.perf_counter()
+    index = SearchIndex.load(path)
+    t4 = time.perf_counter()
+
+    print(f"{len(index)} products, {len(index.vocabulary)} words, {os.path.getsize(path) / 1024**2:.1f} MiB on disk")
+    print(f"build           {(t2 - t1) * 1e3:8.1f} ms")
+    print(f"save            {(t3 - t2) * 1e3:8.1f} ms")
+    print(f"load            {(t4 - t3) * 1e3:8.1f} ms")
+
+    times = []
+    for query in queries(names, args.queries):
+        t1 = time.perf_counter()
+        index.search(query)
+        times.append(time.perf_counter() - t1)
+    times.sort()
+    print(f"query p50       {statistics.median(times) * 1e3:8.3f} ms")
+    print(f"query p99       {times[int(len(times) * 0.99)] * 1e3:8.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the columnar snapshot.
+
+Writes a snapshot of generated products with etc.snapshot, maps it and aggregates the mean price
+per store and category straight from the columns, without unpacking rows. Reports the write time,
+the file size, the time to open it and the time of the scan.
+
+Usage:
+    python -m benchmarks.bench_snapshot [--rows N]
+"""
+
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+
+from etc.snapshot import PRODUCTS_SCHEMA, Snapshot, SnapshotWriter
+
+STORES = ["Selver", "Prisma", "Rimi", "Coop", "Maxima"]
+CATEGORIES = ["Piimatooted", "Munad", "Leib", "Liha", "Joogid", "Maiustused", "Puuviljad", "Juust", "Kala", "Olmekeemia"]
+
+
+def rows(size: int):
+    """
+    Generates product rows in the order of PRODUCTS_SCHEMA.
+
+    :param size: The number of rows.
+
+    :returns: An iterator over the rows.
+    """
+
+    rng = random.Random(42)
+    for i in range(size):
+        store = rng.choice(STORES)
+        yield (
+            4740000000000 + i, store, f"Toode {i}", "N/A", rng.choice(CATEGORIES), round(rng.uniform(0.2, 20), 2),
+            None, i % 7 == 0, False, "1 kg", f"https://example.ee/{i}", f"https://example.ee/{i}.jpg", "",
+        )
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("--rows", help="The number of generated products", type=int, default=1_000_000)
+    args = argparser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "products.snapshot")
+    t1 = time.perf_counter()
+    writer = SnapshotWriter(path)
+    writer.extend("products", PRODUCTS_SCHEMA, rows(args.rows))
+    writer.close()
+    t2 = time.perf_counter()
+
+    # The rows the writer held are gone, only the mapped file counts from here on.
+    del writer
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t3 = time.perf_counter()
+    snapshot = Snapshot(path)
+    products = snapshot["products"]
+    t4 = time.perf_counter()
+
+    stores, categories = products.column("store"), products.column("category")
+    prices = products.column("price")
+    width = len(categories.dictionary)
+    sums = [0.0] * (len(stores.dictionary) * width)
+    counts = [0] * len(sums)
+    for store, category, price in zip(stores.codes, categories.codes, prices):
+        sums[store * width + category] += price
+        counts[store * width + category] += 1
+    t5 = time.perf_counter()
+
+    scale = 1024 if sys.platform != "darwin" else 1024**2
+    print(f"rows            {len(products)}")
+    print(f"size            {os.path.getsize(path) / 1024**2:.1f} MiB, {os.path.getsize(path) / len(products):.1f} bytes per row")
+    print(f"write           {t2 - t1:.2f} s")
+    print(f"open            {(t4 - t3) * 1e3:.2f} ms")
+    print(f"scan            {t5 - t4:.2f} s, {len(products) / (t5 - t4) / 1e6:.1f} M rows/s")
+    print(f"peak RSS        {rss / scale:.1f} MiB while writing")
+    for store, name in enumerate(stores.dictionary):
+        means = [sums[store * width + c] / counts[store * width + c] for c in range(width) if counts[store * width + c]]
+        print(f"{name:<8} mean price over categories {sum(means) / len(means):.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Startup benchmark of the command line entry.
+
+Times fresh interpreters importing the modules and running main.py without scraping, --help and a
+dummy --finalize on the in-memory database, so neither connects to MySQL. Optionally lists the
+modules whose import takes the longest, from python -X importtime.
+
+Usage:
+    python -m benchmarks.bench_startup [--repeat N] [--imports N]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+COMMANDS = {
+    "interpreter": ["-c", "pass"],
+    "import etc.data": ["-c", "import etc.data"],
+    "import stores": ["-c", "import prisma, selver"],
+    "main.py --help": ["main.py", "--help"],
+    "main.py --dummy --finalize": ["main.py", "--dummy", "--finalize", "--run-id", str(int(time.time()))],
+}
+
+
+def measure(label: str, arguments: list, repeat: int) -> None:
+    """
+    Prints the minimum and median wall time of running the interpreter with the arguments.
+
+    :param label: The name of the measurement.\n
+    :param arguments: The arguments of the interpreter.\n
+    :param repeat: The number of runs.
+
+    :returns: None
+    """
+
+    env = {**os.environ, "DATABASE_BACKEND": "memory"}
+    times = []
+    for _ in range(repeat):
+        t1 = time.perf_counter()
+        subprocess.run([sys.executable, *arguments], env=env, check=True, capture_output=True)
+        times.append(time.perf_counter() - t1)
+    print(f"{label:<28} min {min(times) * 1e3:7.1f} ms   median {statistics.median(times) * 1e3:7.1f} ms")
+
+
+def slowest_imports(module: str, count: int) -> None:
+    """
+    Prints the modules whose import, with everything it imports, takes the longest.
+
+    :param module: The module to import.\n
+    :param count: The number of modules to print.
+
+    :returns: None
+    """
+
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"], check=True, capture_output=True, text=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        rows.append((int(cumulative), name))
+
+    print(f"\nslowest imports of {module}")
+    for cumulative, name in sorted(rows, reverse=True)[:count]:
+        print(f"{name:<40} {cumulative / 1e3:7.1f} ms")
+
+
+def main() -> None:
+    """Runs the benchmark."""
+    argparser = ArgumentParser()
+    argparser.add_argument("--repeat", help="The number of runs of every command", type=int, default=10)
+    argparser.add_argument("--imports", help="Also list the N slowest imports of main.py", type=int, default=0)
+    args = argparser.parse_args()
+
+    for label, arguments in COMMANDS.items():
+        measure(label, arguments, args.repeat)
+    if args.imports:
+        slowest_imports("main", args.imports)
+
+
+if __name__ == "__main__":
+    main()
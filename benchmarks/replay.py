@@ -0,0 +1,133 @@
+"""
+Local stand-in for the store APIs that replays a fixture archive.
+
+Serves the responses recorded with `python main.py --record FILE`, with an artificial latency,
+a share of failing requests and an optional request rate above which it throttles with 429s.
+Point the scrapers at it with `python main.py --replay http://127.0.0.1:8080`.
+
+Usage:
+    python -m benchmarks.replay FILE [--port N] [--latency S] [--jitter S] [--error-rate P] [--rate N]
+"""
+
+import asyncio
+import random
+import time
+from argparse import ArgumentParser
+
+from aiohttp import web
+
+from etc.fixtures import FixtureArchive
+
+
+class ReplayServer:
+    """
+    Replays the responses of a fixture archive.
+
+    :param path: The path of the fixture archive.\n
+    :param latency: The mean time in seconds before a response is sent.\n
+    :param jitter: The maximum random time in seconds added to or taken from the latency.\n
+    :param error_rate: The share of requests answered with a 503.\n
+    :param rate: The number of requests per second above which requests are answered with a 429, 0 for no limit.\n
+    :param seed: The seed of the random latencies and errors.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        rate: float = 0.0,
+        seed: int = 42,
+    ) -> None:
+        self.archive: FixtureArchive = FixtureArchive(path)
+        self.latency: float = latency
+        self.jitter: float = jitter
+        self.error_rate: float = error_rate
+        self.rate: float = rate
+        self.random: random.Random = random.Random(seed)
+        self.tokens: float = rate
+        self.updated: float = time.monotonic()
+        self.served: int = 0
+
+    def application(self) -> web.Application:
+        """
+        Returns the aiohttp application serving the archive.
+
+        :returns: The application.
+        """
+
+        app = web.Application()
+        app.router.add_get("/{key}", self.__handle)
+        return app
+
+    async def __handle(self, request: web.Request) -> web.Response:
+        key = request.match_info["key"]
+        if key not in self.archive:
+            return web.Response(status=404)
+
+        if self.rate and not self.__take_token():
+            return web.Response(status=429, headers={"Retry-After": "1"})
+
+        delay = self.latency + self.random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.random.random() < self.error_rate:
+            return web.Response(status=503)
+
+        self.served += 1
+        status, content_type, body = self.archive.get(key)
+        return web.Response(status=status, body=body, content_type=content_type)
+
+    def __take_token(self) -> bool:
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def serve(path: str, host: str = "127.0.0.1", port: int = 8080, **options) -> None:
+    """
+    Serves a fixture archive until interrupted.
+
+    :param path: The path of the fixture archive.\n
+    :param host: The host to listen on.\n
+    :param port: The port to listen on.\n
+    :param options: The options of ReplayServer.
+
+    :returns: None
+    """
+
+    server = ReplayServer(path, **options)
+    print(f"Replaying {len(server.archive)} responses on http://{host}:{port}", flush=True)
+    web.run_app(server.application(), host=host, port=port, print=None)
+
+
+def main() -> None:
+    """Runs the replay server."""
+    argparser = ArgumentParser()
+    argparser.add_argument("path", help="The fixture archive recorded with main.py --record")
+    argparser.add_argument("--host", help="The host to listen on", default="127.0.0.1")
+    argparser.add_argument("--port", help="The port to listen on", type=int, default=8080)
+    argparser.add_argument("--latency", help="The mean latency in seconds", type=float, default=0.05)
+    argparser.add_argument("--jitter", help="The maximum random latency added or taken", type=float, default=0.02)
+    argparser.add_argument("--error-rate", help="The share of requests failing with a 503", type=float, default=0.0)
+    argparser.add_argument("--rate", help="Requests per second before throttling with 429s", type=float, default=0.0)
+    args = argparser.parse_args()
+
+    serve(
+        args.path,
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate=args.rate,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+This module contains the on-disk response cache used for incremental scraping.
+
+Classes:
+    ResponseCache: Remembers the validators and content hash of every response so unchanged products can be skipped.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import typing
+
+# Returned by request_page when the response hasn't changed since the last run.
+NOT_MODIFIED = object()
+
+CACHE_PATH = "resources/cache/responses.sqlite3"
+
+
+class ResponseCache:
+    """
+    Remembers the validators and content hash of every response so unchanged products can be skipped.
+
+    New hashes are only staged when a response is read and are written to disk by commit, which
+    the pipeline calls once the products of the response have been committed to the database.
+    A run that dies halfway therefore never marks a product as unchanged that was never saved.
+    The (ean, store) keys of those products are stored alongside, so a run that skips a response
+    can still mark its products as seen.
+
+    :param path: The path of the cache file.\n
+    :param refresh: Treat every response as changed, but still record it for the next run.
+    """
+
+    def __init__(self, path: str = CACHE_PATH, refresh: bool = False) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Shards share the file, the journal lets them read while another one writes.
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=30)
+        self.connection.execute("PRAGMA journal_mode = WAL;")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            digest BLOB,
+            keys TEXT
+            );
+            """
+        )
+        if "keys" not in [column[1] for column in self.connection.execute("PRAGMA table_info(responses);")]:
+            self.connection.execute("ALTER TABLE responses ADD COLUMN keys TEXT;")
+        self.refresh: bool = refresh
+        self.pending: typing.Dict[str, tuple] = {}
+        self.unchanged: int = 0
+        self.logger: logging.Logger = logging.getLogger("cache")
+
+    def __entry(self, url: str) -> typing.Optional[tuple]:
+        return self.connection.execute(
+            "SELECT etag, last_modified, digest FROM responses WHERE url = ?;", (url,)
+        ).fetchone()
+
+    def keys(self, url: str) -> typing.List[tuple]:
+        """
+        Returns the keys of the products the url returned when it was last committed.
+
+        :param url: The requested url.
+
+        :returns: A list of (ean, store) tuples.
+        """
+
+        row = self.connection.execute("SELECT keys FROM responses WHERE url = ?;", (url,)).fetchone()
+        return [tuple(key) for key in json.loads(row[0])] if row and row[0] else []
+
+    def conditional_headers(self, url: str) -> typing.Dict[str, str]:
+        """
+        Returns the headers that make the request conditional on the response having changed.
+
+        :param url: The url to request.
+
+        :returns: The If-None-Match and If-Modified-Since headers, if known.
+        """
+
+        if self.refresh or (entry := self.__entry(url)) is None:
+            return {}
+
+        headers = {}
+        if entry[0]:
+            headers["If-None-Match"] = entry[0]
+        if entry[1]:
+            headers["If-Modified-Since"] = entry[1]
+        return headers
+
+    def changed(self, url: str, body: bytes, headers: typing.Mapping[str, str]) -> bool:
+        """
+        Checks if the response differs from the last run and stages it if it does.
+
+        :param url: The requested url.\n
+        :param body: The body of the response.\n
+        :param headers: The headers of the response.
+
+        :returns: True if the response changed, False otherwise.
+        """
+
+        digest = hashlib.blake2b(body, digest_size=16).digest()
+        entry = (headers.get("ETag"), headers.get("Last-Modified"), digest)
+        previous = self.__entry(url)
+
+        if self.refresh or previous is None or previous[2] != digest:
+            self.pending[url] = entry
+            return True
+
+        if previous != entry:
+            # Same content under new validators, safe to update right away.
+            self.connection.execute(
+                "UPDATE responses SET etag = ?, last_modified = ? WHERE url = ?;", (entry[0], entry[1], url)
+            )
+            self.connection.commit()
+        self.unchanged += 1
+        return False
+
+    def not_modified(self) -> None:
+        """
+        Records that the host answered 304 Not Modified.
+
+        :returns: None
+        """
+
+        self.unchanged += 1
+
+    def commit(self, responses: typing.Iterable[typing.Tuple[str, typing.List[tuple]]]) -> None:
+        """
+        Writes the staged entries of the urls to disk.
+
+        :param responses: (url, keys) pairs of the responses whose products have been committed to the database.
+
+        :returns: None
+        """
+
+        entries = [
+            (url, *self.pending.pop(url), json.dumps(keys))
+            for url, keys in responses
+            if url in self.pending
+        ]
+        if entries:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses (url, etag, last_modified, digest, keys) VALUES (?, ?, ?, ?, ?);",
+                entries,
+            )
+            self.connection.commit()
+
+    def close(self) -> None:
+        """
+        Closes the cache file, staged entries that were never committed are dropped.
+
+        :returns: None
+        """
+
+        if self.unchanged:
+            self.logger.info("%s responses were unchanged since the last run.", self.unchanged)
+        self.connection.close()
@@ -1,143 +1,125 @@
-categories = [
-    {
-        "category": "Mahlad ja joogid",
-        "sub-categories": [
-            "Mahlad ja -kontsentraadid, siirupid",
-            "Muud joogid",
-            "Alkoholivabad joogid",
-            "Energiajoogid",
-            "Kakaod, kakaojoogid",
-            "Karastusjoogid, toonikud",
-            "Kohvid",
-            "Smuutid, värsked mahlad",
-            "Spordijoogid",
-        ],
-    },
-    {
-        "category": "Alkohoolsed joogid",
-        "sub-categories": [
-            "Long Drink",
-            "Siider",
-            "Ölled",
-            "Kange Alkohol",
-            "Džinnid",
-            "Konjakid, brändid",
-            "Liköörid",
-            "Liköörveinid",
-            "Muud kanged alkohoolsed joogid",
-            "Punased veinid",
-            "Roosad veinid",
-            "Rummid",
-            "Õlled, siidrid, segud, kokteilid",
-            "Šampanjad, vahuveinid",
-        ],
-    },
-    {
-        "category": "Juust",
-        "sub-categories": ["Juust", "Delikatessjuustud", "Juustud", "Määrdejuustud"],
-    },
-    {
-        "category": "Külmutatud ja jahedad tooted",
-        "sub-categories": [
-            "KÜlmutatud Tooted",
-            "Jahutatud valmistoidud",
-            "Jogurtid, jogurtijoogid",
-            "Jäätised",
-            "Kohukesed",
-            "Kohupiimad, kodujuustud",
-            "Külmutatud liha- ja kalatooted",
-            "Külmutatud köögiviljad, marjad, puuviljad",
-            "Külmutatud tainad ja kondiitritooted",
-            "Külmutatud valmistooted",
-        ],
-    },
-    {
-        "category": "Kuivained",
-        "sub-categories": [
-            "Kuivained",
-            "Paja- ja nuudliroad",
-            "Hommikuhelbed, müslid, kiirpudrud",
-            "Jahud",
-            "Kuivsupid ja -kastmed",
-            "Leivad",
-            "Maitseained",
-            "Makaronid",
-            "Näkileivad",
-            "Pähklid ja kuivatatud puuviljad",
-            "Riisid",
-            "Saiad",
-            "Saiakesed, stritslid, kringlid",
-            "Sepikud, kuklid, lavašid",
-            "Sipsid",
-            "Puljongid",
-        ],
-    },
-    {
-        "category": "Margariinid Ja õlid",
-        "sub-categories": ["Margariinid Ja õlid", "Võid, margariinid", "Õlid, äädikad"],
-    },
-    {
-        "category": "Viljad ja muud värsked tooted",
-        "sub-categories": [
-            "Puu  Ja Juurviljad",
-            "Köögiviljad, juurviljad",
-            "Maitsetaimed, värsked salatid, piprad",
-            "Salatid",
-            "Seened",
-            "Õunad, pirnid",
-        ],
-    },
-    {"category": "Munad", "sub-categories": ["Munad"]},
-    {
-        "category": "Piimatooted",
-        "sub-categories": ["Piimatooted", "Suupisted (Piim)", "Piimad, koored"],
-    },
-    {
-        "category": "Lihad ja kalatooted",
-        "sub-categories": [
-            "Grillvorstid, verivorstid",
-            "Hakkliha",
-            "Keedu- ja suitsuvorstid, viinerid",
-            "Linnuliha",
-            "Muud kalatooted",
-            "Muud lihatooted",
-            "Sealiha",
-            "Singid, rulaadid",
-            "Soolatud ja suitsutatud kalatooted",
-            "Sushi",
-        ],
-    },
-    {
-        "category": "Hoidised",
-        "sub-categories": [
-            "Hoidised",
-            "Ketšupid, tomatipastad, kastmed",
-            "Majoneesid, sinepid",
-        ],
-    },
-    {
-        "category": "Kommid ja muud magusad",
-        "sub-categories": [
-            "Kommikarbid",
-            "Kommipakid",
-            "Koogid, rullbiskviidid, tainad",
-            "Küpsised",
-            "Magusad hoidised",
-            "Magustoidud",
-            "Maiustused, küpsised, näksid",
-            "Muud magustoidud",
-            "Muud maiustused",
-            "Šokolaadid",
-        ],
-    },
-    {"category": "Lastetoidud", "sub-categories": ["Lastetoidud"]},
-    {"category": "Maailma köök", "sub-categories": ["Maailma köök"]},
-]
-
-
-def category_parser(prod_category):
-    for item in categories:
-        for category in item["sub-categories"]:
-            if prod_category == category:
-                return item["category"]
+"""
+This module contains the category index used to map store categories to our categories.
+
+The mapping is loaded from resources/categories.json: "categories" maps every category to the
+sub-categories the stores use for it and "aliases" holds per-store labels that differ from them.
+Labels are normalized (Unicode NFKC, casefolded, whitespace collapsed) before they are looked up,
+so "KÜlmutatud Tooted" and "Puu  Ja Juurviljad" match like any other label.
+
+Functions:
+    normalize_label: Normalizes a category label into an index key.
+    load_categories: Loads the category mapping and builds the index.
+    category_parser: Returns the category of a store category.
+    unmapped_categories: Returns and resets the labels that couldn't be mapped.
+"""
+
+import collections
+import functools
+import json
+import os
+import re
+import typing
+import unicodedata
+
+CATEGORY_FILE = os.path.join(os.path.dirname(__file__), "..", "resources", "categories.json")
+
+WHITESPACE = re.compile(r"\s+")
+NOT_ALPHANUMERIC = re.compile(r"[\W_]+")
+
+categories: typing.List[dict] = []
+index: typing.Dict[str, str] = {}
+store_index: typing.Dict[str, typing.Dict[str, str]] = {}
+loose_index: typing.Dict[str, str] = {}
+unmapped: typing.Dict[str, collections.Counter] = collections.defaultdict(collections.Counter)
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_label(label: str) -> str:
+    """
+    Normalizes a category label into an index key.
+
+    :param label: The category label.
+
+    :returns: The label, NFKC normalized, casefolded and with its whitespace collapsed.
+    """
+
+    return WHITESPACE.sub(" ", unicodedata.normalize("NFKC", label).casefold()).strip()
+
+
+def _loose_label(label: str) -> str:
+    # Drops the diacritics and punctuation as well, only used when the exact key is unknown.
+    decomposed = unicodedata.normalize("NFKD", normalize_label(label))
+    return NOT_ALPHANUMERIC.sub("", "".join(c for c in decomposed if not unicodedata.combining(c)))
+
+
+def load_categories(path: str = CATEGORY_FILE) -> None:
+    """
+    Loads the category mapping and builds the index.
+
+    :param path: The path of the category file.
+
+    :returns: None
+    """
+
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+
+    categories[:] = [
+        {"category": category, "sub-categories": sub_categories}
+        for category, sub_categories in data["categories"].items()
+    ]
+    # Only the sub-categories are labels of the stores, a label that happens to be one of our
+    # categories isn't mapped to it unless it is listed as a sub-category too.
+    index.clear()
+    for category, sub_categories in data["categories"].items():
+        for label in sub_categories:
+            index.setdefault(normalize_label(label), category)
+
+    store_index.clear()
+    for store, aliases in data.get("aliases", {}).items():
+        store_index[store.casefold()] = {normalize_label(label): category for label, category in aliases.items()}
+
+    loose_index.clear()
+    loose_index.update({_loose_label(label): category for label, category in index.items()})
+    _fallback.cache_clear()
+
+
+@functools.lru_cache(maxsize=4096)
+def _fallback(label: str) -> typing.Optional[str]:
+    return loose_index.get(_loose_label(label))
+
+
+def category_parser(prod_category: str, store: str = None) -> str:
+    """
+    Returns the category of a store category.
+
+    :param prod_category: The category label of the store.\n
+    :param store: The name of the store, its aliases are checked first.
+
+    :returns: The category, or "N/A" if the label isn't mapped.
+    """
+
+    key = normalize_label(prod_category)
+    if store is not None and (category := store_index.get(store.casefold(), {}).get(key)) is not None:
+        return category
+
+    if (category := index.get(key) or _fallback(key)) is not None:
+        return category
+
+    unmapped[store or "N/A"][prod_category] += 1
     return "N/A"
+
+
+def unmapped_categories(store: str = None) -> collections.Counter:
+    """
+    Returns and resets the labels that couldn't be mapped.
+
+    :param store: The name of the store.
+
+    :returns: A counter of the unmapped labels and the number of products they had.
+    """
+
+    return unmapped.pop(store or "N/A", collections.Counter())
+
+
+load_categories()
@@ -0,0 +1,121 @@
+"""
+This module contains the on-disk checkpoint that lets a run that died halfway be resumed.
+
+Classes:
+    Checkpoint: Remembers the run and the requests whose products have been committed, so a resumed run skips them.
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import typing
+
+# The default state file, every shard of a sharded run has its own next to it.
+CHECKPOINT_PATH = "resources/state/checkpoint.sqlite3"
+
+
+class Checkpoint:
+    """
+    Remembers the run and the requests whose products have been committed, so a resumed run skips them.
+
+    A request is only checkpointed once the batch holding its products has been committed to the
+    database, the same way the response cache is committed, so a crash never skips a request whose
+    products weren't saved. A resumed run reuses the run id of the checkpoint, the products the
+    first attempt saved are then still seen by the run and finish_run keeps them.
+
+    :param path: The path of the state file.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.connection: sqlite3.Connection = sqlite3.connect(path)
+        # A checkpoint is written after every batch, the journal keeps that cheap.
+        self.connection.execute("PRAGMA journal_mode = WAL;")
+        self.connection.execute("PRAGMA synchronous = NORMAL;")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS run (key TEXT PRIMARY KEY, value INTEGER);")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS requests (store TEXT, digest BLOB, PRIMARY KEY (store, digest)) WITHOUT ROWID;"
+        )
+        self.completed: typing.Dict[str, typing.Set[bytes]] = {}
+        self.logger: logging.Logger = logging.getLogger("checkpoint")
+
+    @property
+    def run_id(self) -> typing.Optional[int]:
+        """
+        The id of the run the checkpoint belongs to, None if there is no unfinished run.
+        """
+
+        row = self.connection.execute("SELECT value FROM run WHERE key = 'run_id';").fetchone()
+        return row[0] if row else None
+
+    def start(self, run_id: int) -> None:
+        """
+        Starts a new run, forgetting the checkpoint of the previous one.
+
+        :param run_id: The id of the new run.
+
+        :returns: None
+        """
+
+        self.connection.execute("DELETE FROM requests;")
+        self.connection.execute("INSERT OR REPLACE INTO run (key, value) VALUES ('run_id', ?);", (run_id,))
+        self.connection.commit()
+        self.completed.clear()
+
+    def done(self, store: str, url: str) -> bool:
+        """
+        Checks if the products of a request have already been committed in this run.
+
+        :param store: The name of the store.\n
+        :param url: The url of the request.
+
+        :returns: True if the request can be skipped, False otherwise.
+        """
+
+        if store not in self.completed:
+            self.completed[store] = {
+                row[0] for row in self.connection.execute("SELECT digest FROM requests WHERE store = ?;", (store,))
+            }
+        return self.__digest(url) in self.completed[store]
+
+    def commit(self, store: str, urls: typing.Iterable[str]) -> None:
+        """
+        Checkpoints requests whose products have been committed to the database.
+
+        :param store: The name of the store.\n
+        :param urls: The urls of the requests.
+
+        :returns: None
+        """
+
+        self.connection.executemany(
+            "INSERT OR IGNORE INTO requests (store, digest) VALUES (?, ?);",
+            ((store, self.__digest(url)) for url in urls),
+        )
+        self.connection.commit()
+
+    def finish(self) -> None:
+        """
+        Forgets the checkpoint once the run has finished, there is nothing left to resume.
+
+        :returns: None
+        """
+
+        self.connection.execute("DELETE FROM requests;")
+        self.connection.execute("DELETE FROM run;")
+        self.connection.commit()
+        self.completed.clear()
+
+    def close(self) -> None:
+        """
+        Closes the state file.
+
+        :returns: None
+        """
+
+        self.connection.close()
+
+    @staticmethod
+    def __digest(url: str) -> bytes:
+        return hashlib.blake2b(url.encode(), digest_size=16).digest()
@@ -0,0 +1,72 @@
+"""
+This module contains the coordinator that runs the scraping tasks.
+
+Classes:
+    Coordinator: Runs every store task concurrently in one event loop with a shared database writer.
+"""
+
+import asyncio
+import logging
+import time
+import typing
+
+from etc.metrics import METRICS
+from etc.pipeline import DatabaseWriter
+from etc.util import stot
+
+
+class Coordinator:
+    """
+    Runs every store task concurrently in one event loop with a shared database writer.
+
+    The stores are independent hosts, so the total time is that of the slowest store instead of
+    the sum of all of them. Every task keeps its own scheduler and connection limits, a task that
+    fails doesn't stop the others.
+
+    :param tasks: The store tasks by store name, every task needs an async run(database_writer) method
+        returning whether every request succeeded.
+    """
+
+    def __init__(self, tasks: typing.Dict[str, typing.Any]) -> None:
+        self.tasks: typing.Dict[str, typing.Any] = tasks
+        self.timings: typing.Dict[str, float] = {}
+        self.logger: logging.Logger = logging.getLogger("coordinator")
+
+    def start(self) -> typing.List[str]:
+        """
+        Runs the tasks until all of them are done.
+
+        :returns: The names of the stores whose task finished.
+        """
+
+        return asyncio.run(self.run())
+
+    async def run(self) -> typing.List[str]:
+        """
+        Runs the tasks in the running event loop until all of them are done.
+
+        :returns: The names of the stores whose task finished.
+        """
+
+        async with DatabaseWriter() as database_writer:
+            finished = await asyncio.gather(
+                *(self.__run_task(store, task, database_writer) for store, task in self.tasks.items())
+            )
+
+        for store, seconds in self.timings.items():
+            self.logger.info("%s done in %s.", store, stot(seconds))
+        return [store for store, ok in zip(self.tasks, finished) if ok]
+
+    async def __run_task(self, store: str, task: typing.Any, database_writer: DatabaseWriter) -> bool:
+        t1 = time.perf_counter()
+        try:
+            if not await task.run(database_writer):
+                self.logger.warning("%s task had failed requests, keeping its products from the last run.", store)
+                return False
+            return True
+        except Exception:  # pylint: disable=broad-except
+            self.logger.exception("%s task failed, keeping its products from the last run.", store)
+            return False
+        finally:
+            self.timings[store] = time.perf_counter() - t1
+            METRICS.observe("task", self.timings[store], store=store)
@@ -1,3 +1,103 @@
-from etc.database import DatabaseConnection
+"""
+This module contains the database connector shared by the scraping tasks and main.
 
-DB_CONNECTOR = DatabaseConnection()
+The connector is only created when it is first used, so importing a scraper, --help and dummy runs
+don't import the MySQL driver or connect. Tests and tools can hand it a connector of their own
+with DB_CONNECTOR.use before that.
+
+Classes:
+    LazyConnector: Stands in for the database connector and creates it on first use.
+
+Functions:
+    offline: Returns whether runs write into the in-memory database instead of MySQL.
+    state_path: Returns where a run keeps a state file.
+"""
+
+import os
+import threading
+import typing
+
+# Offline runs keep their state files here, so replaying fixtures never touches the ones of MySQL runs.
+OFFLINE_STATE_DIR = "resources/offline"
+
+
+def offline() -> bool:
+    """
+    Returns whether runs write into the in-memory database instead of MySQL.
+
+    :returns: True if DATABASE_BACKEND is memory, False otherwise.
+    """
+
+    return os.getenv("DATABASE_BACKEND", "mysql") == "memory"
+
+
+def state_path(path: str) -> str:
+    """
+    Returns where a run keeps a state file, offline runs keep theirs in OFFLINE_STATE_DIR.
+
+    :param path: The path of the file for runs into MySQL.
+
+    :returns: The path.
+    """
+
+    return os.path.join(OFFLINE_STATE_DIR, os.path.basename(path)) if offline() else path
+
+
+def _create_connector() -> typing.Any:
+    # DATABASE_BACKEND=memory runs without MySQL, for the offline benchmarks.
+    if offline():
+        from etc.memory import MemoryDatabase  # pylint: disable=import-outside-toplevel
+
+        return MemoryDatabase()
+
+    from etc.database import DatabaseConnection  # pylint: disable=import-outside-toplevel
+
+    return DatabaseConnection()
+
+
+class LazyConnector:
+    """
+    Stands in for the database connector and creates it on first use.
+
+    Every attribute read or written is passed on to the connector, so it is used exactly like the
+    DatabaseConnection or MemoryDatabase it creates.
+
+    :param factory: Creates the connector.
+    """
+
+    def __init__(self, factory: typing.Callable[[], typing.Any]) -> None:
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_connector", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def use(self, connector: typing.Any) -> None:
+        """
+        Uses a connector instead of creating one.
+
+        :param connector: The connector, like a MemoryDatabase.
+
+        :returns: None
+        """
+
+        object.__setattr__(self, "_connector", connector)
+
+    def get(self) -> typing.Any:
+        """
+        Returns the connector, creating it if it doesn't exist yet.
+
+        :returns: The connector.
+        """
+
+        with self._lock:
+            if self._connector is None:
+                object.__setattr__(self, "_connector", self._factory())
+            return self._connector
+
+    def __getattr__(self, name: str) -> typing.Any:
+        return getattr(self.get(), name)
+
+    def __setattr__(self, name: str, value: typing.Any) -> None:
+        setattr(self.get(), name, value)
+
+
+DB_CONNECTOR = LazyConnector(_create_connector)
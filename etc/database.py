@@ -3,45 +3,389 @@ This module contains the DatabaseConnection object.
 
 Classes:
     DatabaseConnection: DatabaseConnection object used for various actions on the database.
+
+Functions:
+    ca_bundle: Returns the CA bundle the connection to the database is verified with.
 """
 
+import hashlib
 import logging
 import os
+import shutil
+import ssl
+import threading
 import time
-import asyncio
-import aiofiles
-import aiohttp
+import typing
+import urllib.request
 from dotenv import load_dotenv
 import mysql.connector
-from etc.util import swap, diff
+import mysql.connector.pooling
+
+from etc.images import ImageMirror
+from etc.prices import FLAG_DISCOUNT, PriceDrop, PricePoint, price_record
+from etc.product import Product
+from etc.search import SEARCH_INDEX_PATH, SearchIndex
+from etc.snapshot import MATCHES_SCHEMA, PRODUCTS_SCHEMA, SNAPSHOT_PATH, SnapshotWriter
+
+try:
+    import certifi
+except ImportError:
+    certifi = None
+
+# A CA bundle here is used as is, it is only downloaded here if neither certifi nor the system has one.
+CACERT_PATH = "resources/cacert.pem"
+CACERT_URL = "https://curl.se/ca/cacert.pem"
+
+# Maximum number of rows sent to the database in a single statement.
+BULK_SIZE = 500
+
+# Number of product rows read at once when mirroring the images.
+IMAGE_PAGE_SIZE = 1000
+
+# Number of pooled connections, one for the main thread, one for the writer thread and spares.
+POOL_SIZE = 4
+
+PRODUCT_COLUMNS = (
+    "ean", "other_ean", "name", "brand", "category", "image_url", "is_age_restricted",
+    "is_discount", "price", "store", "unit_price", "url", "weight",
+)
+
+UPSERT_PRODUCTS = f"""
+    INSERT INTO Products ({", ".join(PRODUCT_COLUMNS)}, last_seen)
+    VALUES ({", ".join(["%s"] * len(PRODUCT_COLUMNS))}, %s)
+    ON DUPLICATE KEY UPDATE
+    {", ".join(f"{column} = VALUES({column})" for column in PRODUCT_COLUMNS if column not in ("ean", "store"))},
+    last_seen = VALUES(last_seen),
+    disregard = 0
+"""
+
+# The run every unchanged response was last seen in, by the hash of its url. Its products point at
+# it, so marking an unchanged response as seen writes one row instead of one row per product.
+CREATE_REQUESTS = """
+    CREATE TABLE Requests (
+    request BIGINT UNSIGNED NOT NULL PRIMARY KEY,
+    last_seen INT UNSIGNED NOT NULL
+    );
+"""
+
+# Every code a product is known by, its EAN and all of its other EANs, as numbers so that '0047...'
+# and 47... are the same key. The primary key lets matching group the codes straight from the index.
+CREATE_PRODUCT_EANS = """
+    CREATE TABLE ProductEans (
+    ean BIGINT UNSIGNED NOT NULL,
+    product_id BIGINT UNSIGNED NOT NULL,
+    PRIMARY KEY (ean, product_id),
+    KEY product_id (product_id)
+    );
+"""
+
+BACKFILL_PRODUCT_EANS = """
+    INSERT IGNORE INTO ProductEans (ean, product_id)
+    SELECT CAST(ean AS UNSIGNED), ID FROM Products WHERE ean IS NOT NULL AND ean != 0
+    UNION
+    SELECT CAST(other_ean AS UNSIGNED), ID FROM Products
+    WHERE other_ean IS NOT NULL AND other_ean != '' AND other_ean != 0;
+"""
+
+# The codes of an upserted batch are staged per connection and replace the codes of its products.
+STAGE_PRODUCT_EANS = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS ProductEanStage (
+    product_ean BIGINT UNSIGNED NOT NULL,
+    store VARCHAR(64) NOT NULL,
+    ean BIGINT UNSIGNED NOT NULL,
+    KEY product (product_ean, store)
+    );
+"""
+
+INSERT_STAGED_EAN = "INSERT INTO ProductEanStage (product_ean, store, ean) VALUES (%s, %s, %s)"
+
+REPLACE_PRODUCT_EANS_STATEMENTS = (
+    """
+    DELETE pe FROM ProductEans AS pe
+    JOIN Products AS p ON p.ID = pe.product_id
+    JOIN ProductEanStage AS s ON s.product_ean = p.ean AND s.store = p.store;
+    """,
+    """
+    INSERT IGNORE INTO ProductEans (ean, product_id)
+    SELECT s.ean, p.ID FROM ProductEanStage AS s
+    JOIN Products AS p ON p.ean = s.product_ean AND p.store = s.store
+    ORDER BY s.ean, p.ID;
+    """,
+    "DELETE FROM ProductEanStage;",
+)
+
+# Every price a product had, appended only when its price, unit price or flags change. The primary
+# key keeps the records of a product together in run order, so its history is a range of the index.
+CREATE_PRICE_TABLES = (
+    """
+    CREATE TABLE PriceHistory (
+    ean BIGINT UNSIGNED NOT NULL,
+    store VARCHAR(64) NOT NULL,
+    run_id INT UNSIGNED NOT NULL,
+    price_cents INT UNSIGNED NOT NULL,
+    unit_price_cents INT UNSIGNED NULL,
+    flags TINYINT UNSIGNED NOT NULL,
+    PRIMARY KEY (ean, store, run_id)
+    );
+    """,
+    # The last record of every product that is still sold, with the run it changed in.
+    """
+    CREATE TABLE PriceLatest (
+    ean BIGINT UNSIGNED NOT NULL,
+    store VARCHAR(64) NOT NULL,
+    price_cents INT UNSIGNED NOT NULL,
+    unit_price_cents INT UNSIGNED NULL,
+    flags TINYINT UNSIGNED NOT NULL,
+    since INT UNSIGNED NOT NULL,
+    PRIMARY KEY (ean, store),
+    KEY since (since)
+    );
+    """,
+    # The current prices are the first records, as of the run the products were last seen in.
+    f"""
+    INSERT INTO PriceHistory (ean, store, run_id, price_cents, unit_price_cents, flags)
+    SELECT ean, store, last_seen, ROUND(price * 100), ROUND(unit_price * 100), IF(is_discount, {FLAG_DISCOUNT}, 0)
+    FROM Products;
+    """,
+    """
+    INSERT INTO PriceLatest (ean, store, price_cents, unit_price_cents, flags, since)
+    SELECT ean, store, price_cents, unit_price_cents, flags, run_id FROM PriceHistory;
+    """,
+)
+
+# The prices of an upserted batch are staged per connection like its codes.
+STAGE_PRICES = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS PriceStage (
+    ean BIGINT UNSIGNED NOT NULL,
+    store VARCHAR(64) NOT NULL,
+    price_cents INT UNSIGNED NOT NULL,
+    unit_price_cents INT UNSIGNED NULL,
+    flags TINYINT UNSIGNED NOT NULL,
+    PRIMARY KEY (ean, store)
+    );
+"""
+
+INSERT_STAGED_PRICE = (
+    "INSERT INTO PriceStage (ean, store, price_cents, unit_price_cents, flags) VALUES (%s, %s, %s, %s, %s)"
+)
+
+# The products of the unchanged responses of a batch are staged per connection too, every one with
+# the request it was seen in, and then pointed at it with a single update.
+STAGE_SEEN = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS SeenStage (
+    request BIGINT UNSIGNED NOT NULL,
+    ean BIGINT UNSIGNED NOT NULL,
+    store VARCHAR(64) NOT NULL,
+    PRIMARY KEY (ean, store)
+    );
+"""
+
+INSERT_STAGED_SEEN = "INSERT INTO SeenStage (request, ean, store) VALUES (%s, %s, %s)"
+
+UPDATE_SEEN = """
+    UPDATE Products AS p
+    JOIN SeenStage AS s ON s.ean = p.ean AND s.store = p.store
+    SET p.request = s.request
+    WHERE p.request != s.request;
+"""
+
+# Both take the run id: the changed prices are appended and then become the latest ones.
+RECORD_PRICES_STATEMENTS = (
+    """
+    INSERT INTO PriceHistory (ean, store, run_id, price_cents, unit_price_cents, flags)
+    SELECT s.ean, s.store, %s, s.price_cents, s.unit_price_cents, s.flags
+    FROM PriceStage AS s
+    LEFT JOIN PriceLatest AS l ON l.ean = s.ean AND l.store = s.store
+    WHERE l.ean IS NULL OR l.price_cents != s.price_cents OR l.flags != s.flags
+    OR NOT l.unit_price_cents <=> s.unit_price_cents
+    ON DUPLICATE KEY UPDATE
+    price_cents = VALUES(price_cents), unit_price_cents = VALUES(unit_price_cents), flags = VALUES(flags);
+    """,
+    """
+    INSERT INTO PriceLatest (ean, store, price_cents, unit_price_cents, flags, since)
+    SELECT h.ean, h.store, h.price_cents, h.unit_price_cents, h.flags, h.run_id
+    FROM PriceStage AS s
+    JOIN PriceHistory AS h ON h.ean = s.ean AND h.store = s.store AND h.run_id = %s
+    ON DUPLICATE KEY UPDATE
+    price_cents = VALUES(price_cents), unit_price_cents = VALUES(unit_price_cents), flags = VALUES(flags),
+    since = VALUES(since);
+    """,
+)
+
+# Products that changed price since a point in time, against their last record from before it.
+# Both the latest prices and the record before are found through an index, the history isn't scanned.
+PRICE_DROPS = """
+    SELECT l.ean, l.store, b.price_cents, l.price_cents, l.since
+    FROM PriceLatest AS l
+    JOIN PriceHistory AS b ON b.ean = l.ean AND b.store = l.store AND b.run_id = (
+    SELECT MAX(h.run_id) FROM PriceHistory AS h
+    WHERE h.ean = l.ean AND h.store = l.store AND h.run_id < %s
+    )
+    WHERE l.since >= %s AND b.price_cents > l.price_cents
+    ORDER BY (b.price_cents - l.price_cents) / b.price_cents DESC, b.price_cents - l.price_cents DESC
+    LIMIT %s;
+"""
+
+MATCH_STATEMENTS = (
+    "DROP TEMPORARY TABLE IF EXISTS MatchPairs;",
+    # Codes shared by exactly two products, ordered into the cheaper and the more expensive one.
+    """
+    CREATE TEMPORARY TABLE MatchPairs (KEY (cheaper_id), KEY (expensive_id))
+    SELECT DISTINCT
+    IF(b.price < a.price, b.id, a.id) AS cheaper_id,
+    IF(b.price < a.price, a.id, b.id) AS expensive_id,
+    ROUND(ABS(a.price - b.price), 2) AS price_difference_float,
+    COALESCE(ROUND(ABS(a.price - b.price) / ((a.price + b.price) / 2) * 100, 1), 0) AS price_difference_percentage
+    FROM (
+    SELECT MIN(product_id) AS first_id, MAX(product_id) AS second_id
+    FROM ProductEans
+    GROUP BY ean
+    HAVING COUNT(*) = 2
+    ) AS matched
+    JOIN Products AS a ON a.id = matched.first_id
+    JOIN Products AS b ON b.id = matched.second_id;
+    """,
+    """
+    UPDATE Products
+    SET disregard = 0, price_difference_float = 0, price_difference_percentage = 0
+    WHERE disregard != 0 OR price_difference_float != 0 OR price_difference_percentage != 0;
+    """,
+    """
+    UPDATE Products AS p
+    JOIN (
+    SELECT cheaper_id, MAX(price_difference_float) AS price_difference_float,
+    MAX(price_difference_percentage) AS price_difference_percentage
+    FROM MatchPairs
+    GROUP BY cheaper_id
+    ) AS m ON p.id = m.cheaper_id
+    SET p.price_difference_float = m.price_difference_float,
+    p.price_difference_percentage = m.price_difference_percentage;
+    """,
+    """
+    UPDATE Products AS p
+    JOIN MatchPairs AS m ON p.id = m.expensive_id
+    SET p.disregard = 1;
+    """,
+    "DELETE FROM Matches;",
+    """
+    INSERT INTO Matches
+    SELECT ID, EAN, name, brand, category, image_url, is_age_restricted, is_discount,
+    price, store, unit_price, url, weight, other_ean, price_difference_float, price_difference_percentage
+    FROM Products
+    WHERE disregard = 0;
+    """,
+    "DROP TEMPORARY TABLE MatchPairs;",
+)
+
+
+def ca_bundle(path: str = CACERT_PATH) -> str:
+    """
+    Returns the CA bundle the connection to the database is verified with.
 
-load_dotenv()
+    A bundle at path is used first, then the one of certifi if it is installed, then the one of
+    the system. Only if there is none is the bundle downloaded to path.
+
+    :param path: The path of the bundle kept with the project.
+
+    :returns: The path of the bundle.
+    """
+
+    if os.path.exists(path):
+        return path
+    if certifi is not None:
+        return certifi.where()
+    cafile = ssl.get_default_verify_paths().cafile
+    if cafile is not None and os.path.exists(cafile):
+        return cafile
+
+    logging.getLogger("database").info("Downloading the CA bundle to %s.", path)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with urllib.request.urlopen(CACERT_URL, timeout=30) as response, open(f"{path}.tmp", "wb") as f:
+        shutil.copyfileobj(response, f)
+    os.replace(f"{path}.tmp", path)
+    return path
+
+
+def _request_hash(url: str) -> int:
+    return int.from_bytes(hashlib.blake2b(url.encode(), digest_size=8).digest(), "big")
 
 
 class DatabaseConnection:
     """
     DatabaseConnection object used for various actions on the database.
+
+    Connections come from a pool and every thread gets its own, so the database writer thread
+    can write batches while the main thread keeps its connection for everything else.
     """
 
     def __init__(self) -> None:
-        self.connection: mysql.connector.connection.MySQLConnection = (
-            mysql.connector.connect(
-                host=os.getenv("HOST"),
-                database=os.getenv("DATABASE"),
-                user=os.getenv("USER"),
-                password=os.getenv("PASSWORD"),
-                ssl_ca="resources/cacert.pem",
-            )
-        )
-
-        self.cursor: mysql.connector.connection.MySQLCursor = self.connection.cursor()
+        self.__pool: mysql.connector.pooling.MySQLConnectionPool = None
+        self.lock: threading.Lock = threading.Lock()
+        self.local: threading.local = threading.local()
         self.logger: logging.Logger = logging.getLogger("database")
         self.debug: bool = False
         self.dummy: bool = False
+        self.run_id: int = int(time.time())
+        self.search_index: SearchIndex = None
 
         if self.debug:
             self.logger.setLevel(logging.DEBUG)
 
+    @property
+    def pool(self) -> mysql.connector.pooling.MySQLConnectionPool:
+        """
+        The connection pool, it connects on first use so dummy runs and imports never do.
+        """
+
+        with self.lock:
+            if self.__pool is None:
+                load_dotenv()
+                self.__pool = mysql.connector.pooling.MySQLConnectionPool(
+                    pool_name="hocus-pocus",
+                    pool_size=POOL_SIZE,
+                    host=os.getenv("HOST"),
+                    database=os.getenv("DATABASE"),
+                    user=os.getenv("USER"),
+                    password=os.getenv("PASSWORD"),
+                    ssl_ca=ca_bundle(),
+                )
+            return self.__pool
+
+    def __local(self) -> threading.local:
+        # Every thread takes its own connection from the pool on first use.
+        if getattr(self.local, "connection", None) is None:
+            self.local.connection = self.pool.get_connection()
+            self.local.cursor = self.local.connection.cursor()
+        return self.local
+
+    @property
+    def connection(self) -> mysql.connector.pooling.PooledMySQLConnection:
+        """
+        The pooled connection of the current thread.
+        """
+
+        return self.__local().connection
+
+    @property
+    def cursor(self) -> mysql.connector.cursor.MySQLCursor:
+        """
+        The cursor of the connection of the current thread.
+        """
+
+        return self.__local().cursor
+
+    def release_connection(self) -> None:
+        """
+        Returns the connection of the current thread to the pool.
+
+        :returns: None
+        """
+
+        if getattr(self.local, "connection", None) is not None:
+            self.local.cursor.close()
+            self.local.connection.close()
+            self.local.connection = None
+
     def commit_transactions(
         self, t1: float = None, i: int = None, threshold: int = None
     ) -> bool:
@@ -72,79 +416,233 @@ class DatabaseConnection:
         if i % 250 == 0:
             self.logger.info(f"Inserted {i} products into database.")
 
-    def insert(self, product) -> None:
+    def rollback_transactions(self) -> None:
+        """
+        Rolls back the transactions that haven't been committed yet.
+
+        :returns: None
         """
-        Inserts a product into a database.
 
-        :param product: Product to be inserted into database.
+        if self.dummy:
+            return
+
+        self.connection.rollback()
+
+    def prepare_tables(self) -> None:
+        """
+        Makes sure the tables have the keys the scraping tasks rely on.
 
-        :return: None
+        :returns: None
         """
 
         if self.dummy:
+            self.logger.debug("Dummy database does not prepare tables.")
             return
 
-        self.logger.debug(f"Inserting {product['name']} into database.")
+        self.cursor.execute(
+            """
+            SELECT COUNT(*) FROM information_schema.statistics
+            WHERE table_schema = DATABASE() AND table_name = 'Products' AND index_name = 'ean_store';
+            """
+        )
+        if self.cursor.fetchone()[0] == 0:
+            self.logger.info("Adding the unique (ean, store) key to the Products table...")
+            self.cursor.execute("ALTER TABLE Products ADD UNIQUE KEY ean_store (ean, store);")
 
         self.cursor.execute(
-            f"""
-            INSERT INTO Products (
-            ean, other_ean, name, brand, category, image_url, is_age_restricted,
-            is_discount, price, store, unit_price, url, weight
+            """
+            SELECT COUNT(*) FROM information_schema.columns
+            WHERE table_schema = DATABASE() AND table_name = 'Products' AND column_name = 'last_seen';
+            """
+        )
+        if self.cursor.fetchone()[0] == 0:
+            self.logger.info("Adding the last_seen column to the Products table...")
+            self.cursor.execute("ALTER TABLE Products ADD COLUMN last_seen INT UNSIGNED NOT NULL DEFAULT 0;")
+
+        self.cursor.execute(
+            """
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = 'Requests';
+            """
+        )
+        if self.cursor.fetchone()[0] == 0:
+            self.logger.info("Adding the Requests table and the request column to the Products table...")
+            self.cursor.execute(CREATE_REQUESTS)
+            self.cursor.execute(
+                "ALTER TABLE Products ADD COLUMN request BIGINT UNSIGNED NOT NULL DEFAULT 0, ADD KEY request (request);"
             )
 
-            VALUES (
-            {product["ean"]},
-            {(product["other_ean"][0] if len(product["other_ean"]) > 0 else 0)},
-            '{product["name"].replace("'", '"')}',
-            '{product["brand"].replace("'", '"')}',
-            '{product["category"]}',
-            '{product["image_url"]}',
-            {product["is_age_restricted"]},
-            {product["is_discount"]},
-            {product["price"]},
-            '{product["store"]}',
-            {product["unit_price"]},
-            '{product["url"]}',
-            '{product["weight"].replace("'", '"')}'
-            );
+        self.cursor.execute(
+            """
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = 'ProductEans';
+            """
+        )
+        if self.cursor.fetchone()[0] == 0:
+            self.logger.info("Creating the ProductEans table from the EANs of the products...")
+            self.cursor.execute(CREATE_PRODUCT_EANS)
+            self.cursor.execute(BACKFILL_PRODUCT_EANS)
+            self.cursor.execute("COMMIT;")
+
+        self.cursor.execute(
+            """
+            SELECT COUNT(*) FROM information_schema.tables
+            WHERE table_schema = DATABASE() AND table_name = 'PriceHistory';
             """
         )
+        if self.cursor.fetchone()[0] == 0:
+            self.logger.info("Creating the PriceHistory and PriceLatest tables from the prices of the products...")
+            for statement in CREATE_PRICE_TABLES:
+                self.cursor.execute(statement)
+            self.cursor.execute("COMMIT;")
+
+    def bulk_upsert(self, products: typing.List[Product]) -> None:
+        """
+        Inserts products into the database, updating the ones that already exist for the same store.
+
+        The rows are sent in chunks of BULK_SIZE with a single multi-row statement per chunk,
+        existing rows are matched on the unique (ean, store) key and tagged with the current run.
+        Shards running in other processes upsert into the same table through the same key. Every
+        EAN of the products, the other EANs included, then replaces their codes in ProductEans and
+        the prices that changed are appended to PriceHistory.
+
+        :param products: Products to be upserted into the database.
+
+        :returns: None
+        """
+
+        if self.dummy or not products:
+            return
 
+        self.logger.debug(f"Upserting {len(products)} products into database.")
+
+        # A product can come back in more than one response of a batch, the last one wins like it
+        # does in Products, the staged codes and prices are keyed on the product.
+        # Rows are written in key order, so concurrent shards take their row locks in the same order.
+        products = sorted({product.key: product for product in products}.values(), key=lambda product: product.key)
+        rows = [self.__product_row(product) for product in products]
+        for i in range(0, len(rows), BULK_SIZE):
+            self.cursor.executemany(UPSERT_PRODUCTS, rows[i : i + BULK_SIZE])
+
+        codes = [
+            (product.ean, product.store, code)
+            for product in products
+            for code in dict.fromkeys((product.ean, *product.other_ean))
+            if code > 0
+        ]
+        self.cursor.execute(STAGE_PRODUCT_EANS)
+        # A batch that was rolled back and retried may have left its codes behind.
+        self.cursor.execute("DELETE FROM ProductEanStage;")
+        for i in range(0, len(codes), BULK_SIZE):
+            self.cursor.executemany(INSERT_STAGED_EAN, codes[i : i + BULK_SIZE])
+        for statement in REPLACE_PRODUCT_EANS_STATEMENTS:
+            self.cursor.execute(statement)
+
+        prices = [(product.ean, product.store, *price_record(product)) for product in products]
+        self.cursor.execute(STAGE_PRICES)
+        self.cursor.execute("DELETE FROM PriceStage;")
+        for i in range(0, len(prices), BULK_SIZE):
+            self.cursor.executemany(INSERT_STAGED_PRICE, prices[i : i + BULK_SIZE])
+        for statement in RECORD_PRICES_STATEMENTS:
+            self.cursor.execute(statement, (self.run_id,))
+        self.cursor.execute("DELETE FROM PriceStage;")
+
+    def mark_seen(self, responses: list) -> None:
+        """
+        Tags the responses that didn't change since the last run with the current run, so finish_run keeps their products.
+
+        Only the row of every response in Requests is written. Its products already point at it,
+        except the first time the response is unchanged or after a product moved to another
+        request, so the update of the products normally writes nothing. The products of the whole
+        batch are staged and updated in one statement, however many responses it has.
+
+        :param responses: The url and the (ean, store) keys of the products of every response.
+
+        :returns: None
+        """
 
-    def update(self, product) -> None:
+        if self.dummy or not responses:
+            return
+
+        requests = [(_request_hash(url), keys) for url, keys in responses]
+        self.cursor.executemany(
+            "INSERT INTO Requests (request, last_seen) VALUES (%s, %s) ON DUPLICATE KEY UPDATE last_seen = VALUES(last_seen)",
+            [(request, self.run_id) for request, _ in requests],
+        )
+
+        # A product in more than one response points at the last one, like its upsert would.
+        seen = {tuple(key): request for request, keys in requests for key in keys}
+        rows = [(request, ean, store) for (ean, store), request in seen.items()]
+        self.cursor.execute(STAGE_SEEN)
+        # A batch that was rolled back and retried may have left its products behind.
+        self.cursor.execute("DELETE FROM SeenStage;")
+        for i in range(0, len(rows), BULK_SIZE):
+            self.cursor.executemany(INSERT_STAGED_SEEN, rows[i : i + BULK_SIZE])
+        self.cursor.execute(UPDATE_SEEN)
+        self.cursor.execute("DELETE FROM SeenStage;")
+
+    def finish_run(self, stores: list) -> None:
         """
-        Updates a product in a database.
+        Removes the products of the stores that weren't seen in the current run.
+
+        Only stores whose scraping task finished should be passed, a store that failed halfway
+        keeps all of its products until its next complete run.
 
-        :param product: Product to be updated in database.
+        :param stores: The names of the stores that finished.
 
         :returns: None
         """
-        
+
         if self.dummy:
+            self.logger.debug("Dummy database does not remove stale products.")
             return
-        
-        self.logger.debug(f"Updating {product['name']} in database.")
-        
+
+        if not stores:
+            return
+
+        # Products of a changed response were upserted with the run, the ones of an unchanged response point at it.
         self.cursor.execute(
             f"""
-            UPDATE Products
-            SET ean = {product["ean"]},
-            other_ean = {(product["other_ean"][0] if len(product["other_ean"]) > 0 else 0)},
-            name = '{product["name"].replace("'", '"')}',
-            brand = '{product["brand"].replace("'", '"')}',
-            category = '{product["category"]}',
-            image_url = '{product["image_url"]}',
-            is_age_restricted = {product["is_age_restricted"]},
-            is_discount = {product["is_discount"]},
-            price = {product["price"]},
-            store = '{product["store"]}',
-            unit_price = {product["unit_price"]},
-            url = '{product["url"]}',
-            weight = '{product["weight"].replace("'", '"')}',
-            disregard = 0
-            WHERE ean = {product["ean"]} AND store = '{product["store"]}';
+            DELETE p FROM Products AS p
+            LEFT JOIN Requests AS r ON r.request = p.request AND r.last_seen = %s
+            WHERE p.store IN ({', '.join(['%s'] * len(stores))}) AND p.last_seen != %s AND r.request IS NULL;
+            """,
+            (self.run_id, *stores, self.run_id),
+        )
+        self.logger.info("Removed %s products that are no longer sold.", self.cursor.rowcount)
+        self.cursor.execute(
+            """
+            DELETE pe FROM ProductEans AS pe
+            LEFT JOIN Products AS p ON p.ID = pe.product_id
+            WHERE p.ID IS NULL;
+            """
+        )
+        # Their history stays, a product that is sold again gets a new record even at the same price.
+        self.cursor.execute(
             """
+            DELETE l FROM PriceLatest AS l
+            LEFT JOIN Products AS p ON p.ean = l.ean AND p.store = l.store
+            WHERE p.ean IS NULL;
+            """
+        )
+        self.cursor.execute("COMMIT;")
+
+    def __product_row(self, product: Product) -> tuple:
+        return (
+            product.ean,
+            product.other_ean[0] if product.other_ean else 0,
+            product.name,
+            product.brand,
+            product.category,
+            product.image_url,
+            product.is_age_restricted,
+            product.is_discount,
+            product.price,
+            product.store,
+            product.unit_price,
+            product.url,
+            product.weight,
+            self.run_id,
         )
 
     def is_connected(self) -> bool:
@@ -165,118 +663,152 @@ class DatabaseConnection:
         """
         Matches products with the same EAN and calculates the price difference between them.
 
+        Every pair is matched at once with a few set-based statements: codes in ProductEans, every
+        EAN and other EAN of the products, shared by exactly two products become pairs,
+        the cheaper product of each pair gets the price difference, the more expensive one is
+        disregarded and the Matches table is rebuilt in the same transaction.
+
         :returns: None
         """
-        
+
         if self.dummy:
             self.logger.debug("Dummy database does not match products.")
             return
 
-        self.cursor.execute(
-            """
-            SELECT code, COUNT(*) AS count
-            FROM (
-            SELECT EAN AS code
-            FROM Products
-            UNION ALL
-            SELECT OTHER_EAN AS code
-            FROM Products
-            WHERE OTHER_EAN IS NOT NULL AND OTHER_EAN != ''
-            ) AS codes
-            GROUP BY code
-            HAVING count = 2;
-            """
-        )
+        t1 = time.perf_counter()
+        self.logger.info("Matching products...")
+        for statement in MATCH_STATEMENTS:
+            self.cursor.execute(statement)
 
-        matched_eans = [ean[0] for ean in self.cursor.fetchall()]
         self.commit_transactions()
+        self.cursor.execute("SELECT COUNT(*) FROM Matches;")
+        self.logger.info(
+            "Matched products in %s seconds, %s products in Matches.",
+            round(time.perf_counter() - t1, 2),
+            self.cursor.fetchone()[0],
+        )
 
-        self.logger.info("Starting enumeration of matched EANs.")
-        for i, ean in enumerate(matched_eans):
-            self.cursor.execute(
-                f"SELECT * FROM Products WHERE ean = {ean} OR other_ean = {ean};"
-            )
-            products = self.cursor.fetchall()
+    def build_search_index(self, path: str = SEARCH_INDEX_PATH) -> None:
+        """
+        Builds the search index from the Products table and saves it, search uses it from then on.
 
-            if len(products) == 2:
-                expensive_product, cheaper_product = swap(products[0], products[1], 8)
-                percent_diff = diff(expensive_product[8], cheaper_product[8])
-                float_diff = round(expensive_product[8] - cheaper_product[8], 2)
-                self.cursor.execute(
-                    f"""
-                UPDATE Products
-                SET price_difference_percentage = {percent_diff}, price_difference_float = {float_diff}
-                WHERE id = {cheaper_product[0]};
-                """
-                )
+        :param path: The path of the index file.
 
-                self.cursor.execute(
-                    f"""
-                    UPDATE Products
-                    SET disregard = 1
-                    WHERE id = {expensive_product[0]};
-                """
-                )
+        :returns: None
+        """
 
-                self.logger.debug(
-                    f"Updated {ean} with {float_diff} and {percent_diff}% of difference."
-                )
-                self.commit_transactions(i, threshold=25)
+        if self.dummy:
+            self.logger.debug("Dummy database does not build the search index.")
+            return
 
-        self.commit_transactions()
+        t1 = time.perf_counter()
+        # Whole rows are indexed, search returns them like it always did, the indexed columns are found by name.
+        self.cursor.execute("SELECT * FROM Products;")
+        columns = [column[0].lower() for column in self.cursor.description]
+        name, brand, percentage = (columns.index(column) for column in ("name", "brand", "price_difference_percentage"))
+        self.search_index = SearchIndex.build(
+            (row, row[name], row[brand], row[percentage]) for row in self.cursor.fetchall()
+        )
+        self.search_index.save(path)
+        self.logger.info(
+            "Indexed %s products for search in %s seconds.", len(self.search_index), round(time.perf_counter() - t1, 2)
+        )
 
-        self.delete_rows("Matches")
-        self.cursor.execute(
-            """
-        INSERT INTO Matches
-        SELECT ID, EAN, name, brand, category, image_url, is_age_restricted, is_discount, 
-        price, store, unit_price, url, weight, other_ean, price_difference_float, price_difference_percentage
-        FROM Products
-        WHERE disregard = 0;
+    def write_snapshot(self, path: str = SNAPSHOT_PATH) -> None:
         """
-        )
+        Writes the Products and Matches tables into a columnar snapshot, see etc.snapshot.
 
-        self.commit_transactions()
+        :param path: The path of the snapshot.
+
+        :returns: None
+        """
+
+        if self.dummy:
+            self.logger.debug("Dummy database does not write a snapshot.")
+            return
+
+        t1 = time.perf_counter()
+        writer = SnapshotWriter(path)
+        for table, schema in (("Products", PRODUCTS_SCHEMA), ("Matches", MATCHES_SCHEMA)):
+            self.cursor.execute(f"SELECT {', '.join(name for name, _ in schema)} FROM {table};")
+            writer.extend(table.lower(), schema, [])
+            while rows := self.cursor.fetchmany(BULK_SIZE):
+                writer.extend(table.lower(), schema, rows)
+        writer.close(run_id=self.run_id)
+        self.logger.info(
+            "Wrote a snapshot of %s products and %s matches in %s seconds.",
+            writer.rows["products"],
+            writer.rows["matches"],
+            round(time.perf_counter() - t1, 2),
+        )
 
     def search(self, query: str, count: int = 10) -> list:
         """
-        Uses a fuzzy search algorithm to find products that match the search query and returns a list of products that match.
+        Finds the products whose name or brand best match the search query, typos and missing diacritics included.
+
+        The search index is loaded from disk on the first search, or built if there is none, and
+        queries never reach MySQL.
 
         :param query: The search query.
         :param count: The number of results to return.
 
-        :returns: A list of products that match the search query.
+        :returns: A list of Products rows, best match first.
+        """
+
+        if self.search_index is None:
+            self.search_index = SearchIndex.load()
+        if self.search_index is None:
+            if self.dummy:
+                self.logger.debug("Dummy database does not search.")
+                return []
+            self.build_search_index()
+        return self.search_index.search(query, count)
+
+    def price_history(self, ean: int, since: int = 0) -> typing.List[PricePoint]:
+        """
+        Returns how the price of a product changed over time, in every store that sells it.
+
+        :param ean: The EAN of the product.
+        :param since: Only the prices from this unix time on, and the one the product had then.
+
+        :returns: A list of price points, by store and then oldest first.
         """
 
         if self.dummy:
-            self.logger.debug("Dummy database does not search.")
+            self.logger.debug("Dummy database has no price history.")
             return []
-        
+
+        # The point a product had at since is the last one from before it, the history starts there.
         self.cursor.execute(
-            "SELECT * FROM Products WHERE MATCH(name, brand) AGAINST(%s) LIMIT %s",
-            (
-                query,
-                count,
-            ),
+            """
+            SELECT h.store, h.run_id, h.price_cents, h.unit_price_cents, h.flags
+            FROM PriceHistory AS h
+            WHERE h.ean = %s AND h.run_id >= (
+            SELECT COALESCE(MAX(b.run_id), 0) FROM PriceHistory AS b
+            WHERE b.ean = h.ean AND b.store = h.store AND b.run_id <= %s
+            )
+            ORDER BY h.store, h.run_id;
+            """,
+            (ean, since),
         )
-        return self.cursor.fetchall()
+        return [PricePoint.from_record(*row) for row in self.cursor.fetchall()]
 
-    def exists(self, product_ean: str, product_store: str) -> bool:
+    def biggest_drops(self, since: int, count: int = 10) -> typing.List[PriceDrop]:
         """
-        Checks if the product exists in the database.
+        Returns the products whose price dropped the most since a point in time, like the start of the week.
 
-        :param product: The product to check for.
+        :param since: The unix time the prices are compared with.
+        :param count: The number of products to return.
 
-        :returns: True if the product exists in the database, False otherwise.
+        :returns: A list of price drops, the biggest drop in percent first.
         """
 
         if self.dummy:
-            return False
+            self.logger.debug("Dummy database has no price history.")
+            return []
 
-        self.cursor.execute(
-            f"SELECT null FROM Products WHERE ean = {product_ean} AND store = '{product_store}';"
-        )
-        return self.cursor.fetchone() is not None
+        self.cursor.execute(PRICE_DROPS, (since, since, count))
+        return [PriceDrop.from_record(*row) for row in self.cursor.fetchall()]
 
     def delete_rows(self, table_name: str, product_ean: int = None) -> None:
         """
@@ -301,27 +833,37 @@ class DatabaseConnection:
         self.cursor.execute(f"DELETE FROM {table_name};")
         self.cursor.execute("COMMIT;")
 
-    async def __download_img(self, url, item_id, session) -> None:
+    def image_rows(self, page_size: int = IMAGE_PAGE_SIZE) -> typing.Iterator[typing.Tuple[int, str]]:
         """
-        Downloads an image from a url.
+        Reads the id and image url of every product, a page at a time.
 
-        :param url: The url to download from.\n
-        :param item_id: The id of the item.\n
-        :param session: The aiohttp session.
+        The rows are read on the connection of the thread that iterates them, which is returned to
+        the pool once they are read or the iterator is closed.
 
-        :returns: None
-        """
+        :param page_size: The number of rows read at once.
 
-        filename = f"images/{item_id}.jpg"
-        async with session.get(url) as response:
-            async with aiofiles.open(filename, "wb") as f:
-                await f.write(await response.read())
+        :returns: An iterator over the rows, ordered by id.
+        """
 
-    async def download_images(self) -> None:
+        last_id = 0
+        try:
+            while True:
+                self.cursor.execute(
+                    "SELECT ID, image_url FROM Products WHERE ID > %s ORDER BY ID LIMIT %s;", (last_id, page_size)
+                )
+                rows = self.cursor.fetchall()
+                yield from rows
+                if len(rows) < page_size:
+                    return
+                last_id = rows[-1][0]
+        finally:
+            self.release_connection()
+
+    async def download_images(self, mirror: ImageMirror = None) -> None:
         """
-        Downloads all images from the database.
+        Mirrors the images of every product into the images directory.
 
-        :param db_cursor: The database cursor.
+        :param mirror: The image mirror, defaults to one with the default limits.
 
         :returns: None
         """
@@ -330,10 +872,4 @@ class DatabaseConnection:
             self.logger.debug("Dummy database does not download images.")
             return
 
-        self.cursor.execute("SELECT image_url, ID FROM Products")
-        rows = self.cursor.fetchall()
-        self.logger.info(f"Rows: {len(rows)}")
-        async with aiohttp.ClientSession() as session:
-            await asyncio.gather(
-                *[self.__download_img(row[0], row[1], session) for row in rows]
-            )
+        await (mirror or ImageMirror()).mirror(self.image_rows())
@@ -0,0 +1,85 @@
+"""
+This module contains the pluggable JSON decoders used for scraper responses.
+
+msgspec and orjson are optional, the fastest installed backend is used and the stdlib json module
+is the fallback. With msgspec, a store can pass a typed schema so only the fields its parser uses
+are decoded, the rest of the response is skipped without being materialized. The decoded objects
+are then instances of the schema, so the store must read them the way it reads plain dicts.
+
+Classes:
+    Decoder: Decodes JSON response bodies with one of the backends.
+
+Functions:
+    get_decoder: Returns a decoder for the backend.
+"""
+
+import json
+import typing
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ("auto", "msgspec", "orjson", "json")
+
+
+class Decoder:
+    """
+    Decodes JSON response bodies with one of the backends.
+
+    :param backend: The backend, one of "msgspec", "orjson" or "json".\n
+    :param schema: A msgspec type to decode into, ignored by the other backends.
+    """
+
+    def __init__(self, backend: str = "json", schema: typing.Any = None) -> None:
+        if backend == "msgspec" and msgspec is None or backend == "orjson" and orjson is None:
+            raise ValueError(f"The {backend} decoder is not installed.")
+
+        self.backend: str = backend
+        self.schema: typing.Any = schema if backend == "msgspec" else None
+
+        if backend == "msgspec":
+            self.__decoder = (msgspec.json.Decoder(schema) if schema is not None else msgspec.json.Decoder()).decode
+        elif backend == "orjson":
+            self.__decoder = orjson.loads
+        else:
+            self.__decoder = json.loads
+
+    def decode(self, body: bytes) -> typing.Any:
+        """
+        Decodes a response body.
+
+        :param body: The raw body of the response.
+
+        :returns: The decoded response, an instance of the schema if one is used.
+        """
+
+        return self.__decoder(body)
+
+    def __repr__(self) -> str:
+        return f"Decoder({self.backend!r}{', typed' if self.schema is not None else ''})"
+
+
+def get_decoder(backend: str = "auto", schema: typing.Any = None) -> Decoder:
+    """
+    Returns a decoder for the backend.
+
+    :param backend: The backend, "auto" picks msgspec for schemas, orjson otherwise and the stdlib json module last.\n
+    :param schema: A msgspec type to decode into when msgspec is used.
+
+    :returns: The decoder.
+    """
+
+    if backend == "auto":
+        # msgspec only beats orjson when it can skip fields through a schema.
+        if msgspec is not None and (schema is not None or orjson is None):
+            backend = "msgspec"
+        else:
+            backend = "orjson" if orjson is not None else "json"
+    return Decoder(backend, schema)
@@ -0,0 +1,135 @@
+"""
+This module contains the HTTP fixtures used to run the scrapers without the network.
+
+A run with a FixtureRecorder saves every response it reads into a compressed zip archive, the
+replay server in benchmarks.replay serves them back. Responses are stored under a digest of their
+url, so a scraper pointed at the replay server only has to swap its urls with replay_url.
+
+Classes:
+    FixtureRecorder: Records responses into a fixture archive.
+    FixtureArchive: Reads the responses of a fixture archive.
+
+Functions:
+    fixture_key: Returns the key a url is stored under.
+    replay_url: Returns the url of a response on the replay server.
+"""
+
+import hashlib
+import json
+import logging
+import typing
+import zipfile
+
+# The archive member holding the url, status and content type of every response.
+INDEX = "index.json"
+
+
+def fixture_key(url: str) -> str:
+    """
+    Returns the key a url is stored under.
+
+    :param url: The url of the response.
+
+    :returns: The key.
+    """
+
+    return hashlib.sha1(url.encode()).hexdigest()
+
+
+def replay_url(url: str, server: str) -> str:
+    """
+    Returns the url of a response on the replay server.
+
+    :param url: The url of the response.\n
+    :param server: The base url of the replay server, like http://127.0.0.1:8080.
+
+    :returns: The url on the replay server.
+    """
+
+    return f"{server.rstrip('/')}/{fixture_key(url)}"
+
+
+class FixtureRecorder:
+    """
+    Records responses into a fixture archive.
+
+    Only the first response of every url is kept. The index is written when the recorder is
+    closed, an archive that was never closed can't be replayed.
+
+    :param path: The path of the archive, it is overwritten.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self.archive: zipfile.ZipFile = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.index: typing.Dict[str, dict] = {}
+        self.logger: logging.Logger = logging.getLogger("fixtures")
+
+    def record(self, url: str, status: int, content_type: str, body: bytes) -> None:
+        """
+        Records a response.
+
+        :param url: The requested url.\n
+        :param status: The status of the response.\n
+        :param content_type: The content type of the response.\n
+        :param body: The raw body of the response.
+
+        :returns: None
+        """
+
+        key = fixture_key(url)
+        if key in self.index:
+            return
+
+        self.archive.writestr(key, body)
+        self.index[key] = {"url": url, "status": status, "content_type": content_type}
+
+    def close(self) -> None:
+        """
+        Writes the index and closes the archive.
+
+        :returns: None
+        """
+
+        self.archive.writestr(INDEX, json.dumps(self.index))
+        self.archive.close()
+        self.logger.info("Recorded %s responses into %s.", len(self.index), self.path)
+
+
+class FixtureArchive:
+    """
+    Reads the responses of a fixture archive.
+
+    :param path: The path of the archive.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.archive: zipfile.ZipFile = zipfile.ZipFile(path)
+        self.index: typing.Dict[str, dict] = json.loads(self.archive.read(INDEX))
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.index
+
+    def get(self, key: str) -> typing.Tuple[int, str, bytes]:
+        """
+        Returns a recorded response.
+
+        :param key: The key of the response, see fixture_key.
+
+        :returns: The status, content type and body of the response.
+        """
+
+        entry = self.index[key]
+        return entry["status"], entry["content_type"], self.archive.read(key)
+
+    def close(self) -> None:
+        """
+        Closes the archive.
+
+        :returns: None
+        """
+
+        self.archive.close()
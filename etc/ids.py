@@ -0,0 +1,166 @@
+"""
+This module contains the streaming reader of the product id files.
+
+The ids are read in chunks and handed out one at a time, so a scraping task starts requesting as
+soon as the first chunk is read. Duplicates are dropped by comparing the ids exactly as they are
+requested, and EANs can be checked against their check digit before they are requested.
+
+Classes:
+    IdSource: Lazily yields the unique, valid product ids of a file or list that belong to a shard.
+
+Functions:
+    stream_ids: Reads comma or newline separated ids from a file in chunks.
+    valid_ean: Checks the check digit of an EAN, UPC or GTIN.
+    in_shard: Checks if a product id belongs to a shard.
+"""
+
+import itertools
+import logging
+import typing
+import zlib
+
+# Bytes read from the file at once.
+CHUNK_SIZE = 1 << 16
+
+# Ids of a list handled at once.
+BATCH_SIZE = 8192
+
+# Commas and any whitespace separate the ids.
+SEPARATORS = b", \t\n\r\x0b\x0c"
+
+
+def stream_ids(path: str, chunk_size: int = CHUNK_SIZE) -> typing.Iterator[str]:
+    """
+    Reads comma or newline separated ids from a file in chunks.
+
+    :param path: The path of the file.\n
+    :param chunk_size: The number of bytes read at once.
+
+    :returns: An iterator over the ids, in the order of the file.
+    """
+
+    for ids in _read_chunks(path, chunk_size):
+        yield from filter(None, ids)
+
+
+def _read_chunks(path: str, chunk_size: int = CHUNK_SIZE) -> typing.Iterator[typing.List[str]]:
+    # The ids of every chunk, decoded at once. Some may be empty.
+    rest = b""
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            data = rest + chunk
+            parts = data.replace(b",", b" ").split()
+            # The last part may continue in the next chunk.
+            rest = parts.pop() if parts and data[-1:] not in SEPARATORS else b""
+            if parts:
+                yield b" ".join(parts).decode().split(" ")
+    if rest:
+        yield [rest.decode()]
+
+
+def valid_ean(code: str) -> bool:
+    """
+    Checks the check digit of an EAN, UPC or GTIN.
+
+    Codes of 8 to 14 digits are accepted, a UPC stored without its leading zero still checks out
+    since leading zeros don't change the check digit.
+
+    :param code: The code.
+
+    :returns: True if the check digit is right, False otherwise.
+    """
+
+    if not 8 <= len(code) <= 14 or not code.isascii() or not code.isdigit():
+        return False
+
+    # From the right, the digits before the check digit are weighted 3, 1, 3, 1... Summing the
+    # bytes and taking away the "0"s is several times faster than converting every digit.
+    digits = code.encode()
+    odd, even = digits[-2::-2], digits[-3::-2]
+    total = 3 * (sum(odd) - 48 * len(odd)) + sum(even) - 48 * len(even)
+    return (10 - total % 10) % 10 == digits[-1] - 48
+
+
+def in_shard(product_id: str, shards: int, shard_index: int) -> bool:
+    """
+    Checks if a product id belongs to a shard.
+
+    The ids are partitioned by their crc32, so every process and machine splits them the same way
+    whatever the order of the id file.
+
+    :param product_id: The product id.\n
+    :param shards: The number of shards.\n
+    :param shard_index: The shard, from 0 to shards - 1.
+
+    :returns: True if the id belongs to the shard, False otherwise.
+    """
+
+    return shards == 1 or zlib.crc32(product_id.strip().encode()) % shards == shard_index
+
+
+class IdSource:
+    """
+    Lazily yields the unique, valid product ids of a file or list that belong to a shard.
+
+    It can be iterated more than once, every iteration reads the file again.
+
+    :param path: The path of the file of comma or newline separated ids.\n
+    :param ids: The ids, used instead of the file if given.\n
+    :param validator: Returns whether an id is valid, invalid ids are skipped.\n
+    :param shards: The number of shards the ids are split into.\n
+    :param shard_index: The shard whose ids are yielded.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        ids: typing.Iterable[str] = None,
+        validator: typing.Callable[[str], bool] = None,
+        shards: int = 1,
+        shard_index: int = 0,
+    ) -> None:
+        self.path: str = path
+        self.ids: typing.Iterable[str] = ids
+        self.validator: typing.Callable[[str], bool] = validator
+        self.shards: int = shards
+        self.shard_index: int = shard_index
+        self.count: int = 0
+        self.duplicates: int = 0
+        self.invalid: int = 0
+
+    def __iter__(self) -> typing.Iterator[str]:
+        self.count = self.duplicates = self.invalid = 0
+        seen: typing.Set[str] = set()
+        if self.ids is None:
+            batches = _read_chunks(self.path)
+        else:
+            ids = iter(self.ids)
+            batches = iter(lambda: [product_id.strip() for product_id in itertools.islice(ids, BATCH_SIZE)], [])
+
+        # Every step works on a whole chunk of ids, so reading them costs little more than splitting the file.
+        for batch in batches:
+            batch = [product_id for product_id in batch if product_id]
+            if self.shards > 1:
+                batch = [product_id for product_id in batch if in_shard(product_id, self.shards, self.shard_index)]
+            if self.validator is not None:
+                valid = list(filter(self.validator, batch))
+                self.invalid += len(batch) - len(valid)
+                batch = valid
+
+            # Ids are compared exactly as they are requested, "0042" and "42" are two ids.
+            fresh = [product_id for product_id in dict.fromkeys(batch) if product_id not in seen]
+            seen.update(fresh)
+            self.duplicates += len(batch) - len(fresh)
+            self.count += len(fresh)
+            yield from fresh
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """
+        Logs how many ids were read and skipped.
+
+        :param logger: The logger to log to.
+
+        :returns: None
+        """
+
+        logger.info("Read %s product ids, skipped %s duplicates and %s invalid.", self.count, self.duplicates, self.invalid)
@@ -0,0 +1,412 @@
+"""
+This module contains the mirror of the product images.
+
+Every image is stored once under the hash of its content, images/objects/ab/abcdef....jpg, and
+every product gets a hard link to it named after its id, images/<id>.jpg, like the images were
+named before, whatever the format of the image. Links of products that are gone are removed. A manifest remembers the ETag, Last-Modified and hash of every url, so the next run
+only asks the hosts whether an image changed and doesn't rewrite the ones that didn't.
+
+Classes:
+    ImageManifest: Remembers the validators and content hash of every image url and the image every product links to.
+    ImageMirror: Mirrors the images of a stream of product rows with bounded concurrency.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import itertools
+import logging
+import os
+import sqlite3
+import threading
+import time
+import typing
+import uuid
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from etc.metrics import METRICS
+
+# The directory the images are mirrored into.
+IMAGE_DIR = "images"
+
+# Bytes written to disk at once, an image is never held in memory whole.
+CHUNK_SIZE = 1 << 16
+
+# Manifest rows written before they are committed.
+COMMIT_SIZE = 500
+
+# Product rows read and linked at once, in a thread of their own.
+PAGE_SIZE = 1000
+
+# Every link keeps the name the images always had, the objects have the extension of their format.
+LINK_EXTENSION = ".jpg"
+
+# File extensions by content type, anything else keeps the extension of its url.
+EXTENSIONS = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/gif": ".gif",
+    "image/avif": ".avif",
+    "image/svg+xml": ".svg",
+}
+
+
+class ImageManifest:
+    """
+    Remembers the validators and content hash of every image url and the image every product links to.
+
+    :param path: The path of the manifest file.
+    """
+
+    def __init__(self, path: str = os.path.join(IMAGE_DIR, "manifest.sqlite3")) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # The rows are linked in the thread that reads them, the downloads use the manifest in the event loop.
+        self.connection: sqlite3.Connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode = WAL;")
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS images (
+            url TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            digest TEXT,
+            extension TEXT
+            );
+            """
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS links (item_id TEXT PRIMARY KEY, url TEXT, path TEXT, digest TEXT, seen INTEGER);"
+        )
+        if "seen" not in [column[1] for column in self.connection.execute("PRAGMA table_info(links);")]:
+            self.connection.execute("ALTER TABLE links ADD COLUMN seen INTEGER;")
+        self.lock: threading.RLock = threading.RLock()
+        self.uncommitted: int = 0
+
+    def entry(self, url: str) -> typing.Optional[tuple]:
+        """
+        Returns what is known about an image url.
+
+        :param url: The url of the image.
+
+        :returns: The ETag, Last-Modified, content hash and file extension, None if the url is new.
+        """
+
+        with self.lock:
+            return self.connection.execute(
+                "SELECT etag, last_modified, digest, extension FROM images WHERE url = ?;", (url,)
+            ).fetchone()
+
+    def update(self, url: str, etag: str, last_modified: str, digest: str, extension: str) -> None:
+        """
+        Remembers the validators and content hash of an image url, once its file has been written.
+
+        :param url: The url of the image.\n
+        :param etag: The ETag of the response.\n
+        :param last_modified: The Last-Modified of the response.\n
+        :param digest: The sha256 of the content.\n
+        :param extension: The file extension of the image.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO images (url, etag, last_modified, digest, extension) VALUES (?, ?, ?, ?, ?);",
+                (url, etag, last_modified, digest, extension),
+            )
+            self.__written()
+
+    def link(self, rows: typing.Iterable[typing.Tuple[str, str]], seen: int) -> None:
+        """
+        Sets the image urls of products, their links are updated once the images have been downloaded.
+
+        :param rows: The id of every product and the url of its image.\n
+        :param seen: Marks the products of this mirroring, prune removes the others.
+
+        :returns: None
+        """
+
+        with self.lock:
+            for item_id, url in rows:
+                self.connection.execute(
+                    """
+                    INSERT INTO links (item_id, url, seen) VALUES (?, ?, ?)
+                    ON CONFLICT (item_id) DO UPDATE SET url = excluded.url, seen = excluded.seen;
+                    """,
+                    (item_id, url, seen),
+                )
+                self.__written()
+
+    def prune(self, seen: int) -> typing.List[str]:
+        """
+        Forgets the products that weren't linked in a mirroring.
+
+        :param seen: The mark link was called with.
+
+        :returns: The paths of their links.
+        """
+
+        with self.lock:
+            paths = [
+                path
+                for (path,) in self.connection.execute("SELECT path FROM links WHERE seen IS NOT ?;", (seen,))
+                if path is not None
+            ]
+            self.connection.execute("DELETE FROM links WHERE seen IS NOT ?;", (seen,))
+            self.commit()
+        return paths
+
+    def stale_links(self) -> typing.List[tuple]:
+        """
+        Returns the products whose link doesn't point to the current content of their image.
+
+        :returns: A list of the id, the path of the current link, the content hash and the file extension.
+        """
+
+        with self.lock:
+            return self.connection.execute(
+                """
+                SELECT links.item_id, links.path, images.digest, images.extension
+                FROM links JOIN images ON images.url = links.url
+                WHERE links.digest IS NOT images.digest;
+                """
+            ).fetchall()
+
+    def linked(self, item_id: str, path: str, digest: str) -> None:
+        """
+        Remembers the link of a product.
+
+        :param item_id: The id of the product.\n
+        :param path: The path of the link.\n
+        :param digest: The content hash it points to.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.connection.execute(
+                "UPDATE links SET path = ?, digest = ? WHERE item_id = ?;", (path, digest, item_id)
+            )
+            self.__written()
+
+    def commit(self) -> None:
+        """
+        Writes the manifest to disk.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def close(self) -> None:
+        """
+        Commits and closes the manifest.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.commit()
+            self.connection.close()
+
+    def __written(self) -> None:
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_SIZE:
+            self.commit()
+
+
+class ImageMirror:
+    """
+    Mirrors the images of a stream of product rows with bounded concurrency.
+
+    The rows are consumed as the workers free up, so they can come from the database a page at a
+    time in a thread of their own, so reading them never holds up the downloads. A url shared by
+    several products is requested once, an image the manifest knows is requested conditionally and
+    the bodies are streamed to disk. Identical images under different urls end up in the same file.
+
+    :param directory: The directory the images are mirrored into.\n
+    :param manifest: The manifest, defaults to the one in the directory.\n
+    :param concurrency: The number of images downloaded at once.\n
+    :param per_host: The number of images downloaded at once from a single host.\n
+    :param refresh: Download every image again, even if the manifest says it hasn't changed.\n
+    :param timeout: The total timeout of a single image in seconds.
+    """
+
+    def __init__(
+        self,
+        directory: str = IMAGE_DIR,
+        manifest: ImageManifest = None,
+        concurrency: int = 32,
+        per_host: int = 8,
+        refresh: bool = False,
+        timeout: float = 60.0,
+    ) -> None:
+        self.directory: str = directory
+        self.manifest: ImageManifest = manifest or ImageManifest(os.path.join(directory, "manifest.sqlite3"))
+        self.concurrency: int = concurrency
+        self.per_host: int = per_host
+        self.refresh: bool = refresh
+        self.timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(total=timeout)
+        self.results: typing.Dict[str, int] = {}
+        self.logger: logging.Logger = logging.getLogger("images")
+
+    async def mirror(self, rows: typing.Iterable[typing.Tuple[typing.Any, str]]) -> None:
+        """
+        Mirrors the images of the rows and links every product to its image.
+
+        :param rows: The id and image url of every product.
+
+        :returns: None
+        """
+
+        t1 = time.perf_counter()
+        self.results.clear()
+        os.makedirs(os.path.join(self.directory, "tmp"), exist_ok=True)
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+
+        connector = aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.per_host)
+        # One thread reads every page, so a database connection of the rows stays with the same thread.
+        loop = asyncio.get_running_loop()
+        reader = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-rows")
+        rows = iter(rows)
+        mark = time.time_ns()
+        async with aiohttp.ClientSession(connector=connector, timeout=self.timeout) as session:
+            workers = [asyncio.create_task(self.__worker(session, queue)) for _ in range(self.concurrency)]
+            try:
+                requested = set()
+                while (urls := await loop.run_in_executor(reader, self.__read_page, rows, mark)) is not None:
+                    for url in urls:
+                        if url not in requested:
+                            requested.add(url)
+                            await queue.put(url)
+                await queue.join()
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                await loop.run_in_executor(reader, getattr(rows, "close", lambda: None))
+                reader.shutdown()
+
+        linked = self.__link()
+        for path in self.manifest.prune(mark):
+            if os.path.exists(path):
+                os.remove(path)
+        self.manifest.commit()
+        self.logger.info(
+            "Mirrored images in %s seconds: %s, %s links updated.",
+            round(time.perf_counter() - t1, 2),
+            ", ".join(f"{count} {result}" for result, count in sorted(self.results.items())) or "none",
+            linked,
+        )
+
+    def object_path(self, digest: str, extension: str) -> str:
+        """
+        Returns the path an image is stored at.
+
+        :param digest: The sha256 of the content.\n
+        :param extension: The file extension of the image.
+
+        :returns: The path.
+        """
+
+        return os.path.join(self.directory, "objects", digest[:2], f"{digest}{extension}")
+
+    def __read_page(
+        self, rows: typing.Iterator[typing.Tuple[typing.Any, str]], mark: int
+    ) -> typing.Optional[typing.List[str]]:
+        # Links the products of the next page that have an image and returns the urls, None after the last page.
+        page = list(itertools.islice(rows, PAGE_SIZE))
+        if not page:
+            return None
+        linked = [(str(item_id), url) for item_id, url in page if url]
+        self.manifest.link(linked, mark)
+        return [url for _, url in linked]
+
+    async def __worker(self, session: aiohttp.ClientSession, queue: asyncio.Queue) -> None:
+        while True:
+            url = await queue.get()
+            try:
+                result = await self.__download(session, url)
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.debug("Failed to download %s: %r", url, e)
+                result = "failed"
+            finally:
+                queue.task_done()
+            self.results[result] = self.results.get(result, 0) + 1
+            METRICS.count("images", result=result)
+
+    async def __download(self, session: aiohttp.ClientSession, url: str) -> str:
+        headers = {}
+        # The reader thread holds the manifest while it links a page, so it is only used off the event loop.
+        entry = await asyncio.to_thread(self.manifest.entry, url)
+        # A conditional request is only safe while the file it would keep is still there.
+        if not self.refresh and entry is not None and os.path.exists(self.object_path(entry[2], entry[3])):
+            if entry[0]:
+                headers["If-None-Match"] = entry[0]
+            if entry[1]:
+                headers["If-Modified-Since"] = entry[1]
+
+        host = urlsplit(url).hostname
+        started = time.monotonic()
+        async with session.get(url, headers=headers) as response:
+            if response.status == 304:
+                METRICS.latency(host, time.monotonic() - started)
+                return "unchanged"
+            if response.status != 200:
+                METRICS.error(host, str(response.status))
+                return "failed"
+
+            extension = EXTENSIONS.get(response.content_type) or os.path.splitext(urlsplit(url).path)[1] or ".jpg"
+            digest = hashlib.sha256()
+            temporary = os.path.join(self.directory, "tmp", uuid.uuid4().hex)
+            try:
+                # Writing a chunk only copies it into the page cache, it doesn't hold the event loop up.
+                with open(temporary, "wb") as f:
+                    async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                        digest.update(chunk)
+                        f.write(chunk)
+                METRICS.latency(host, time.monotonic() - started)
+
+                path = self.object_path(digest.hexdigest(), extension)
+                if os.path.exists(path):
+                    result = "unchanged" if entry is not None and entry[2] == digest.hexdigest() else "duplicate"
+                else:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    os.replace(temporary, path)
+                    result = "written"
+            finally:
+                if os.path.exists(temporary):
+                    os.remove(temporary)
+
+            await asyncio.to_thread(
+                self.manifest.update,
+                url,
+                response.headers.get("ETag"),
+                response.headers.get("Last-Modified"),
+                digest.hexdigest(),
+                extension,
+            )
+            return result
+
+    def __link(self) -> int:
+        linked = 0
+        for item_id, previous, digest, extension in self.manifest.stale_links():
+            source = self.object_path(digest, extension)
+            if not os.path.exists(source):
+                continue
+            path = os.path.join(self.directory, f"{item_id}{LINK_EXTENSION}")
+            temporary = f"{path}.tmp"
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            os.link(source, temporary)
+            os.replace(temporary, path)
+            if previous is not None and previous != path and os.path.exists(previous):
+                os.remove(previous)
+            self.manifest.linked(item_id, path, digest)
+            linked += 1
+        return linked
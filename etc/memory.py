@@ -0,0 +1,304 @@
+"""
+This module contains the in-memory stand-in for the database.
+
+Classes:
+    MemoryDatabase: In-memory stand-in for DatabaseConnection, used to run the scrapers without MySQL.
+"""
+
+import logging
+import threading
+import time
+import typing
+
+from etc.data import state_path
+from etc.images import ImageMirror
+from etc.prices import PriceDrop, PricePoint, price_record
+from etc.product import Product
+from etc.search import SearchIndex
+from etc.snapshot import PRODUCTS_SCHEMA, SNAPSHOT_PATH, SnapshotWriter
+
+
+class MemoryDatabase:
+    """
+    In-memory stand-in for DatabaseConnection, used to run the scrapers without MySQL.
+
+    It has the methods the scraping tasks and main use and keeps their semantics: writes only become
+    visible on commit, a rollback drops them, products are keyed on (ean, store) and finish_run
+    removes the products that weren't seen in the run. A committed product whose price changed gets
+    a price record, like in PriceHistory. Set DATABASE_BACKEND=memory to use it.
+    """
+
+    def __init__(self) -> None:
+        self.products: typing.Dict[typing.Tuple[int, str], Product] = {}
+        self.last_seen: typing.Dict[typing.Tuple[int, str], int] = {}
+        self.matches: int = 0
+        # The run id, price and unit price in cents and flags of every price of a product, oldest first.
+        self.prices: typing.Dict[typing.Tuple[int, str], typing.List[tuple]] = {}
+        self.pending: typing.List[typing.Tuple[typing.Tuple[int, str], typing.Optional[Product]]] = []
+        self.lock: threading.Lock = threading.Lock()
+        self.logger: logging.Logger = logging.getLogger("database")
+        self.debug: bool = False
+        self.dummy: bool = False
+        self.run_id: int = int(time.time())
+        self.search_index: SearchIndex = None
+
+    def release_connection(self) -> None:
+        """
+        Does nothing, there are no connections.
+
+        :returns: None
+        """
+
+    def commit_transactions(self, *_) -> bool:
+        """
+        Makes the pending writes visible.
+
+        :returns: True if the writes were committed, False in dummy mode.
+        """
+
+        if self.dummy:
+            return False
+
+        with self.lock:
+            for key, product in self.pending:
+                if product is not None:
+                    self.__record_price(key, product)
+                    self.products[key] = product
+                if key in self.products:
+                    self.last_seen[key] = self.run_id
+            self.pending.clear()
+        return True
+
+    def __record_price(self, key: typing.Tuple[int, str], product: Product) -> None:
+        # Like PriceLatest, a product that was removed gets a new record even at the same price.
+        record = price_record(product)
+        history = self.prices.setdefault(key, [])
+        if key in self.products and history and history[-1][1:] == record:
+            return
+        if history and history[-1][0] == self.run_id:
+            history.pop()
+        history.append((self.run_id, *record))
+
+    def rollback_transactions(self) -> None:
+        """
+        Drops the pending writes.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.pending.clear()
+
+    def prepare_tables(self) -> None:
+        """
+        Does nothing, there are no tables.
+
+        :returns: None
+        """
+
+    def bulk_upsert(self, products: typing.List[Product]) -> None:
+        """
+        Inserts products, replacing the ones that already exist for the same store.
+
+        :param products: Products to be upserted.
+
+        :returns: None
+        """
+
+        if self.dummy or not products:
+            return
+
+        with self.lock:
+            self.pending.extend((product.key, product) for product in products)
+
+    def mark_seen(self, responses: list) -> None:
+        """
+        Tags the products of responses that didn't change since the last run with the current run, so finish_run keeps them.
+
+        :param responses: The url and the (ean, store) keys of the products of every response.
+
+        :returns: None
+        """
+
+        if self.dummy or not responses:
+            return
+
+        with self.lock:
+            self.pending.extend((tuple(key), None) for _, keys in responses for key in keys)
+
+    def finish_run(self, stores: list) -> None:
+        """
+        Removes the products of the stores that weren't seen in the current run.
+
+        :param stores: The names of the stores that finished.
+
+        :returns: None
+        """
+
+        if self.dummy or not stores:
+            return
+
+        with self.lock:
+            stale = [
+                key for key in self.products if key[1] in stores and self.last_seen.get(key) != self.run_id
+            ]
+            for key in stale:
+                del self.products[key]
+                self.last_seen.pop(key, None)
+        self.logger.info("Removed %s products that are no longer sold.", len(stale))
+
+    def is_connected(self) -> bool:
+        """
+        Checks if the database is connected.
+
+        :returns: Always True.
+        """
+
+        return True
+
+    def match_products(self) -> None:
+        """
+        Counts the products left in Matches after disregarding one product of every matched pair.
+
+        :returns: None
+        """
+
+        if self.dummy:
+            return
+
+        t1 = time.perf_counter()
+        codes: typing.Dict[int, set] = {}
+        with self.lock:
+            for key, product in self.products.items():
+                for code in (product.ean, *product.other_ean):
+                    codes.setdefault(code, set()).add(key)
+
+        # One product of every pair is disregarded, like the more expensive one is in MySQL.
+        disregarded = {max(keys) for keys in codes.values() if len(keys) == 2}
+        self.matches = len(self.products) - len(disregarded)
+        self.logger.info(
+            "Matched products in %s seconds, %s products in Matches.",
+            round(time.perf_counter() - t1, 2),
+            self.matches,
+        )
+
+    def price_history(self, ean: int, since: int = 0) -> typing.List[PricePoint]:
+        """
+        Returns how the price of a product changed over time, in every store that sells it.
+
+        :param ean: The EAN of the product.
+        :param since: Only the prices from this unix time on, and the one the product had then.
+
+        :returns: A list of price points, by store and then oldest first.
+        """
+
+        points = []
+        with self.lock:
+            for (_, store), history in sorted(item for item in self.prices.items() if item[0][0] == ean):
+                start = max([i for i, record in enumerate(history) if record[0] <= since], default=0)
+                points.extend(PricePoint.from_record(store, *record) for record in history[start:])
+        return points
+
+    def biggest_drops(self, since: int, count: int = 10) -> typing.List[PriceDrop]:
+        """
+        Returns the products whose price dropped the most since a point in time, like the start of the week.
+
+        :param since: The unix time the prices are compared with.
+        :param count: The number of products to return.
+
+        :returns: A list of price drops, the biggest drop in percent first.
+        """
+
+        drops = []
+        with self.lock:
+            for key in self.products:
+                history = self.prices.get(key, [])
+                before = [record for record in history if record[0] < since]
+                if not before or history[-1][0] < since or before[-1][1] <= history[-1][1]:
+                    continue
+                drops.append(PriceDrop.from_record(*key, before[-1][1], history[-1][1], history[-1][0]))
+        drops.sort(key=lambda drop: (-drop.percentage, drop.after - drop.before))
+        return drops[:count]
+
+    def build_search_index(self, path: str = None) -> None:
+        """
+        Builds the search index from the products, it is kept in memory only.
+
+        :param path: Ignored, nothing is written to disk.
+
+        :returns: None
+        """
+
+        with self.lock:
+            products = sorted(self.products.items())
+        self.search_index = SearchIndex.build((product, product.name, product.brand, 0) for _, product in products)
+
+    def search(self, query: str, count: int = 10) -> list:
+        """
+        Finds the products whose name or brand best match the search query.
+
+        :param query: The search query.
+        :param count: The number of results to return.
+
+        :returns: A list of products that match the search query.
+        """
+
+        if self.search_index is None:
+            self.build_search_index()
+        return self.search_index.search(query, count)
+
+    def write_snapshot(self, path: str = None) -> None:
+        """
+        Writes the products into a columnar snapshot, there is no Matches table to write.
+
+        :param path: The path of the snapshot, defaults to the one of offline runs, the snapshot of MySQL is left alone.
+
+        :returns: None
+        """
+
+        if self.dummy:
+            return
+
+        with self.lock:
+            products = sorted(self.products.items())
+        writer = SnapshotWriter(path if path is not None else state_path(SNAPSHOT_PATH))
+        writer.extend(
+            "products",
+            PRODUCTS_SCHEMA,
+            (
+                (
+                    product.ean, product.store, product.name, product.brand, product.category, product.price,
+                    product.unit_price, product.is_discount, product.is_age_restricted, product.weight, product.url,
+                    product.image_url, product.other_ean[0] if product.other_ean else 0,
+                )
+                for _, product in products
+            ),
+        )
+        writer.close(run_id=self.run_id)
+
+    def image_rows(self, page_size: int = 1000) -> typing.Iterator[typing.Tuple[str, str]]:
+        """
+        Returns the key and image url of every product, the products have no ids.
+
+        :param page_size: Ignored, the products are already in memory.
+
+        :returns: An iterator over the rows.
+        """
+
+        with self.lock:
+            rows = [(f"{store}-{ean}", product.image_url) for (ean, store), product in sorted(self.products.items())]
+        return iter(rows)
+
+    async def download_images(self, mirror: ImageMirror = None) -> None:
+        """
+        Mirrors the images of every product into the images directory.
+
+        :param mirror: The image mirror, defaults to one with the default limits.
+
+        :returns: None
+        """
+
+        if self.dummy:
+            return
+
+        await (mirror or ImageMirror()).mirror(self.image_rows())
@@ -0,0 +1,407 @@
+"""
+This module contains the metrics recorded during a run.
+
+Every stage of a run records into the shared METRICS: the time spent in it, counters, per-host
+request latency histograms and errors by type. At the end of the run they are logged and can be
+written as a JSON run report and as a Prometheus textfile, for the node_exporter textfile collector.
+
+Classes:
+    Histogram: Latency histogram with fixed buckets.
+    Metrics: Thread-safe timers, counters, latency histograms and error counts of a run.
+"""
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+import typing
+
+# Upper bounds of the latency buckets in seconds, the last bucket takes everything above.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float("inf"))
+
+# The prefix of every Prometheus metric.
+PREFIX = "hocus"
+
+Labels = typing.Tuple[typing.Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """
+    Latency histogram with fixed buckets.
+
+    :param buckets: The upper bounds of the buckets, the last one must be infinite.
+    """
+
+    def __init__(self, buckets: typing.Sequence[float] = BUCKETS) -> None:
+        self.buckets: typing.Sequence[float] = buckets
+        self.counts: typing.List[int] = [0] * len(buckets)
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        """
+        Adds a value to its bucket.
+
+        :param value: The value.
+
+        :returns: None
+        """
+
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "Histogram") -> None:
+        """
+        Adds the values of another histogram with the same buckets.
+
+        :param other: The other histogram.
+
+        :returns: None
+        """
+
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.sum += other.sum
+
+    def quantile(self, q: float) -> float:
+        """
+        Estimates a quantile, interpolating linearly inside its bucket.
+
+        :param q: The quantile, between 0 and 1.
+
+        :returns: The estimate, 0 if the histogram is empty.
+        """
+
+        if self.count == 0:
+            return 0.0
+
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i]
+                if upper == float("inf"):
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+    def to_dict(self) -> dict:
+        """
+        Returns the histogram for the run report.
+
+        :returns: The count, mean, p50, p90 and p99 in seconds and the bucket counts.
+        """
+
+        return {
+            "count": self.count,
+            "mean": round(self.sum / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p90": round(self.quantile(0.9), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)},
+        }
+
+
+class Metrics:
+    """
+    Thread-safe timers, counters, latency histograms and error counts of a run.
+
+    Timers and counters take labels, like store="Selver". The time of a stage is summed over every
+    worker running it, so stages that run concurrently can add up to more than the run took.
+    """
+
+    def __init__(self) -> None:
+        self.lock: threading.Lock = threading.Lock()
+        self.started: float = time.time()
+        self.t1: float = time.perf_counter()
+        self.stages: typing.Dict[typing.Tuple[str, Labels], typing.List[float]] = {}
+        self.counters: typing.Dict[typing.Tuple[str, Labels], int] = {}
+        self.latencies: typing.Dict[str, Histogram] = {}
+        self.errors: typing.Dict[typing.Tuple[str, str], int] = {}
+        self.logger: logging.Logger = logging.getLogger("metrics")
+
+    def reset(self) -> None:
+        """
+        Forgets everything recorded and restarts the run clock.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.started = time.time()
+            self.t1 = time.perf_counter()
+            self.stages.clear()
+            self.counters.clear()
+            self.latencies.clear()
+            self.errors.clear()
+
+    def observe(self, stage: str, seconds: float, **labels: str) -> None:
+        """
+        Adds the time spent in a stage.
+
+        :param stage: The name of the stage.\n
+        :param seconds: The time spent.\n
+        :param labels: The labels of the stage.
+
+        :returns: None
+        """
+
+        key = (stage, tuple(sorted(labels.items())))
+        with self.lock:
+            if (timer := self.stages.get(key)) is None:
+                # Count, total seconds and the longest single time.
+                timer = self.stages[key] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    @contextlib.contextmanager
+    def timer(self, stage: str, **labels: str) -> typing.Iterator[None]:
+        """
+        Context manager that adds the time spent inside it to a stage.
+
+        :param stage: The name of the stage.\n
+        :param labels: The labels of the stage.
+        """
+
+        t1 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - t1, **labels)
+
+    def count(self, name: str, value: int = 1, **labels: str) -> None:
+        """
+        Increments a counter.
+
+        :param name: The name of the counter.\n
+        :param value: The increment.\n
+        :param labels: The labels of the counter.
+
+        :returns: None
+        """
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def latency(self, host: str, seconds: float) -> None:
+        """
+        Adds the latency of a request to the histogram of its host.
+
+        :param host: The host of the request.\n
+        :param seconds: The latency.
+
+        :returns: None
+        """
+
+        with self.lock:
+            if (histogram := self.latencies.get(host)) is None:
+                histogram = self.latencies[host] = Histogram()
+            histogram.observe(seconds)
+
+    def error(self, host: str, kind: str) -> None:
+        """
+        Counts an error.
+
+        :param host: The host of the request that failed.\n
+        :param kind: The type of the error, like the status or the name of the exception.
+
+        :returns: None
+        """
+
+        with self.lock:
+            self.errors[host, kind] = self.errors.get((host, kind), 0) + 1
+
+    def histogram(self, host: str = None) -> Histogram:
+        """
+        Returns the latencies of a host, or of every host merged.
+
+        :param host: The host, every host if None.
+
+        :returns: A copy of the histogram.
+        """
+
+        merged = Histogram()
+        with self.lock:
+            for name, histogram in self.latencies.items():
+                if host is None or name == host:
+                    merged.merge(histogram)
+        return merged
+
+    def total(self, name: str, **labels: str) -> int:
+        """
+        Returns the sum of a counter over every label it has, or over the ones matching the labels.
+
+        :param name: The name of the counter.\n
+        :param labels: The labels to match.
+
+        :returns: The sum.
+        """
+
+        with self.lock:
+            return sum(
+                value
+                for (counter, counter_labels), value in self.counters.items()
+                if counter == name and set(labels.items()) <= set(counter_labels)
+            )
+
+    def seconds(self, stage: str) -> float:
+        """
+        Returns the time spent in a stage over every label it has.
+
+        :param stage: The name of the stage.
+
+        :returns: The total seconds.
+        """
+
+        with self.lock:
+            return sum(timer[1] for (name, _), timer in self.stages.items() if name == stage)
+
+    def report(self, **extra: typing.Any) -> dict:
+        """
+        Returns the structured run report.
+
+        :param extra: More fields to add to the report.
+
+        :returns: The report.
+        """
+
+        duration = time.perf_counter() - self.t1
+        items = self.total("items")
+        with self.lock:
+            report = {
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(self.started)),
+                "duration": round(duration, 3),
+                "items": items,
+                "items_per_second": round(items / duration, 2) if duration > 0 else 0.0,
+                **extra,
+                "stages": [
+                    {
+                        "stage": stage,
+                        "labels": dict(labels),
+                        "count": count,
+                        "seconds": round(total, 6),
+                        "mean": round(total / count, 6) if count else 0.0,
+                        "max": round(longest, 6),
+                    }
+                    for (stage, labels), (count, total, longest) in sorted(self.stages.items())
+                ],
+                "counters": [
+                    {"counter": name, "labels": dict(labels), "value": value}
+                    for (name, labels), value in sorted(self.counters.items())
+                ],
+                "hosts": {
+                    host: {
+                        **histogram.to_dict(),
+                        "errors": {kind: n for (name, kind), n in sorted(self.errors.items()) if name == host},
+                    }
+                    for host, histogram in sorted(self.latencies.items())
+                },
+            }
+        return report
+
+    def write_report(self, path: str, **extra: typing.Any) -> None:
+        """
+        Writes the run report as JSON.
+
+        :param path: The path of the file.\n
+        :param extra: More fields to add to the report.
+
+        :returns: None
+        """
+
+        self.__write(path, json.dumps(self.report(**extra), indent=2))
+        self.logger.info("Wrote the run report to %s.", path)
+
+    def write_prometheus(self, path: str) -> None:
+        """
+        Writes the metrics in the Prometheus text format, for the node_exporter textfile collector.
+
+        :param path: The path of the file, it should end with .prom.
+
+        :returns: None
+        """
+
+        lines = [
+            f"# HELP {PREFIX}_stage_seconds_total Time spent in every stage of the run.",
+            f"# TYPE {PREFIX}_stage_seconds_total counter",
+        ]
+        with self.lock:
+            for (stage, labels), (_, total, _) in sorted(self.stages.items()):
+                lines.append(f"{PREFIX}_stage_seconds_total{self.__labels(labels, stage=stage)} {total:.6f}")
+
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {PREFIX}_{name}_total counter")
+                for (counter, labels), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(f"{PREFIX}_{name}_total{self.__labels(labels)} {value}")
+
+            lines.append(f"# TYPE {PREFIX}_request_errors_total counter")
+            for (host, kind), value in sorted(self.errors.items()):
+                lines.append(f"{PREFIX}_request_errors_total{self.__labels((), host=host, kind=kind)} {value}")
+
+            lines.append(f"# TYPE {PREFIX}_request_duration_seconds histogram")
+            for host, histogram in sorted(self.latencies.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(
+                        f"{PREFIX}_request_duration_seconds_bucket{self.__labels((), host=host, le=le)} {cumulative}"
+                    )
+                host_labels = self.__labels((), host=host)
+                lines.append(f"{PREFIX}_request_duration_seconds_sum{host_labels} {histogram.sum:.6f}")
+                lines.append(f"{PREFIX}_request_duration_seconds_count{host_labels} {histogram.count}")
+
+        lines.append(f"# TYPE {PREFIX}_run_duration_seconds gauge")
+        lines.append(f"{PREFIX}_run_duration_seconds {time.perf_counter() - self.t1:.3f}")
+        lines.append(f"# TYPE {PREFIX}_last_run_timestamp_seconds gauge")
+        lines.append(f"{PREFIX}_last_run_timestamp_seconds {self.started:.0f}")
+        self.__write(path, "\n".join(lines) + "\n")
+
+    def log_summary(self) -> None:
+        """
+        Logs where the time of the run went, longest stage first.
+
+        :returns: None
+        """
+
+        stages: typing.Dict[str, float] = {}
+        with self.lock:
+            for (stage, _), timer in self.stages.items():
+                stages[stage] = stages.get(stage, 0.0) + timer[1]
+
+        ordered = sorted(stages.items(), key=lambda stage: -stage[1])
+        self.logger.info("Time per stage: %s", ", ".join(f"{stage} {round(seconds, 2)}s" for stage, seconds in ordered))
+
+    @staticmethod
+    def __labels(labels: Labels, **more: str) -> str:
+        pairs = [*labels, *more.items()]
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    @staticmethod
+    def __write(path: str, text: str) -> None:
+        # Written to a temporary file first, so readers never see half a file.
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(f"{path}.tmp", path)
+
+
+# The metrics of the current run, shared by every stage.
+METRICS = Metrics()
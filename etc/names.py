@@ -0,0 +1,87 @@
+"""
+This module contains the product name normalizer shared by every store.
+
+Classes:
+    ParsedName: A normalized product name with the quantity and unit found in it.
+
+Functions:
+    parse_name: Normalizes a product name and extracts its quantity and unit.
+    normalize_name: Normalizes a product name.
+"""
+
+import functools
+import re
+import typing
+
+# Single character replacements, applied in one pass with str.translate.
+TRANSLATION = str.maketrans({"´": "'", "`": "'", "\u00a0": " "})
+# Multi character clean-ups, applied in one pass with a single substitution.
+CLEANUP = re.compile(r"&?amp;|\s{2,}")
+# Everything from the first size or pack marker on is cut off the name, "Piim 2,5% 1 l" -> "Piim",
+# along with a comma right before it. The pattern starts with a plain space and spells the cases of
+# the units out, so the regex engine skips ahead to the spaces instead of trying every position.
+SIZE_SUFFIX = re.compile(r" \d{1,4}?\d? ?(?:[gGlL/€xX×,]|[kK][gG]|[mM][lL]|[tT][kK])")
+QUANTITY = re.compile(
+    r"(?<![\d.,])(?P<quantity>\d+(?:[.,]\d+)?)\s?(?P<unit>kg|g|mg|ml|cl|dl|l|tk|pcs)(?!\w)",
+    flags=re.IGNORECASE,
+)
+
+
+class ParsedName(typing.NamedTuple):
+    """
+    A normalized product name with the quantity and unit found in it.
+
+    :param name: The normalized name.\n
+    :param quantity: The quantity, None if the name has none.\n
+    :param unit: The lowercase unit of the quantity, None if the name has none.
+    """
+
+    name: str
+    quantity: typing.Optional[float]
+    unit: typing.Optional[str]
+
+
+def _cleanup(match: re.Match) -> str:
+    return " " if match.group(0).isspace() else "&" if match.group(0)[0] == "&" else ""
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_name(product_name: str) -> ParsedName:
+    """
+    Normalizes a product name and extracts its quantity and unit.
+
+    The result is cached, the same names come back on every run and from every store.
+
+    :param product_name: The name of the product, as the store has it.
+
+    :returns: The parsed name.
+    """
+
+    # Most names need neither clean-up, checking first is cheaper than running them.
+    if "´" in product_name or "`" in product_name or "\u00a0" in product_name:
+        product_name = product_name.translate(TRANSLATION)
+    if "amp;" in product_name or "  " in product_name:
+        product_name = CLEANUP.sub(_cleanup, product_name)
+
+    quantity = unit = None
+    if (suffix := SIZE_SUFFIX.search(product_name)) is not None:
+        start = suffix.start()
+        # The quantity is part of the size suffix, so only the suffix is searched.
+        if (match := QUANTITY.search(product_name, start)) is not None:
+            quantity = float(match.group("quantity").replace(",", "."))
+            unit = match.group("unit").lower()
+        product_name = product_name[: start - 1 if start and product_name[start - 1] == "," else start]
+
+    return ParsedName(product_name.strip().title(), quantity, unit)
+
+
+def normalize_name(product_name: str) -> str:
+    """
+    Normalizes a product name.
+
+    :param product_name: The name of the product, as the store has it.
+
+    :returns: The normalized name.
+    """
+
+    return parse_name(product_name).name
@@ -0,0 +1,346 @@
+"""
+This module contains the streaming fetch -> parse -> write pipeline used by the scraping tasks.
+
+Classes:
+    DatabaseWriter: Single writer that serializes the batches of every running pipeline into the database.
+    Pipeline: Bounded producer/consumer pipeline that streams products from a store into the database.
+"""
+
+import asyncio
+import logging
+import queue
+import threading
+import time
+import typing
+
+from etc.cache import NOT_MODIFIED, ResponseCache
+from etc.checkpoint import Checkpoint
+from etc.data import DB_CONNECTOR
+from etc.decoding import Decoder
+from etc.fixtures import FixtureRecorder
+from etc.metrics import METRICS
+from etc.product import Product
+from etc.util import RequestScheduler, decode_body, request_page, stot
+
+if typing.TYPE_CHECKING:
+    import aiohttp
+
+# Marks the end of a queue, every worker that receives it passes it on and exits.
+_DONE = object()
+
+# MySQL deadlock and lock wait timeout errors. Shards writing at the same time can run into them,
+# the transaction is rolled back and the batch is written again.
+TRANSIENT_ERRNOS = {1205, 1213}
+WRITE_ATTEMPTS = 3
+
+
+class DatabaseWriter:
+    """
+    Single writer that serializes the batches of every running pipeline into the database.
+
+    The batches of every store running in the event loop go through a queue to one dedicated
+    writer thread, which writes and commits them on its own pooled connection. The event loop
+    never waits on MySQL, it only waits for the future of a batch while the fetchers keep going.
+    Use it as an async context manager.
+
+    :param queue_size: The maximum number of batches waiting to be written.
+    """
+
+    def __init__(self, queue_size: int = 8) -> None:
+        self.queue_size: int = queue_size
+        self.queue: queue.Queue = queue.Queue()
+        self.slots: asyncio.Semaphore = None
+        self.loop: asyncio.AbstractEventLoop = None
+        self.thread: threading.Thread = threading.Thread(target=self.__run, name="database-writer", daemon=True)
+        self.logger: logging.Logger = logging.getLogger("writer")
+
+    async def __aenter__(self) -> "DatabaseWriter":
+        self.loop = asyncio.get_running_loop()
+        self.slots = asyncio.Semaphore(self.queue_size)
+        self.thread.start()
+        return self
+
+    async def __aexit__(self, *_) -> None:
+        self.queue.put(_DONE)
+        await asyncio.to_thread(self.thread.join)
+
+    async def write(
+        self,
+        writer: typing.Callable[[typing.List[Product]], None],
+        items: typing.List[Product],
+        seen: typing.List[tuple],
+    ) -> None:
+        """
+        Writes and commits a batch, returns once it has been committed.
+
+        :param writer: Writes the items into the database.\n
+        :param items: The items to write.\n
+        :param seen: The url and the (ean, store) keys of every unchanged response, its products are marked as seen.
+
+        :returns: None
+        """
+
+        async with self.slots:
+            future = self.loop.create_future()
+            self.queue.put((writer, items, seen, future))
+            await future
+
+    def __run(self) -> None:
+        try:
+            while (entry := self.queue.get()) is not _DONE:
+                writer, items, seen, future = entry
+                try:
+                    self.__write(writer, items, seen)
+                except Exception as e:  # pylint: disable=broad-except
+                    self.logger.error("Failed to write %s items: %r", len(items), e)
+                    self.loop.call_soon_threadsafe(self.__resolve, future, e)
+                else:
+                    self.loop.call_soon_threadsafe(self.__resolve, future, None)
+        finally:
+            DB_CONNECTOR.release_connection()
+
+    def __write(self, writer: typing.Callable[[typing.List[Product]], None], items: list, seen: list) -> None:
+        for attempt in range(1, WRITE_ATTEMPTS + 1):
+            try:
+                with METRICS.timer("upsert"):
+                    writer(items)
+                with METRICS.timer("mark_seen"):
+                    DB_CONNECTOR.mark_seen(seen)
+                with METRICS.timer("commit"):
+                    DB_CONNECTOR.commit_transactions()
+                return
+            except Exception as e:  # pylint: disable=broad-except
+                self.__rollback()
+                if getattr(e, "errno", None) not in TRANSIENT_ERRNOS or attempt == WRITE_ATTEMPTS:
+                    raise
+                self.logger.warning("Writing %s items failed with %r, retrying.", len(items), e)
+                METRICS.count("write_retries")
+                time.sleep(0.1 * attempt)
+
+    def __rollback(self) -> None:
+        try:
+            DB_CONNECTOR.rollback_transactions()
+        except Exception as e:  # pylint: disable=broad-except
+            self.logger.error("Failed to roll back: %r", e)
+
+    @staticmethod
+    def __resolve(future: asyncio.Future, error: Exception = None) -> None:
+        if future.cancelled():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(None)
+
+
+class Pipeline:
+    """
+    Bounded producer/consumer pipeline that streams products from a store into the database.
+
+    A fixed pool of fetch workers requests the urls and feeds the payloads into a bounded queue,
+    parse workers turn the payloads into items and a writer drains the items in batches into the
+    shared database writer. Every queue is bounded, so memory stays flat no matter how many urls are
+    scanned and the database writes overlap with the network requests. With a response cache,
+    payloads that haven't changed since the last run are dropped before they are parsed and only
+    their products are marked as seen. Requests that failed are neither written nor checkpointed,
+    a resumed run requests them again and run reports them, so the products of the store aren't
+    removed over a network error.
+
+    :param session: The aiohttp session.\n
+    :param requests: An iterable of (url, product ids) pairs to request, consumed lazily.\n
+    :param parser: Turns a payload and the product ids it was requested for into a list of items.\n
+    :param writer: Writes a batch of items into the database.\n
+    :param logger: The logger of the scraping task.\n
+    :param database_writer: The database writer shared by every running pipeline.\n
+    :param scheduler: The scheduler that limits and retries the requests.\n
+    :param cache: The response cache used to skip unchanged payloads.\n
+    :param decoder: The JSON decoder of the responses.\n
+    :param recorder: Records the responses into a fixture archive.\n
+    :param store: The name of the store, labels the metrics of the pipeline.\n
+    :param checkpoint: Remembers the requests whose products have been committed, needs the store.\n
+    :param fetch_workers: The number of fetch workers, the scheduler decides how many of them request at once.\n
+    :param parse_workers: The number of parse workers.\n
+    :param batch_size: The number of items written to the database at once.\n
+    :param queue_size: The maximum number of entries waiting in each queue.
+    """
+
+    def __init__(
+        self,
+        session: "aiohttp.ClientSession",
+        requests: typing.Iterable[typing.Tuple[str, list]],
+        parser: typing.Callable[[dict, list], typing.List[Product]],
+        writer: typing.Callable[[typing.List[Product]], None],
+        logger: logging.Logger,
+        database_writer: DatabaseWriter,
+        scheduler: RequestScheduler = None,
+        cache: ResponseCache = None,
+        decoder: Decoder = None,
+        recorder: FixtureRecorder = None,
+        store: str = None,
+        checkpoint: Checkpoint = None,
+        fetch_workers: int = 20,
+        parse_workers: int = 2,
+        batch_size: int = 250,
+        queue_size: int = 100,
+    ) -> None:
+        self.session: "aiohttp.ClientSession" = session
+        self.requests: typing.Iterable[typing.Tuple[str, list]] = requests
+        self.parser = parser
+        self.writer = writer
+        self.logger: logging.Logger = logger
+        self.database_writer: DatabaseWriter = database_writer
+        self.scheduler: RequestScheduler = scheduler
+        self.cache: ResponseCache = cache
+        self.decoder: Decoder = decoder
+        self.recorder: FixtureRecorder = recorder
+        self.store: str = store
+        self.checkpoint: Checkpoint = checkpoint
+        self.labels: typing.Dict[str, str] = {"store": store} if store is not None else {}
+        self.fetch_workers: int = fetch_workers
+        self.parse_workers: int = parse_workers
+        self.batch_size: int = batch_size
+
+        self.url_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.payload_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.item_queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+
+        self.requested: int = 0
+        self.failed: int = 0
+        self.skipped: int = 0
+        self.unchanged: int = 0
+        self.written: int = 0
+
+    async def run(self) -> int:
+        """
+        Runs the pipeline until every url has been requested and every item has been written.
+
+        :returns: The number of items written into the database, failed holds the number of requests that failed.
+        """
+
+        t1 = time.perf_counter()
+        writer = asyncio.create_task(self.__writer())
+        parsers = [asyncio.create_task(self.__parser()) for _ in range(self.parse_workers)]
+        fetchers = [asyncio.create_task(self.__fetcher()) for _ in range(self.fetch_workers)]
+        feeder = asyncio.create_task(self.__feed(fetchers, parsers))
+
+        # Every worker is watched, a worker that dies would otherwise leave the others waiting on its queue.
+        tasks = [feeder, writer, *parsers, *fetchers]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+            errors = [task.exception() for task in tasks if task in done and not task.cancelled()]
+            if error := next((error for error in errors if error is not None), None):
+                raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        t2 = time.perf_counter()
+        for name in ("requested", "failed", "skipped", "unchanged"):
+            METRICS.count(name, getattr(self, name), **self.labels)
+        self.logger.info(
+            "Done inserting %s items in %s. %s seconds per item (%s requested, %s failed, %s skipped, %s unchanged)",
+            self.written,
+            stot(t2 - t1),
+            round((t2 - t1) / max(self.written, 1), 4),
+            self.requested,
+            self.failed,
+            self.skipped,
+            self.unchanged,
+        )
+        return self.written
+
+    async def __feed(self, fetchers: typing.List[asyncio.Task], parsers: typing.List[asyncio.Task]) -> None:
+        # Feeds the urls and ends every stage once the stage before it is done.
+        for request in self.requests:
+            await self.url_queue.put(request)
+
+        for _ in fetchers:
+            await self.url_queue.put(_DONE)
+        await asyncio.gather(*fetchers)
+
+        for _ in parsers:
+            await self.payload_queue.put(_DONE)
+        await asyncio.gather(*parsers)
+
+        await self.item_queue.put(_DONE)
+
+    async def __fetcher(self) -> None:
+        while (request := await self.url_queue.get()) is not _DONE:
+            url, product_ids = request
+            self.requested += 1
+            try:
+                # The request times the exchange with the host as the fetch stage and its wait for the
+                # scheduler apart. The body is decoded after it, so no two stages overlap.
+                payload = await request_page(
+                    session=self.session,
+                    url=url,
+                    scheduler=self.scheduler,
+                    cache=self.cache,
+                    decoder=self.decoder,
+                    recorder=self.recorder,
+                    raw=True,
+                    labels=self.labels,
+                )
+                if payload is not NOT_MODIFIED:
+                    payload = decode_body(payload, self.decoder, **self.labels)
+            except Exception as e:  # pylint: disable=broad-except
+                self.failed += 1
+                self.logger.debug("Failed to request %s: %r", url, e)
+                continue
+
+            if payload is NOT_MODIFIED:
+                self.unchanged += 1
+                await self.item_queue.put((url, None))
+                continue
+
+            await self.payload_queue.put((url, product_ids, payload))
+
+    async def __parser(self) -> None:
+        while (entry := await self.payload_queue.get()) is not _DONE:
+            url, product_ids, payload = entry
+            try:
+                with METRICS.timer("parse", **self.labels):
+                    items = [item for item in self.parser(payload, product_ids) if item]
+            except Exception as e:  # pylint: disable=broad-except
+                self.logger.debug("Failed to parse %s: %r", url, e)
+                items = []
+
+            if not items:
+                self.skipped += 1
+                if self.cache is not None:
+                    self.cache.commit([(url, [])])
+                if self.checkpoint is not None:
+                    self.checkpoint.commit(self.store, [url])
+                continue
+
+            await self.item_queue.put((url, items))
+
+    async def __writer(self) -> None:
+        batch, size = [], 0
+        while (entry := await self.item_queue.get()) is not _DONE:
+            batch.append(entry)
+            size += len(entry[1] or ())
+            if size >= self.batch_size or len(batch) >= self.batch_size:
+                await self.__flush(batch)
+                batch, size = [], 0
+
+        if batch:
+            await self.__flush(batch)
+
+    async def __flush(self, batch: typing.List[tuple]) -> None:
+        items = [item for _, url_items in batch if url_items is not None for item in url_items]
+        seen = [(url, self.cache.keys(url)) for url, url_items in batch if url_items is None]
+
+        await self.database_writer.write(self.writer, items, seen)
+        if self.cache is not None:
+            self.cache.commit(
+                (url, [item.key for item in url_items])
+                for url, url_items in batch
+                if url_items is not None
+            )
+        if self.checkpoint is not None:
+            self.checkpoint.commit(self.store, (url for url, _ in batch))
+        self.written += len(items)
+        METRICS.count("items", len(items), **self.labels)
+        self.logger.info("Inserted %s products into database.", self.written)
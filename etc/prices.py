@@ -0,0 +1,126 @@
+"""
+This module contains the records of the price history.
+
+Every run overwrites the prices of the products, so the history is kept apart from them: a record
+of the price in integer cents and its flags is appended for a product only when they change, keyed
+on the product and the run id, which is the unix time the run started. Both database backends
+store the records this way and return them as the records below.
+
+Classes:
+    PricePoint: The price of a product from a run on, until the next point.
+    PriceDrop: A product whose price dropped since a point in time.
+
+Functions:
+    cents: Converts a price in euros to integer cents.
+    price_record: Returns the price, unit price and flags of a product as they are stored.
+"""
+
+import typing
+
+from etc.product import Product
+
+# Bits of the flags of a record.
+FLAG_DISCOUNT = 1
+
+
+class PricePoint(typing.NamedTuple):
+    """
+    The price of a product from a run on, until the next point.
+
+    :param store: The name of the store.\n
+    :param run_id: The run the price was first seen in.\n
+    :param price: The price in euros.\n
+    :param unit_price: The price per unit in euros, None if the store has none.\n
+    :param is_discount: Whether the price is discounted.
+    """
+
+    store: str
+    run_id: int
+    price: float
+    unit_price: typing.Optional[float]
+    is_discount: bool
+
+    @classmethod
+    def from_record(
+        cls, store: str, run_id: int, price_cents: int, unit_price_cents: typing.Optional[int], flags: int
+    ) -> "PricePoint":
+        """
+        Builds a point from a stored record.
+
+        :param store: The name of the store.\n
+        :param run_id: The run the price was first seen in.\n
+        :param price_cents: The price in cents.\n
+        :param unit_price_cents: The price per unit in cents, None if the store has none.\n
+        :param flags: The flags of the record.
+
+        :returns: The point.
+        """
+
+        return cls(
+            store,
+            int(run_id),
+            price_cents / 100,
+            None if unit_price_cents is None else unit_price_cents / 100,
+            bool(flags & FLAG_DISCOUNT),
+        )
+
+
+class PriceDrop(typing.NamedTuple):
+    """
+    A product whose price dropped since a point in time.
+
+    :param ean: The EAN of the product.\n
+    :param store: The name of the store.\n
+    :param before: The price in euros at that point in time.\n
+    :param after: The current price in euros.\n
+    :param percentage: How much cheaper the product got, in percent of the price before.\n
+    :param run_id: The run the current price was first seen in.
+    """
+
+    ean: int
+    store: str
+    before: float
+    after: float
+    percentage: float
+    run_id: int
+
+    @classmethod
+    def from_record(cls, ean: int, store: str, before_cents: int, after_cents: int, run_id: int) -> "PriceDrop":
+        """
+        Builds a drop from the stored prices before and after.
+
+        :param ean: The EAN of the product.\n
+        :param store: The name of the store.\n
+        :param before_cents: The price in cents at that point in time.\n
+        :param after_cents: The current price in cents.\n
+        :param run_id: The run the current price was first seen in.
+
+        :returns: The drop.
+        """
+
+        percentage = round((before_cents - after_cents) / before_cents * 100, 1)
+        return cls(int(ean), store, before_cents / 100, after_cents / 100, percentage, int(run_id))
+
+
+def cents(price: typing.Optional[float]) -> typing.Optional[int]:
+    """
+    Converts a price in euros to integer cents, 1.99 -> 199.
+
+    :param price: The price in euros, None if there is none.
+
+    :returns: The price in cents, None if there is none.
+    """
+
+    return None if price is None else int(round(price * 100))
+
+
+def price_record(product: Product) -> typing.Tuple[int, typing.Optional[int], int]:
+    """
+    Returns the price, unit price and flags of a product as they are stored.
+
+    :param product: The product.
+
+    :returns: The price in cents, the unit price in cents and the flags.
+    """
+
+    return cents(product.price), cents(product.unit_price), FLAG_DISCOUNT if product.is_discount else 0
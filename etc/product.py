@@ -0,0 +1,78 @@
+"""
+This module contains the Product record the store parsers emit and the database consumes.
+
+Classes:
+    Product: A scraped product.
+"""
+
+import math
+import typing
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True, slots=True)
+class Product:
+    """
+    A scraped product.
+
+    The fields are validated and coerced once when the record is built, so the database layer can
+    bind them as parameters directly. Invalid values raise ValueError.
+
+    :param ean: The main EAN of the product.\n
+    :param store: The name of the store.\n
+    :param name: The normalized name.\n
+    :param price: The price in euros.\n
+    :param unit_price: The price per unit in euros, None if the store has none.\n
+    :param is_discount: Whether the price is discounted.\n
+    :param is_age_restricted: Whether the product is age restricted.\n
+    :param weight: The weight or volume, as the store has it.\n
+    :param url: The url of the product page.\n
+    :param category: The category.\n
+    :param image_url: The url of the image.\n
+    :param brand: The brand, "N/A" if unknown.\n
+    :param other_ean: The other EANs the product is sold under.
+    """
+
+    ean: int
+    store: str
+    name: str
+    price: float
+    unit_price: typing.Optional[float]
+    is_discount: bool
+    is_age_restricted: bool
+    weight: str
+    url: str
+    category: str
+    image_url: str
+    brand: str = "N/A"
+    other_ean: typing.Tuple[int, ...] = ()
+
+    def __post_init__(self) -> None:
+        ean = int(self.ean)
+        if ean <= 0:
+            raise ValueError(f"Invalid EAN {self.ean!r}")
+
+        object.__setattr__(self, "ean", ean)
+        object.__setattr__(self, "price", self.__price(self.price))
+        object.__setattr__(self, "unit_price", None if self.unit_price is None else self.__price(self.unit_price))
+        object.__setattr__(self, "is_discount", bool(self.is_discount))
+        object.__setattr__(self, "is_age_restricted", bool(self.is_age_restricted))
+        object.__setattr__(self, "brand", self.brand or "N/A")
+        object.__setattr__(
+            self, "other_ean", tuple(int(other) for other in self.other_ean or () if int(other) not in (0, ean))
+        )
+
+    @staticmethod
+    def __price(value: typing.Union[float, str]) -> float:
+        price = round(float(value), 2)
+        if not math.isfinite(price) or price < 0:
+            raise ValueError(f"Invalid price {value!r}")
+        return price
+
+    @property
+    def key(self) -> typing.Tuple[int, str]:
+        """
+        The (ean, store) key the product is stored under.
+        """
+
+        return self.ean, self.store
@@ -0,0 +1,248 @@
+"""
+This module contains the base class every store scraping task is built on.
+
+Classes:
+    StoreScraper: The base class for a store scraping task.
+
+Functions:
+    register_store: Class decorator that adds a store scraping task to STORES.
+"""
+
+import asyncio
+import logging
+import typing
+
+from etc.cache import ResponseCache
+from etc.checkpoint import Checkpoint
+from etc.category import unmapped_categories
+from etc.data import DB_CONNECTOR
+from etc.decoding import get_decoder
+from etc.fixtures import FixtureRecorder, replay_url
+from etc.ids import IdSource, valid_ean
+from etc.pipeline import DatabaseWriter, Pipeline
+from etc.product import Product
+from etc.util import RequestScheduler
+
+# Every registered store scraping task by its lowercase store name.
+STORES: typing.Dict[str, typing.Type["StoreScraper"]] = {}
+
+
+def register_store(scraper: typing.Type["StoreScraper"]) -> typing.Type["StoreScraper"]:
+    """
+    Class decorator that adds a store scraping task to STORES.
+
+    :param scraper: The store scraping task.
+
+    :returns: The store scraping task.
+    """
+
+    STORES[scraper.store.lower()] = scraper
+    return scraper
+
+
+class StoreScraper:
+    """
+    The base class for a store scraping task.
+
+    A store only has to set store and id_file and implement build_url and parse, reading the ids,
+    the connection limits, the streaming pipeline, retries and caching are shared by every store.
+    Stores whose API returns several products per request set batch_size to request them in batches.
+
+    :param file_name: The name of the file containing product ids, defaults to id_file.\n
+    :param ids: The list of product ids, used instead of the file if given.\n
+    :param debug: Whether to set the logging to debug or not.\n
+    :param scheduler: The scheduler that limits and retries the requests.\n
+    :param cache: The response cache used to skip products that haven't changed since the last run.\n
+    :param batch_size: The number of product ids per request, defaults to the batch_size of the store.\n
+    :param decoder: The JSON decoder backend, see etc.decoding.get_decoder.\n
+    :param recorder: Records the responses into a fixture archive.\n
+    :param replay: The base url of a replay server, the recorded responses are requested from it instead of the store.\n
+    :param checkpoint: Remembers the requests whose products have been committed, they are skipped when resuming.\n
+    :param shards: The number of shards the product ids are split into.\n
+    :param shard_index: The shard this task scrapes, from 0 to shards - 1.
+
+    :returns: None
+    """
+
+    # The name of the store, as stored in the database.
+    store: str = None
+    # The default file containing the product ids.
+    id_file: str = None
+    # The number of product ids requested at once.
+    batch_size: int = 1
+    # Whether the product ids are EANs, the ones with a wrong check digit are then skipped.
+    ean_ids: bool = False
+    # A msgspec type with only the fields parse uses. If msgspec is installed the responses are decoded into it,
+    # so parse must read its instances the same way it reads the dicts of the json module.
+    schema: typing.Any = None
+    headers: typing.Dict[str, str] = {"X-Requested-With": "XMLHttpRequest"}
+
+    def __init__(
+        self,
+        file_name: str = None,
+        ids: list = None,
+        debug: bool = False,
+        scheduler: RequestScheduler = None,
+        cache: ResponseCache = None,
+        batch_size: int = None,
+        decoder: str = "auto",
+        recorder: FixtureRecorder = None,
+        replay: str = None,
+        checkpoint: Checkpoint = None,
+        shards: int = 1,
+        shard_index: int = 0,
+    ):
+        self.file_name: str = file_name if file_name is not None or ids is not None else self.id_file
+        self.ids: list = ids
+        self.scheduler: RequestScheduler = scheduler or RequestScheduler()
+        self.cache: ResponseCache = cache
+        self.batch_size: int = batch_size or self.batch_size
+        self.decoder = get_decoder(decoder, self.schema)
+        self.recorder: FixtureRecorder = recorder
+        self.replay: str = replay
+        self.checkpoint: Checkpoint = checkpoint
+        self.resumed: int = 0
+        self.shards: int = shards
+        self.shard_index: int = shard_index
+        self.logger: logging.Logger = logging.getLogger(self.store.lower())
+        if debug:
+            self.logger.setLevel(logging.DEBUG)
+
+    def build_url(self, product_ids: list) -> str:
+        """
+        Builds the url that returns the products, there are at most batch_size of them.
+
+        :param product_ids: The ids of the products.
+
+        :returns: The url.
+        """
+
+        raise NotImplementedError
+
+    def parse(self, payload: dict, product_ids: list) -> typing.List[Product]:
+        """
+        Turns a payload into items.
+
+        :param payload: The decoded response.\n
+        :param product_ids: The ids of the products the payload was requested for.
+
+        :returns: The items, empty if the payload has no products.
+        """
+
+        raise NotImplementedError
+
+    def upsert(self, items: typing.List[Product]) -> None:
+        """
+        Writes a batch of items into the database, runs in the database writer thread.
+
+        :param items: The items to write.
+
+        :returns: None
+        """
+
+        DB_CONNECTOR.bulk_upsert(items)
+
+    def read_ids(self) -> IdSource:
+        """
+        Returns the product ids of the shard, the file is read lazily while the products are requested.
+
+        :returns: The unique and valid product ids.
+        """
+
+        return IdSource(
+            path=self.file_name,
+            ids=self.ids if self.file_name is None else None,
+            validator=valid_ean if self.ean_ids else None,
+            shards=self.shards,
+            shard_index=self.shard_index,
+        )
+
+    def start(self) -> None:
+        """
+        Starts the task.
+
+        :returns: None
+        """
+
+        asyncio.run(self.run())
+
+    async def run(self, database_writer: DatabaseWriter = None) -> bool:
+        """
+        Runs the task in the running event loop.
+
+        :param database_writer: The database writer shared with the other tasks, a new one is used if None.
+
+        :returns: True if every request succeeded, False if the products of some may be missing.
+        """
+
+        if database_writer is None:
+            async with DatabaseWriter() as database_writer:
+                return await self.__start_scanner(database_writer)
+        return await self.__start_scanner(database_writer)
+
+    async def __start_scanner(self, database_writer: DatabaseWriter) -> bool:
+        # aiohttp is only imported once a task runs, so importing the stores stays cheap.
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        self.logger.info("Starting %s task...", self.store)
+        ids = self.read_ids()
+
+        my_conn = aiohttp.TCPConnector(limit=self.scheduler.max_concurrency)
+        async with aiohttp.ClientSession(connector=my_conn) as session:
+            session.headers.update(self.headers)
+
+            self.logger.info("Streaming products into database...")
+            pipeline = Pipeline(
+                session=session,
+                requests=self.__requests(ids),
+                parser=self.parse,
+                writer=self.upsert,
+                logger=self.logger,
+                database_writer=database_writer,
+                scheduler=self.scheduler,
+                cache=self.cache,
+                decoder=self.decoder,
+                recorder=self.recorder,
+                store=self.store,
+                checkpoint=self.checkpoint,
+                fetch_workers=self.scheduler.max_concurrency,
+            )
+            await pipeline.run()
+            self.scheduler.log_summary(self.logger)
+        ids.log_summary(self.logger)
+
+        if self.resumed:
+            self.logger.info("Skipped %s requests that were committed before the run was resumed.", self.resumed)
+
+        if unmapped := unmapped_categories(self.store):
+            self.logger.warning(
+                "%s categories aren't mapped: %s",
+                len(unmapped),
+                ", ".join(f"{label} ({count})" for label, count in unmapped.most_common()),
+            )
+
+        if pipeline.failed:
+            self.logger.warning("%s requests failed, a resumed run requests them again.", pipeline.failed)
+        return pipeline.failed == 0
+
+    def __requests(self, ids: typing.Iterable[str]) -> typing.Iterator[typing.Tuple[str, list]]:
+        batch = []
+        for product_id in ids:
+            batch.append(product_id)
+            if len(batch) >= self.batch_size:
+                yield from self.__request(batch)
+                batch = []
+
+        if batch:
+            yield from self.__request(batch)
+
+    def __request(self, product_ids: list) -> typing.Iterator[typing.Tuple[str, list]]:
+        url = self.__url(product_ids)
+        if self.checkpoint is not None and self.checkpoint.done(self.store, url):
+            self.resumed += 1
+            return
+        yield url, product_ids
+
+    def __url(self, product_ids: list) -> str:
+        url = self.build_url(product_ids)
+        return replay_url(url, self.replay) if self.replay is not None else url
@@ -0,0 +1,278 @@
+"""
+This module contains the in-memory product search index.
+
+The index is built from the products after every run and saved to disk, so searching
+never asks MySQL. Names and brands are split into words folded to lowercase without diacritics,
+"Šokolaad" is found as "sokolaad", an inverted index finds the products of every word and a
+trigram index over the words finds the ones a query misspells. The last word of a query also
+matches as a prefix, so a query can be searched as it is typed.
+
+Classes:
+    SearchIndex: Inverted and trigram index over the names and brands of products.
+
+Functions:
+    fold: Lowercases a text and removes its diacritics.
+    words: Splits a text into folded words.
+    trigrams: Returns the trigrams of a word.
+"""
+
+import array
+import bisect
+import functools
+import heapq
+import logging
+import math
+import os
+import pickle
+import re
+import time
+import typing
+import unicodedata
+
+# The default index file, written after every run.
+SEARCH_INDEX_PATH = "resources/state/search.pickle"
+
+# Bumped whenever the layout of the index changes, older files are rebuilt.
+FORMAT = 2
+
+# How similar a word has to be to a query word to match it, as the Dice coefficient of their trigrams.
+SIMILARITY = 0.5
+
+# Words matched by their prefix or by their trigrams count for less than the word itself.
+PREFIX_WEIGHT = 0.8
+FUZZY_WEIGHT = 0.6
+
+# A prefix only matches this many words, the ones most products have.
+PREFIX_LIMIT = 32
+
+# Every query word a product matches adds this to its score, more than any single word can add,
+# so products matching more of the query always come first.
+MATCH_BONUS = 100.0
+
+# How much the price difference percentage raises the relevance, a 50% saving counts as 5% more relevant.
+PRICE_WEIGHT = 0.1
+
+WORD = re.compile(r"\w+")
+
+
+def fold(text: str) -> str:
+    """
+    Lowercases a text and removes its diacritics, "Õun Šokolaadis" -> "oun sokolaadis".
+
+    :param text: The text.
+
+    :returns: The folded text.
+    """
+
+    if text.isascii():
+        return text.lower()
+    decomposed = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def words(text: str) -> typing.List[str]:
+    """
+    Splits a text into folded words.
+
+    :param text: The text.
+
+    :returns: The words, in order.
+    """
+
+    return WORD.findall(fold(text)) if text else []
+
+
+@functools.lru_cache(maxsize=4096)
+def trigrams(word: str) -> typing.FrozenSet[str]:
+    """
+    Returns the trigrams of a word, padded so that short words and their first letters count.
+
+    :param word: The folded word.
+
+    :returns: The set of trigrams.
+    """
+
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+class SearchIndex:
+    """
+    Inverted and trigram index over the names and brands of products.
+
+    Results are ranked by how many query words they match and then by how well, every query word
+    a product matches adds the inverse document frequency of the word it matched, so rare words
+    count more than "piim". A bigger price difference raises the relevance slightly, so of products
+    that match about equally well the biggest saving comes first. Misspelled words are only looked
+    up in the trigram index when the word itself isn't in the index.
+
+    :param documents: The products, returned as they are by search.\n
+    :param vocabulary: The sorted words of every product.\n
+    :param postings: The ids of the products of every word, in the order of the vocabulary.\n
+    :param grams: The ids of the words of every trigram.\n
+    :param boosts: The price difference percentage of every product.
+    """
+
+    def __init__(
+        self,
+        documents: list,
+        vocabulary: typing.List[str],
+        postings: typing.List[array.array],
+        grams: typing.Dict[str, array.array],
+        boosts: array.array,
+    ) -> None:
+        self.documents: list = documents
+        self.vocabulary: typing.List[str] = vocabulary
+        self.postings: typing.List[array.array] = postings
+        self.grams: typing.Dict[str, array.array] = grams
+        self.boosts: array.array = boosts
+        self.word_ids: typing.Dict[str, int] = {word: i for i, word in enumerate(vocabulary)}
+        self.gram_counts: array.array = array.array("H", (len(trigrams.__wrapped__(word)) for word in vocabulary))
+        self.logger: logging.Logger = logging.getLogger("search")
+
+    @classmethod
+    def build(cls, products: typing.Iterable[typing.Tuple[typing.Any, str, str, float]]) -> "SearchIndex":
+        """
+        Builds the index.
+
+        :param products: The product, its name, brand and price difference percentage, for every product.
+
+        :returns: The index.
+        """
+
+        documents = []
+        boosts = array.array("d")
+        inverted: typing.Dict[str, typing.List[int]] = {}
+        for document, name, brand, price_difference in products:
+            doc_id = len(documents)
+            documents.append(document)
+            boosts.append(float(price_difference or 0))
+            for word in dict.fromkeys(words(name) + words(brand if brand != "N/A" else "")):
+                inverted.setdefault(word, []).append(doc_id)
+
+        vocabulary = sorted(inverted)
+        postings = [array.array("I", inverted[word]) for word in vocabulary]
+        grams: typing.Dict[str, array.array] = {}
+        for word_id, word in enumerate(vocabulary):
+            for gram in trigrams(word):
+                grams.setdefault(gram, array.array("I")).append(word_id)
+        return cls(documents, vocabulary, postings, grams, boosts)
+
+    @classmethod
+    def load(cls, path: str = SEARCH_INDEX_PATH) -> typing.Optional["SearchIndex"]:
+        """
+        Loads an index saved by save.
+
+        :param path: The path of the file.
+
+        :returns: The index, None if there is no file or it has an older format.
+        """
+
+        if not os.path.exists(path):
+            return None
+        with open(path, "rb") as f:
+            saved = pickle.load(f)
+        if saved.get("format") != FORMAT:
+            return None
+        return cls(saved["documents"], saved["vocabulary"], saved["postings"], saved["grams"], saved["boosts"])
+
+    def save(self, path: str = SEARCH_INDEX_PATH) -> None:
+        """
+        Saves the index, written to a temporary file first so readers never see half of it.
+
+        :param path: The path of the file.
+
+        :returns: None
+        """
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        saved = {
+            "format": FORMAT,
+            "documents": self.documents,
+            "vocabulary": self.vocabulary,
+            "postings": self.postings,
+            "grams": self.grams,
+            "boosts": self.boosts,
+        }
+        with open(f"{path}.tmp", "wb") as f:
+            pickle.dump(saved, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{path}.tmp", path)
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def search(self, query: str, count: int = 10) -> list:
+        """
+        Finds the products that best match a query.
+
+        :param query: The search query.\n
+        :param count: The number of results to return.
+
+        :returns: The best matching products, best first.
+        """
+
+        t1 = time.perf_counter()
+        query_words = list(dict.fromkeys(words(query)))
+        if not query_words or not self.documents:
+            return []
+
+        total = len(self.documents)
+        scores: typing.Dict[int, float] = {}
+        for position, word in enumerate(query_words):
+            best: typing.Dict[int, float] = {}
+            # A rarer word the query word expands to mustn't outweigh the query word itself.
+            exact = self.word_ids.get(word)
+            ceiling = math.log(1 + total / len(self.postings[exact])) if exact is not None else math.inf
+            for word_id, weight in self.__expand(word, prefix=position == len(query_words) - 1).items():
+                postings = self.postings[word_id]
+                weight = MATCH_BONUS + weight * min(ceiling, math.log(1 + total / len(postings)))
+                if not best:
+                    best = dict.fromkeys(postings, weight)
+                    continue
+                for doc_id in postings:
+                    if weight > best.get(doc_id, 0.0):
+                        best[doc_id] = weight
+            if not scores:
+                scores = best
+                continue
+            for doc_id, weight in best.items():
+                scores[doc_id] = scores.get(doc_id, 0.0) + weight
+
+        # The best candidates by relevance alone, then reranked with their price difference.
+        candidates = heapq.nlargest(count * 4, scores, key=scores.__getitem__)
+        ranked = sorted(candidates, key=lambda doc_id: -self.__relevance(scores[doc_id], doc_id))[:count]
+        self.logger.debug("Searched %r in %s ms.", query, round((time.perf_counter() - t1) * 1e3, 3))
+        return [self.documents[doc_id] for doc_id in ranked]
+
+    def __relevance(self, score: float, doc_id: int) -> float:
+        matched, relevance = divmod(score, MATCH_BONUS)
+        return matched * MATCH_BONUS + relevance * (1 + PRICE_WEIGHT * self.boosts[doc_id] / 100)
+
+    def __expand(self, word: str, prefix: bool) -> typing.Dict[int, float]:
+        # The words of the index a query word matches, with how much each match counts.
+        expanded: typing.Dict[int, float] = {}
+        if (exact := self.word_ids.get(word)) is not None:
+            expanded[exact] = 1.0
+
+        if prefix:
+            start = bisect.bisect_left(self.vocabulary, word)
+            end = bisect.bisect_left(self.vocabulary, word + "\uffff", start)
+            if end - start > PREFIX_LIMIT:
+                word_ids = heapq.nlargest(PREFIX_LIMIT, range(start, end), key=lambda i: len(self.postings[i]))
+            else:
+                word_ids = range(start, end)
+            for prefixed in word_ids:
+                expanded.setdefault(prefixed, PREFIX_WEIGHT)
+
+        # Only words that aren't in the index and are long enough to be misspelled are looked up by trigrams.
+        if exact is None and len(word) >= 4:
+            query_grams = trigrams(word)
+            shared: typing.Dict[int, int] = {}
+            for gram in query_grams:
+                for similar in self.grams.get(gram, ()):
+                    shared[similar] = shared.get(similar, 0) + 1
+            for similar, common in shared.items():
+                similarity = 2 * common / (len(query_grams) + self.gram_counts[similar])
+                if similarity >= SIMILARITY:
+                    expanded[similar] = max(expanded.get(similar, 0.0), FUZZY_WEIGHT * similarity)
+        return expanded
@@ -0,0 +1,393 @@
+"""
+This module contains the columnar snapshot of the products and matches written after every run.
+
+A snapshot is a single file readers map into memory, numeric columns are read as typed memoryviews
+without copying, store, category and brand are dictionary-encoded as small integer codes and text
+columns are one UTF-8 blob with an offset per row. So a reader can scan and aggregate millions of
+rows without a database connection and without unpacking rows it doesn't look at. The memoryviews
+can also be handed to numpy.frombuffer or pyarrow.py_buffer as they are.
+
+Layout: the magic, the column blocks aligned to 8 bytes, a JSON footer describing the tables and
+where their columns are, the length of the footer as 8 bytes and the magic again.
+
+Classes:
+    SnapshotWriter: Writes the tables of a snapshot column by column.
+    Snapshot: Maps a snapshot into memory and reads its tables.
+    Table: A table of a snapshot.
+    StringColumn: A text column of a snapshot, decoded one value at a time.
+    DictionaryColumn: A dictionary-encoded column of a snapshot.
+"""
+
+import array
+import itertools
+import json
+import mmap
+import os
+import struct
+import sys
+import time
+import typing
+
+# The default snapshot file, replaced after every run.
+SNAPSHOT_PATH = "resources/snapshots/products.snapshot"
+
+MAGIC = b"HPSNAP01"
+
+# Rows turned into columns at once.
+BATCH_SIZE = 8192
+
+NAN = float("nan")
+
+# Column kinds: "q" int64, "d" float64 (None is NaN), "B" bool, "str" text and "dict" dictionary-encoded text.
+PRODUCTS_SCHEMA = (
+    ("ean", "q"),
+    ("store", "dict"),
+    ("name", "str"),
+    ("brand", "dict"),
+    ("category", "dict"),
+    ("price", "d"),
+    ("unit_price", "d"),
+    ("is_discount", "B"),
+    ("is_age_restricted", "B"),
+    ("weight", "str"),
+    ("url", "str"),
+    ("image_url", "str"),
+    ("other_ean", "str"),
+)
+MATCHES_SCHEMA = (
+    ("id", "q"),
+    *PRODUCTS_SCHEMA,
+    ("price_difference_float", "d"),
+    ("price_difference_percentage", "d"),
+)
+
+
+def _align(f: typing.BinaryIO) -> None:
+    f.write(b"\0" * (-f.tell() % 8))
+
+
+class _ColumnBuilder:
+    # Collects the values of a column and writes its blocks.
+
+    def __init__(self, name: str, kind: str) -> None:
+        self.name: str = name
+        self.kind: str = kind
+        # Text columns keep where every value ends in the blob, after a leading 0.
+        typecode = "Q" if kind == "str" else "I" if kind == "dict" else kind
+        self.values: array.array = array.array(typecode, [0] if kind == "str" else [])
+        self.blob: bytearray = bytearray()
+        self.dictionary: typing.Dict[str, int] = {}
+
+    def extend(self, values: typing.Sequence) -> None:
+        if self.kind == "str":
+            encoded = [b"" if value is None else str(value).encode() for value in values]
+            # The first offset is already the last one of the previous batch.
+            offsets = itertools.accumulate(map(len, encoded), initial=self.values[-1])
+            self.values.extend(itertools.islice(offsets, 1, None))
+            self.blob += b"".join(encoded)
+        elif self.kind == "dict":
+            dictionary = self.dictionary
+            self.values.extend(
+                dictionary.setdefault(value, len(dictionary))
+                for value in ("" if value is None else str(value) for value in values)
+            )
+        elif self.kind == "d":
+            self.values.extend(NAN if value is None else float(value) for value in values)
+        else:
+            self.values.extend(int(value or 0) for value in values)
+
+    def write(self, f: typing.BinaryIO) -> dict:
+        if self.kind == "dict":
+            typecode = "B" if len(self.dictionary) <= 0xFF else "H" if len(self.dictionary) <= 0xFFFF else "I"
+            return {
+                "kind": "dict",
+                "dictionary": list(self.dictionary),
+                "codes": self.__block(f, array.array(typecode, self.values)),
+            }
+        if self.kind == "str":
+            typecode = "I" if len(self.blob) <= 0xFFFFFFFF else "Q"
+            return {
+                "kind": "str",
+                "offsets": self.__block(f, array.array(typecode, self.values)),
+                "data": self.__block(f, self.blob, "B"),
+            }
+        return {"kind": self.kind, "values": self.__block(f, self.values)}
+
+    @staticmethod
+    def __block(f: typing.BinaryIO, values: typing.Union[array.array, bytearray], typecode: str = None) -> dict:
+        _align(f)
+        offset = f.tell()
+        f.write(values)
+        return {"offset": offset, "length": f.tell() - offset, "type": typecode or values.typecode}
+
+
+class SnapshotWriter:
+    """
+    Writes the tables of a snapshot column by column.
+
+    The rows are only held as columns, which take a fraction of the memory of the rows, and the file
+    is written to a temporary file first and then replaces the snapshot, so readers that still map
+    the previous one keep reading it.
+
+    :param path: The path of the snapshot.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH) -> None:
+        self.path: str = path
+        self.tables: typing.Dict[str, typing.List[_ColumnBuilder]] = {}
+        self.rows: typing.Dict[str, int] = {}
+
+    def append(self, table: str, schema: typing.Sequence[typing.Tuple[str, str]], row: typing.Sequence) -> None:
+        """
+        Adds a row to a table.
+
+        :param table: The name of the table.\n
+        :param schema: The name and kind of every column of the table.\n
+        :param row: The values, in the order of the schema.
+
+        :returns: None
+        """
+
+        self.extend(table, schema, [row])
+
+    def extend(
+        self, table: str, schema: typing.Sequence[typing.Tuple[str, str]], rows: typing.Iterable[typing.Sequence]
+    ) -> None:
+        """
+        Adds rows to a table, the table exists even if there are none.
+
+        :param table: The name of the table.\n
+        :param schema: The name and kind of every column of the table.\n
+        :param rows: The rows, their values in the order of the schema.
+
+        :returns: None
+        """
+
+        columns = self.__table(table, schema)
+        rows = iter(rows)
+        while batch := list(itertools.islice(rows, BATCH_SIZE)):
+            for column, values in zip(columns, zip(*batch)):
+                column.extend(values)
+            self.rows[table] += len(batch)
+
+    def __table(self, table: str, schema: typing.Sequence[typing.Tuple[str, str]]) -> typing.List[_ColumnBuilder]:
+        if table not in self.tables:
+            self.tables[table] = [_ColumnBuilder(name, kind) for name, kind in schema]
+            self.rows[table] = 0
+        return self.tables[table]
+
+    def close(self, **meta: typing.Any) -> None:
+        """
+        Writes the snapshot.
+
+        :param meta: More fields for the footer, like the run id.
+
+        :returns: None
+        """
+
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.tmp", "wb") as f:
+            f.write(MAGIC)
+            footer = {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "byteorder": sys.byteorder,
+                **meta,
+                "tables": {
+                    table: {
+                        "rows": self.rows[table],
+                        "columns": {column.name: column.write(f) for column in columns},
+                    }
+                    for table, columns in self.tables.items()
+                },
+            }
+            encoded = json.dumps(footer).encode()
+            f.write(encoded)
+            f.write(struct.pack("<Q", len(encoded)))
+            f.write(MAGIC)
+        os.replace(f"{self.path}.tmp", self.path)
+
+
+class StringColumn:
+    """
+    A text column of a snapshot, decoded one value at a time.
+
+    :param offsets: Where every value ends in the data, after a leading 0.\n
+    :param data: The UTF-8 values, one after another.
+    """
+
+    def __init__(self, offsets: memoryview, data: memoryview) -> None:
+        self.offsets: memoryview = offsets
+        self.data: memoryview = data
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return str(self.data[self.offsets[i]:self.offsets[i + 1]], "utf-8")
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return (self[i] for i in range(len(self)))
+
+
+class DictionaryColumn:
+    """
+    A dictionary-encoded column of a snapshot.
+
+    Aggregating over the codes is much cheaper than over the values, a value is only looked up
+    in the dictionary when it is needed.
+
+    :param codes: The code of every row.\n
+    :param dictionary: The value of every code.
+    """
+
+    def __init__(self, codes: memoryview, dictionary: typing.List[str]) -> None:
+        self.codes: memoryview = codes
+        self.dictionary: typing.List[str] = dictionary
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, i: int) -> str:
+        return self.dictionary[self.codes[i]]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        return (self.dictionary[code] for code in self.codes)
+
+    def code(self, value: str) -> typing.Optional[int]:
+        """
+        Returns the code of a value.
+
+        :param value: The value.
+
+        :returns: The code, None if no row has the value.
+        """
+
+        try:
+            return self.dictionary.index(value)
+        except ValueError:
+            return None
+
+
+class Table:
+    """
+    A table of a snapshot.
+
+    Numeric columns are typed memoryviews over the mapped file, text columns are StringColumn and
+    dictionary-encoded ones DictionaryColumn.
+
+    :param snapshot: The snapshot the table is in.\n
+    :param name: The name of the table.\n
+    :param footer: The description of the table in the footer.
+    """
+
+    def __init__(self, snapshot: "Snapshot", name: str, footer: dict) -> None:
+        self.snapshot: "Snapshot" = snapshot
+        self.name: str = name
+        self.rows: int = footer["rows"]
+        self.footer: typing.Dict[str, dict] = footer["columns"]
+        self.cache: typing.Dict[str, typing.Any] = {}
+
+    def __len__(self) -> int:
+        return self.rows
+
+    @property
+    def columns(self) -> typing.List[str]:
+        """
+        The names of the columns.
+        """
+
+        return list(self.footer)
+
+    def column(self, name: str) -> typing.Union[memoryview, StringColumn, DictionaryColumn]:
+        """
+        Returns a column without copying it.
+
+        :param name: The name of the column.
+
+        :returns: The column.
+        """
+
+        if name not in self.cache:
+            column = self.footer[name]
+            if column["kind"] == "str":
+                self.cache[name] = StringColumn(
+                    self.snapshot.block(column["offsets"]), self.snapshot.block(column["data"])
+                )
+            elif column["kind"] == "dict":
+                self.cache[name] = DictionaryColumn(self.snapshot.block(column["codes"]), column["dictionary"])
+            else:
+                self.cache[name] = self.snapshot.block(column["values"])
+        return self.cache[name]
+
+    def row(self, i: int) -> dict:
+        """
+        Returns a row, for reading single rows, use the columns to scan.
+
+        :param i: The index of the row.
+
+        :returns: The values of the row by column name.
+        """
+
+        return {name: self.column(name)[i] for name in self.footer}
+
+
+class Snapshot:
+    """
+    Maps a snapshot into memory and reads its tables.
+
+    The columns are views over the mapped file, so the file is only read as far as they are used
+    and several processes reading the same snapshot share its pages.
+
+    :param path: The path of the snapshot.
+    """
+
+    def __init__(self, path: str = SNAPSHOT_PATH) -> None:
+        with open(path, "rb") as f:
+            self.mmap: mmap.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mmap[:8] != MAGIC or self.mmap[-8:] != MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+
+        length = struct.unpack("<Q", self.mmap[-16:-8])[0]
+        self.meta: dict = json.loads(self.mmap[-16 - length:-16])
+        self.swap: bool = self.meta["byteorder"] != sys.byteorder
+        self.tables: typing.Dict[str, Table] = {
+            name: Table(self, name, table) for name, table in self.meta.pop("tables").items()
+        }
+
+    def __enter__(self) -> "Snapshot":
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def __getitem__(self, name: str) -> Table:
+        return self.tables[name]
+
+    def block(self, block: dict) -> typing.Union[memoryview, array.array]:
+        """
+        Returns a block of the file as a typed view.
+
+        :param block: The description of the block in the footer.
+
+        :returns: The view, or a byte-swapped copy if the file was written with the other byte order.
+        """
+
+        view = memoryview(self.mmap)[block["offset"]:block["offset"] + block["length"]].cast(block["type"])
+        if self.swap and view.itemsize > 1:
+            copy = array.array(block["type"], view)
+            copy.byteswap()
+            return copy
+        return view
+
+    def close(self) -> None:
+        """
+        Unmaps the snapshot, it stays mapped as long as views of its columns are still used.
+
+        :returns: None
+        """
+
+        self.tables.clear()
+        try:
+            self.mmap.close()
+        except BufferError:
+            pass
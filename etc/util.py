@@ -2,17 +2,37 @@
 This file contains utility functions.
 
 Functions:
-    download_img: Downloads an image from a url.
-    download_images: Downloads all images from the database.
     stot: Converts seconds to a time format.
     swap: Swaps two values in a list.
     diff: Returns the percentage difference between two numbers.
     request_page: Requests a page from a url.
+    read_response: Reads a response, checking it against the response cache.
+    decode_body: Decodes a JSON response body, timing it as the decode stage.
+
+Classes:
+    TokenBucket: Token bucket rate limiter.
+    AdaptiveLimiter: AIMD concurrency limiter for a single host.
+    RequestScheduler: Schedules requests with per-host adaptive concurrency, rate limiting and retries.
 """
 
+import asyncio
+import json
+import logging
+import random
+import time
 import typing
+from urllib.parse import urlsplit
+
+if typing.TYPE_CHECKING:
+    import aiohttp
+
+from etc.cache import NOT_MODIFIED, ResponseCache
+from etc.decoding import Decoder
+from etc.fixtures import FixtureRecorder
+from etc.metrics import METRICS
 
-from aiohttp import ClientSession
+# Statuses that mean the host is overloaded or throttling us, these are retried.
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
 
 
 def stot(seconds: float) -> str:
@@ -63,7 +83,16 @@ def diff(first_number: float, second_number: float) -> float:
 
 
 async def request_page(
-    session: ClientSession, url: str, page_id: str = None, not_json=False
+    session: "aiohttp.ClientSession",
+    url: str,
+    page_id: str = None,
+    not_json=False,
+    scheduler: "RequestScheduler" = None,
+    cache: ResponseCache = None,
+    decoder: Decoder = None,
+    recorder: FixtureRecorder = None,
+    raw: bool = False,
+    labels: typing.Dict[str, str] = None,
 ) -> typing.Coroutine:
     """
     Requests a page and returns the response.
@@ -71,12 +100,372 @@ async def request_page(
     :param session: The aiohttp session.\n
     :param url: The url to request.\n
     :param page_id: The page id to replace in the url.\n
-    :param not_json: Whether to return the response as text or json.
+    :param not_json: Whether to return the response as text or json.\n
+    :param scheduler: The scheduler that limits and retries the request.\n
+    :param cache: The response cache, makes the request conditional.\n
+    :param decoder: The JSON decoder, the stdlib json module is used if None.\n
+    :param recorder: Records the response into a fixture archive.\n
+    :param raw: Whether to return the body undecoded, for callers that time decoding apart.\n
+    :param labels: The labels of the fetch and schedule_wait stages the request is timed in.
 
-    :returns: The response.
+    :returns: The response, or NOT_MODIFIED if the cache says it hasn't changed.
     """
 
     if page_id is not None:
         url = url.replace("%REPLACE", page_id)
-    async with session.get(url) as response:
+    if scheduler is not None:
+        return await scheduler.request(
+            session=session,
+            url=url,
+            not_json=not_json,
+            cache=cache,
+            decoder=decoder,
+            recorder=recorder,
+            raw=raw,
+            labels=labels,
+        )
+    headers = cache.conditional_headers(url) if cache is not None else None
+    with METRICS.timer("fetch", **(labels or {})):
+        async with session.get(url, headers=headers) as response:
+            return await read_response(response, url, not_json, cache, decoder, recorder, raw)
+
+
+async def read_response(
+    response: "aiohttp.ClientResponse",
+    url: str,
+    not_json: bool = False,
+    cache: ResponseCache = None,
+    decoder: Decoder = None,
+    recorder: FixtureRecorder = None,
+    raw: bool = False,
+) -> typing.Any:
+    """
+    Reads a response, checking it against the response cache.
+
+    :param response: The aiohttp response.\n
+    :param url: The requested url.\n
+    :param not_json: Whether to return the response as text or json.\n
+    :param cache: The response cache.\n
+    :param decoder: The JSON decoder, the stdlib json module is used if None.\n
+    :param recorder: Records the response into a fixture archive.\n
+    :param raw: Whether to return the body undecoded.
+
+    :returns: The response, or NOT_MODIFIED if the cache says it hasn't changed.
+    """
+
+    if cache is None and decoder is None and recorder is None and not raw:
         return await response.text() if not_json else await response.json()
+
+    if cache is not None and response.status == 304:
+        cache.not_modified()
+        return NOT_MODIFIED
+
+    body = await response.read()
+    if recorder is not None:
+        recorder.record(url, response.status, response.content_type, body)
+    if cache is not None and not cache.changed(url, body, response.headers):
+        return NOT_MODIFIED
+
+    if raw:
+        return body
+    if not_json:
+        return body.decode(response.get_encoding())
+    return decode_body(body, decoder)
+
+
+def decode_body(body: bytes, decoder: Decoder = None, **labels: str) -> typing.Any:
+    """
+    Decodes a JSON response body, timing it as the decode stage.
+
+    :param body: The body of the response.\n
+    :param decoder: The JSON decoder, the stdlib json module is used if None.\n
+    :param labels: The labels of the decode stage.
+
+    :returns: The decoded response.
+    """
+
+    with METRICS.timer("decode", **labels):
+        return decoder.decode(body) if decoder is not None else json.loads(body)
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter.
+
+    :param rate: The number of tokens added per second, 0 disables the limit.\n
+    :param capacity: The maximum number of tokens, defaults to one second worth of tokens.
+    """
+
+    def __init__(self, rate: float, capacity: float = None) -> None:
+        self.rate: float = rate
+        self.capacity: float = capacity or max(rate, 1.0)
+        self.tokens: float = self.capacity
+        self.updated: float = time.monotonic()
+        self.lock: asyncio.Lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """
+        Waits until a token is available and takes it.
+
+        :returns: None
+        """
+
+        if self.rate <= 0:
+            return
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter for a single host.
+
+    The limit grows by one every full window of healthy responses and is multiplied by
+    decrease_factor when a request fails or the smoothed latency drifts above
+    latency_tolerance times the fastest latency seen, at most once per window.
+
+    :param initial: The starting concurrency.\n
+    :param minimum: The lowest concurrency.\n
+    :param maximum: The highest concurrency.\n
+    :param latency_tolerance: How many times slower than the fastest response is considered congested.\n
+    :param decrease_factor: What the limit is multiplied with on congestion.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        latency_tolerance: float = 3.0,
+        decrease_factor: float = 0.5,
+    ) -> None:
+        self.limit: float = float(initial)
+        self.minimum: int = minimum
+        self.maximum: int = maximum
+        self.latency_tolerance: float = latency_tolerance
+        self.decrease_factor: float = decrease_factor
+
+        self.in_flight: int = 0
+        self.latency: float = None
+        self.min_latency: float = None
+        self.last_decrease: float = 0.0
+        self.condition: asyncio.Condition = asyncio.Condition()
+
+    async def acquire(self) -> float:
+        """
+        Waits for a free slot and takes it.
+
+        :returns: The time the slot was taken, which has to be passed to release.
+        """
+
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return time.monotonic()
+
+    async def release(self, started: float, healthy: bool) -> None:
+        """
+        Frees a slot and adjusts the limit.
+
+        :param started: The time returned by acquire.\n
+        :param healthy: Whether the host answered without errors.
+
+        :returns: None
+        """
+
+        now = time.monotonic()
+        latency = now - started
+        async with self.condition:
+            self.in_flight -= 1
+            if healthy:
+                self.latency = latency if self.latency is None else self.latency * 0.8 + latency * 0.2
+                self.min_latency = latency if self.min_latency is None else min(self.min_latency, latency)
+
+            congested = not healthy or self.latency > self.min_latency * self.latency_tolerance
+            if congested:
+                # Only requests started after the last decrease may decrease again.
+                if started > self.last_decrease:
+                    self.limit = max(float(self.minimum), self.limit * self.decrease_factor)
+                    self.last_decrease = now
+            else:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+
+            self.condition.notify_all()
+
+
+class RequestScheduler:
+    """
+    Schedules requests with per-host adaptive concurrency, rate limiting and retries.
+
+    :param concurrency: The starting concurrency per host.\n
+    :param min_concurrency: The lowest concurrency per host.\n
+    :param max_concurrency: The highest concurrency per host.\n
+    :param rate: The maximum number of requests per second per host, 0 disables the limit.\n
+    :param burst: The number of requests that may be sent at once above the rate.\n
+    :param retries: How many times a single request is retried.\n
+    :param retry_budget: The share of requests that may be retries, keeps retries from piling up during an outage.\n
+    :param backoff: The base delay between retries in seconds.\n
+    :param max_backoff: The longest delay between retries in seconds.\n
+    :param timeout: The total timeout of a single request in seconds.\n
+    :param connect_timeout: The timeout of connecting to the host in seconds.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = 20,
+        min_concurrency: int = 2,
+        max_concurrency: int = 64,
+        rate: float = 0.0,
+        burst: float = None,
+        retries: int = 3,
+        retry_budget: float = 0.2,
+        backoff: float = 0.5,
+        max_backoff: float = 30.0,
+        timeout: float = 30.0,
+        connect_timeout: float = 10.0,
+    ) -> None:
+        self.concurrency: int = concurrency
+        self.min_concurrency: int = min_concurrency
+        self.max_concurrency: int = max(max_concurrency, concurrency)
+        self.rate: float = rate
+        self.burst: float = burst
+        self.retries: int = retries
+        self.retry_budget: float = retry_budget
+        self.backoff: float = backoff
+        self.max_backoff: float = max_backoff
+        # aiohttp is only imported by the code that requests, so importing this module stays cheap.
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        self.timeout: aiohttp.ClientTimeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+
+        self.limiters: typing.Dict[str, AdaptiveLimiter] = {}
+        self.buckets: typing.Dict[str, TokenBucket] = {}
+        self.requests: int = 0
+        self.retried: int = 0
+        self.errors: typing.Dict[str, int] = {}
+        self.logger: logging.Logger = logging.getLogger("scheduler")
+
+    async def request(
+        self,
+        session: "aiohttp.ClientSession",
+        url: str,
+        not_json: bool = False,
+        cache: ResponseCache = None,
+        decoder: Decoder = None,
+        recorder: FixtureRecorder = None,
+        raw: bool = False,
+        labels: typing.Dict[str, str] = None,
+    ) -> typing.Any:
+        """
+        Requests a page, retrying with jittered exponential backoff when the host fails or throttles.
+
+        Only the exchange with the host is timed as the fetch stage. Waiting for the rate and
+        concurrency limits and the backoff between retries is timed as the schedule_wait stage.
+
+        :param session: The aiohttp session.\n
+        :param url: The url to request.\n
+        :param not_json: Whether to return the response as text or json.\n
+        :param cache: The response cache, makes the request conditional.\n
+        :param decoder: The JSON decoder, the stdlib json module is used if None.\n
+        :param recorder: Records the response into a fixture archive.\n
+        :param raw: Whether to return the body undecoded.\n
+        :param labels: The labels of the stages the request is timed in.
+
+        :returns: The response, or NOT_MODIFIED if the cache says it hasn't changed.
+        """
+
+        import aiohttp  # pylint: disable=import-outside-toplevel
+
+        labels = labels or {}
+        host = urlsplit(url).hostname
+        if host not in self.limiters:
+            self.limiters[host] = AdaptiveLimiter(self.concurrency, self.min_concurrency, self.max_concurrency)
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        limiter, bucket = self.limiters[host], self.buckets[host]
+
+        attempt = 0
+        while True:
+            self.requests += 1
+            retry_after = None
+            healthy = False
+
+            waited = time.perf_counter()
+            await bucket.acquire()
+            started = await limiter.acquire()
+            METRICS.observe("schedule_wait", time.perf_counter() - waited, **labels)
+            try:
+                headers = cache.conditional_headers(url) if cache is not None else None
+                async with session.get(url, headers=headers, timeout=self.timeout) as response:
+                    if response.status in RETRY_STATUSES:
+                        retry_after = response.headers.get("Retry-After")
+                        error = aiohttp.ClientResponseError(
+                            response.request_info,
+                            response.history,
+                            status=response.status,
+                            message=response.reason,
+                            headers=response.headers,
+                        )
+                    else:
+                        healthy = True
+                        return await read_response(response, url, not_json, cache, decoder, recorder, raw)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            finally:
+                elapsed = time.monotonic() - started
+                METRICS.latency(host, elapsed)
+                METRICS.observe("fetch", elapsed, **labels)
+                await limiter.release(started, healthy)
+
+            name = f"{error.status}" if isinstance(error, aiohttp.ClientResponseError) else type(error).__name__
+            self.errors[name] = self.errors.get(name, 0) + 1
+            METRICS.error(host, name)
+
+            if attempt >= self.retries or self.retried >= self.retry_budget * self.requests + self.retries:
+                raise error
+
+            attempt += 1
+            self.retried += 1
+            delay = self.__backoff_delay(attempt, retry_after)
+            self.logger.debug("Retrying %s in %s seconds after %s.", url, round(delay, 2), name)
+            with METRICS.timer("schedule_wait", **labels):
+                await asyncio.sleep(delay)
+
+    def __backoff_delay(self, attempt: int, retry_after: str = None) -> float:
+        # Full jitter, unless the host told us how long to wait.
+        if retry_after is not None and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def log_summary(self, logger: logging.Logger) -> None:
+        """
+        Logs the state of every host the scheduler has requested.
+
+        :param logger: The logger to log to.
+
+        :returns: None
+        """
+
+        logger.info(
+            "%s requests, %s retries, errors: %s",
+            self.requests,
+            self.retried,
+            self.errors or "none",
+        )
+        for host, limiter in self.limiters.items():
+            histogram = METRICS.histogram(host)
+            logger.info(
+                "%s: concurrency %s, latency %s seconds, p50 %s p99 %s",
+                host,
+                int(limiter.limit),
+                round(limiter.latency or 0, 3),
+                round(histogram.quantile(0.5), 3),
+                round(histogram.quantile(0.99), 3),
+            )
@@ -2,34 +2,189 @@
 This module contains the main entry point for the program.
 """
 
+import asyncio
+import importlib
 import logging
 import os
+import subprocess
 import sys
 import time
-from argparse import ArgumentParser
+from argparse import ArgumentParser, Namespace
 
-from etc.data import DB_CONNECTOR
+from etc.cache import CACHE_PATH, ResponseCache
+from etc.checkpoint import CHECKPOINT_PATH, Checkpoint
+from etc.coordinator import Coordinator
+from etc.decoding import BACKENDS
+from etc.fixtures import FixtureRecorder
+from etc.metrics import METRICS
+from etc.data import DB_CONNECTOR, offline, state_path
+from etc.scraper import STORES
 from etc.util import stot
-from prisma import Prisma
-from selver import Selver
+
+# The store modules, named like the stores. Importing one registers its scraping task, they are only
+# imported once the arguments are parsed, so --help doesn't import what the stores need.
+STORE_MODULES = ("prisma", "selver")
 
 
 argparser = ArgumentParser()
 argparser.add_argument("-d", "--debug", help="Set the logging to debug mode", action="store_true", required=False)
 argparser.add_argument("--dummy", help="Don't delete any data from the database", action="store_true", required=False)
-args = argparser.parse_args()
-
-logging.basicConfig(
-    format="[%(asctime)s] [%(name)s/%(levelname)s]: %(message)s",
-    datefmt="%d-%b-%y %H:%M:%S",
-    level=logging.INFO,
+argparser.add_argument(
+    "-i",
+    "--incremental",
+    help="Skip the products that haven't changed since the last run",
+    action="store_true",
+    required=False,
+)
+argparser.add_argument(
+    "-s",
+    "--stores",
+    help="The stores to scrape, defaults to every store",
+    nargs="+",
+    choices=STORE_MODULES,
+    default=list(STORE_MODULES),
+    required=False,
+)
+argparser.add_argument(
+    "--decoder",
+    help="The JSON decoder of the responses, defaults to the fastest installed one",
+    choices=BACKENDS,
+    default="auto",
+    required=False,
+)
+argparser.add_argument(
+    "--record",
+    help="Record the responses into a fixture archive, like resources/fixtures.zip",
+    metavar="FILE",
+    required=False,
+)
+argparser.add_argument(
+    "--replay",
+    help="Request the recorded responses from a replay server, like http://127.0.0.1:8080",
+    metavar="URL",
+    required=False,
+)
+argparser.add_argument(
+    "--resume",
+    help="Continue the last run from its checkpoint if it didn't finish",
+    action="store_true",
+    required=False,
+)
+argparser.add_argument(
+    "--report",
+    help="Write a JSON report of where the time of the run went, like resources/reports/run.json",
+    metavar="FILE",
+    required=False,
+)
+argparser.add_argument(
+    "--prometheus",
+    help="Write the metrics of the run as a Prometheus textfile, like /var/lib/node_exporter/hocus.prom",
+    metavar="FILE",
+    required=False,
+)
+argparser.add_argument(
+    "--images",
+    help="Mirror the product images into images/ once the products are matched",
+    action="store_true",
+    required=False,
+)
+argparser.add_argument(
+    "--shards",
+    help="Split the product ids into this many shards, run by as many processes",
+    type=int,
+    default=1,
+    required=False,
+)
+argparser.add_argument(
+    "--shard-index",
+    help="Only scrape this shard, without it every shard is launched locally",
+    type=int,
+    required=False,
+)
+argparser.add_argument(
+    "--run-id",
+    help="The id of the run, the unix time it started at, the shards of one run have to share it",
+    type=int,
+    required=False,
+)
+argparser.add_argument(
+    "--finalize",
+    help="Don't scrape, only finish the run of --run-id after its shards ran on other machines",
+    action="store_true",
+    required=False,
 )
+
 logger = logging.getLogger("main")
 
+# 2020-01-01, no run of the scraper is older, so an earlier run id can only be a mistake.
+EARLIEST_RUN_ID = 1577836800
+
+
+def parse_args(argv: list = None) -> Namespace:
+    """
+    Parses and checks the command line arguments.
+
+    :param argv: The arguments, defaults to the ones of the process.
+
+    :returns: The parsed arguments.
+    """
+
+    args = argparser.parse_args(argv)
+    if args.finalize and (args.run_id is None or args.shard_index is not None):
+        argparser.error("--finalize needs --run-id and can't be used with --shard-index")
+    if args.shards < 1 or args.shard_index is not None and not 0 <= args.shard_index < args.shards:
+        argparser.error("--shard-index has to be between 0 and --shards - 1")
+    if args.shards > 1 and args.record is not None:
+        argparser.error("--record can't be used with --shards")
+    # The price history dates its records by the run id, so it has to be a time the run could have started at.
+    if args.run_id is not None and not EARLIEST_RUN_ID <= args.run_id <= time.time() + 86400:
+        argparser.error("--run-id has to be the unix time in seconds the run started at")
+    return args
+
+
+def load_stores(stores: list) -> None:
+    """
+    Imports the store modules, which registers their scraping tasks in STORES.
+
+    :param stores: The names of the stores.
+
+    :returns: None
+    """
+
+    for store in stores:
+        importlib.import_module(store)
+
+
+def shard_path(args: Namespace, path: str, shard_index: int = None) -> str:
+    """
+    Returns the path of a per-shard file, every shard process writes its own.
+
+    :param args: The command line arguments.\n
+    :param path: The path of the file without shards.\n
+    :param shard_index: The shard, defaults to the shard of this process.
 
-def main():
+    :returns: The path, unchanged if there is no shard.
+    """
+
+    shard_index = args.shard_index if shard_index is None else shard_index
+    if shard_index is None:
+        return path
+    root, extension = os.path.splitext(path)
+    return f"{root}-{shard_index}-of-{args.shards}{extension}"
+
+
+def main(argv: list = None):
     """Main entry point for the program."""
-    if not os.path.exists(".env"):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    args = parse_args(argv)
+    shard = f" {args.shard_index + 1}/{args.shards}" if args.shard_index is not None else ""
+    logging.basicConfig(
+        format=f"[%(asctime)s] [%(name)s{shard}/%(levelname)s]: %(message)s",
+        datefmt="%d-%b-%y %H:%M:%S",
+        level=logging.INFO,
+    )
+
+    if not os.path.exists(".env") and not offline():
         logger.error("Missing '.env' file. Please copy '.env.template' into '.env' and add valid credentials.")
         sys.exit(1)
     
@@ -38,29 +193,167 @@ def main():
         logging.getLogger().setLevel(logging.DEBUG)
         DB_CONNECTOR.debug = args.debug
 
-    if not os.path.exists("resources/cacert.pem"):
-        logger.debug("Downloading cacert.pem.")
-        os.system("curl -o resources/cacert.pem https://curl.haxx.se/ca/cacert.pem")
-
     if args.dummy:
         logger.info("Setting dummy mode.")
         DB_CONNECTOR.dummy = args.dummy
 
     if DB_CONNECTOR.is_connected():
         t1 = time.perf_counter()
+        load_stores(args.stores)
+
+        with METRICS.timer("prepare"):
+            DB_CONNECTOR.prepare_tables()
+
+        if args.finalize:
+            DB_CONNECTOR.run_id = args.run_id
+            finished = [STORES[store].store for store in args.stores]
+        elif args.shards > 1 and args.shard_index is None:
+            finished = launch_shards(args, argv)
+        else:
+            finished = scrape(args)
 
-        # Delete all rows from the Products table before adding new ones.
-        DB_CONNECTOR.delete_rows("Products")
+        # Only the process that launched the shards, or the only process, finishes the run.
+        if args.shard_index is None:
+            # Remove the products that weren't seen in this run.
+            with METRICS.timer("finish"):
+                DB_CONNECTOR.finish_run(finished)
 
-        # Start the tasks.
-        Prisma(file_name="resources/prisma/eans.txt", debug=args.debug).start()
-        Selver(file_name="resources/selver/skus.txt", debug=args.debug).start()
+            # Match the products.
+            with METRICS.timer("match"):
+                DB_CONNECTOR.match_products()
 
-        # Match the products.
-        DB_CONNECTOR.match_products()
+            # Index the matched products for search.
+            with METRICS.timer("index"):
+                DB_CONNECTOR.build_search_index()
+
+            # Write the columnar snapshot for the readers that don't need the database.
+            with METRICS.timer("snapshot"):
+                DB_CONNECTOR.write_snapshot()
+
+            if args.images:
+                with METRICS.timer("images"):
+                    asyncio.run(DB_CONNECTOR.download_images())
 
         t2 = time.perf_counter()
         logger.info("Done in %s.", stot(t2 - t1))
+        METRICS.log_summary()
+        if args.report is not None:
+            METRICS.write_report(shard_path(args, args.report), run_id=DB_CONNECTOR.run_id, stores=finished)
+        if args.prometheus is not None:
+            METRICS.write_prometheus(shard_path(args, args.prometheus))
+
+        # A shard that didn't finish every store must not let the run be finished.
+        if args.shard_index is not None and len(finished) < len(args.stores):
+            sys.exit(1)
+
+
+def scrape(args: Namespace) -> list:
+    """
+    Runs the scraping tasks of the stores, or of this shard of the stores.
+
+    :param args: The command line arguments.
+
+    :returns: The names of the stores whose task finished.
+    """
+
+    # The dummy database writes nothing, so it must not teach the cache that products were saved.
+    # Recording needs every response in full and replayed responses shouldn't end up in the cache.
+    use_cache = not args.dummy and args.record is None and args.replay is None
+    cache = ResponseCache(state_path(CACHE_PATH), refresh=not args.incremental) if use_cache else None
+    recorder = FixtureRecorder(args.record) if args.record is not None else None
+
+    # Requests are checkpointed as their products are committed, a resumed run skips them.
+    # Offline runs keep theirs apart, so a --resume into MySQL never picks up a replay.
+    checkpoint = None if args.dummy else Checkpoint(state_path(shard_path(args, CHECKPOINT_PATH)))
+    if checkpoint is not None:
+        # A shard only resumes the checkpoint of the run it was launched for.
+        if args.resume and checkpoint.run_id is not None and args.run_id in (None, checkpoint.run_id):
+            logger.info("Resuming run %s.", checkpoint.run_id)
+            DB_CONNECTOR.run_id = checkpoint.run_id
+        else:
+            DB_CONNECTOR.run_id = args.run_id or DB_CONNECTOR.run_id
+            checkpoint.start(DB_CONNECTOR.run_id)
+    elif args.run_id is not None:
+        DB_CONNECTOR.run_id = args.run_id
+
+    # Run the tasks concurrently, products of a store are only removed if its task finished.
+    finished = Coordinator(
+        {
+            STORES[store].store: STORES[store](
+                debug=args.debug,
+                cache=cache,
+                decoder=args.decoder,
+                recorder=recorder,
+                replay=args.replay,
+                checkpoint=checkpoint,
+                shards=args.shards,
+                shard_index=args.shard_index or 0,
+            )
+            for store in args.stores
+        }
+    ).start()
+
+    if cache is not None:
+        cache.close()
+    if recorder is not None:
+        recorder.close()
+
+    # Only a run whose every store finished is done, otherwise --resume picks up the rest.
+    # The checkpoint of a shard is kept until every shard is done, the launcher finishes it.
+    if checkpoint is not None:
+        if len(finished) == len(args.stores) and args.shard_index is None:
+            checkpoint.finish()
+        checkpoint.close()
+
+    return finished
+
+
+def launch_shards(args: Namespace, argv: list) -> list:
+    """
+    Runs every shard in its own process with the same run id and waits for them.
+
+    :param args: The command line arguments.\n
+    :param argv: The arguments they were parsed from, every shard gets them too.
+
+    :returns: The names of the stores, if every shard finished all of them, else none.
+    """
+
+    checkpoints = (
+        [
+            Checkpoint(state_path(shard_path(args, CHECKPOINT_PATH, shard_index)))
+            for shard_index in range(args.shards)
+        ]
+        if not args.dummy
+        else []
+    )
+    run_ids = [checkpoint.run_id for checkpoint in checkpoints if checkpoint.run_id is not None]
+    if args.resume and run_ids:
+        run_id = run_ids[0]
+        logger.info("Resuming run %s.", run_id)
+    else:
+        run_id = args.run_id or DB_CONNECTOR.run_id
+    DB_CONNECTOR.run_id = run_id
+
+    logger.info("Launching %s shards of run %s...", args.shards, run_id)
+    shards = [
+        subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), *argv, "--shard-index", str(shard_index), "--run-id", str(run_id)]
+        )
+        for shard_index in range(args.shards)
+    ]
+    failed = [shard_index for shard_index, shard in enumerate(shards) if shard.wait() != 0]
+
+    if failed:
+        logger.error("Shards %s failed, keeping the products from the last run.", ", ".join(map(str, failed)))
+        finished = []
+    else:
+        finished = [STORES[store].store for store in args.stores]
+
+    for checkpoint in checkpoints:
+        if finished:
+            checkpoint.finish()
+        checkpoint.close()
+    return finished
 
 
 if __name__ == "__main__":
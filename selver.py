@@ -5,154 +5,199 @@ Classes:
     Selver: The class for the Selver scraping task and other utilities it may need.
 """
 
-import asyncio
-import contextlib
-import logging
-import time
-
-import aiohttp
+import json
+import typing
+from typing import List
+from urllib.parse import quote
 
 from etc.category import category_parser
-from etc.util import request_page, stot
-from etc.data import DB_CONNECTOR
+from etc.names import ParsedName, parse_name
+from etc.product import Product
+from etc.pipeline import DatabaseWriter
+from etc.scraper import StoreScraper, register_store
 
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
 
-class Selver:
-    """
+if msgspec is not None:
+    # Only the fields the parser reads are decoded, the rest of every hit is skipped.
 
-    The class for the Selver scraping task and other utilities it may need.
+    class _Document(msgspec.Struct):
+        """
+        A decoded part of the response, read like the dict plain json would have decoded.
+        Absent fields stay UNSET and raise KeyError, like missing keys do.
+        """
 
-    :param file_name: The name of the file containing product eans.\n
-    :param eans: The list of product eans.
-    :param debug: Whether to set the logging to debug or not.
+        def __getitem__(self, key: str) -> typing.Any:
+            value = getattr(self, key, msgspec.UNSET)
+            if value is msgspec.UNSET:
+                raise KeyError(key)
+            return value
 
-    :returns: None
-    """
+        def get(self, key: str, default: typing.Any = None) -> typing.Any:
+            value = getattr(self, key, msgspec.UNSET)
+            return default if value is msgspec.UNSET else value
 
-    def __init__(self, file_name: str = None, eans: list = None, debug: bool = False):
-        """
-        Initializes the Selver class.
+    class _Price(_Document):
+        is_discount: typing.Any = msgspec.UNSET
 
-        Parameters:
-        :param file_name: Name of the file containing product eans.
-        :param eans: List of product eans.
-        """
+    class _Category(_Document):
+        name: typing.Any = msgspec.UNSET
 
-        self.file_name: str = file_name
-        self.eans: list = eans
-        self.logger = logging.getLogger("selver")
-        if debug:
-            self.logger.setLevel(logging.DEBUG)
+    class _Image(_Document):
+        image: typing.Any = msgspec.UNSET
 
-    def start(self) -> None:
-        """
-        Starts the Selver task.
+    class _Source(_Document):
+        sku: typing.Any = msgspec.UNSET
+        product_main_ean: typing.Any = msgspec.UNSET
+        name: typing.Any = msgspec.UNSET
+        product_other_ean: typing.Any = msgspec.UNSET
+        final_price_incl_tax: typing.Any = msgspec.UNSET
+        product_age_restricted: typing.Any = msgspec.UNSET
+        product_volume: typing.Any = msgspec.UNSET
+        unit_price: typing.Any = msgspec.UNSET
+        url_key: typing.Any = msgspec.UNSET
+        prices: typing.List[_Price] = msgspec.UNSET
+        category: typing.List[_Category] = msgspec.UNSET
+        media_gallery: typing.List[_Image] = msgspec.UNSET
 
-        :returns: None
-        """
+    class _Hit(_Document):
+        _source: _Source
 
-        asyncio.run(self.__start_scanner())
+    class _Hits(_Document):
+        hits: typing.List[_Hit] = []
 
-    async def __start_scanner(self) -> None:
-        """
-        Scrapes the Selver website for products and inserts them into the database.
+    class _Search(_Document):
+        # A response without hits, like an empty or error result, is an empty page.
+        hits: _Hits = msgspec.field(default_factory=_Hits)
 
-        Parameters:
-        file_name (str): Name of the file containing product eans.
-        eans (list): List of product eans.
+    SCHEMA = _Search
+else:
+    SCHEMA = None
 
-        Returns:
-        None
-        """
 
-        self.logger.info("Starting Selver task...")
-        my_conn = aiohttp.TCPConnector(limit=20)
-        if self.file_name is not None:
-            with open(self.file_name, encoding="utf-8") as f:
-                eans = f.read().split(",")
-
-        async with aiohttp.ClientSession(connector=my_conn) as session:
-            session.headers.update({"X-Requested-With": "XMLHttpRequest"})
-            tasks = []
-            for ean in eans:
-                url = (
-                    "https://www.selver.ee/api/catalog/vue_storefront_catalog_et/product/_search?from=0&request={"
-                    '"query":{"bool":{"filter":{"bool":{"must":[{"terms":{"sku":["%REPLACE"]}},{"terms":{"visibility":['
-                    '2,3,4]}},{"terms":{"status":[1]}}]}}}}}&size=8&sort&_source_include=product_main_ean,'
-                    "product_age_restricted,name,media_gallery.image,url_key,product_other_ean,*.is_discount,"
-                    "unit_price,final_*,category.name,product_volume&_source_exclude=sgn,price_tax"
-                )
-                url = url.replace("%REPLACE", ean)
-                tasks.append(
-                    asyncio.ensure_future(request_page(session=session, url=url))
-                )
-
-            self.logger.info(f"Gathering {len(tasks)} products...")
-            gathered_products = await asyncio.gather(*tasks, return_exceptions=True)
-
-            i = len(eans) > 0
-            starting_time = time.perf_counter()
-            t1 = starting_time + 1
-            self.logger.info("Inserting products into database...")
-            for product in gathered_products:
-                try:
-                    item = self.__item_parser(product["hits"]["hits"][0]["_source"])
-                    if DB_CONNECTOR.exists(item["ean"], item["store"]):
-                        DB_CONNECTOR.update(item)
-                    else:
-                        DB_CONNECTOR.insert(item)
-                    i += 1
-                except IndexError:
-                    continue
-
-                if DB_CONNECTOR.commit_transactions(t1, i):
-                    t1 = time.perf_counter()
-
-            # Avoid division by zero
-            i = i + 1 if len(eans) > 0 else i
-
-            # Commit the last transactions
-            DB_CONNECTOR.commit_transactions()
-            t2 = time.perf_counter()
-            self.logger.info(
-                "Done inserting %s items in %s. %s seconds per item",
-                i,
-                stot(t2 - t1),
-                round((t2 - starting_time) / i, 4),
+@register_store
+class Selver(StoreScraper):
+    """
+
+    The class for the Selver scraping task and other utilities it may need.
+
+    :param file_name: The name of the file containing product skus.\n
+    :param ids: The list of product skus.
+    :param debug: Whether to set the logging to debug or not.\n
+    :param scheduler: The scheduler that limits and retries the requests.\n
+    :param cache: The response cache used to skip products that haven't changed since the last run.\n
+    :param batch_size: The number of skus per catalog request.\n
+    :param decoder: The JSON decoder backend.
+
+    :returns: None
+    """
+
+    store = "Selver"
+    id_file = "resources/selver/skus.txt"
+    # The catalog takes many skus in one terms query, the urls stay well under the usual 8 KB limit.
+    batch_size = 250
+    schema = SCHEMA
+
+    # A sku can have several hits, the window leaves room for them so no sku is pushed out of it.
+    hits_per_sku = 8
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.missing: typing.List[str] = []
+
+    def build_url(self, product_ids: list) -> str:
+        query = {
+            "query": {
+                "bool": {
+                    "filter": {
+                        "bool": {
+                            "must": [
+                                {"terms": {"sku": list(product_ids)}},
+                                {"terms": {"visibility": [2, 3, 4]}},
+                                {"terms": {"status": [1]}},
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+        # Only what would end the parameter is escaped, so the urls of plain skus read like the query.
+        request = quote(json.dumps(query, separators=(",", ":")), safe='{}[]":,')
+        return (
+            "https://www.selver.ee/api/catalog/vue_storefront_catalog_et/product/_search?from=0"
+            f"&request={request}&size={len(product_ids) * self.hits_per_sku}"
+            "&sort&_source_include=sku,product_main_ean,product_age_restricted,name,media_gallery.image,url_key,"
+            "product_other_ean,*.is_discount,unit_price,final_*,category.name,product_volume"
+            "&_source_exclude=sgn,price_tax"
+        )
+
+    def parse(self, payload: dict, product_ids: list) -> List[Product]:
+        # Split the hits back out per sku, only the first hit of every sku is used.
+        hits = {}
+        # A response without hits is an empty page, whichever decoder read it.
+        for hit in payload.get("hits", {}).get("hits", ()):
+            hits.setdefault(hit["_source"].get("sku"), hit["_source"])
+
+        items = []
+        for sku in product_ids:
+            if sku not in hits:
+                self.missing.append(sku)
+                continue
+            try:
+                items.append(self.__item_parser(hits[sku]))
+            except (KeyError, TypeError, IndexError, ValueError):
+                self.logger.debug("Failed to parse %s.", sku)
+
+        return items
+
+    async def run(self, database_writer: DatabaseWriter = None) -> bool:
+        self.missing = []
+        complete = await super().run(database_writer)
+
+        if self.missing:
+            self.logger.warning(
+                "%s skus were missing from the catalog: %s%s",
+                len(self.missing),
+                ", ".join(self.missing[:20]),
+                ", ..." if len(self.missing) > 20 else "",
             )
+            self.logger.debug("Missing skus: %s", ", ".join(self.missing))
+        return complete
 
-    def __item_parser(self, product: dict) -> dict:
+    def __item_parser(self, product: dict) -> Product:
         try:
             other_ean = product["product_other_ean"]
         except KeyError:
             other_ean = None
 
-        return {
-            "ean": int(product["product_main_ean"]),
-            "name": product["name"].title(),
-            "other_ean": self.__other_ean_parser(other_ean),
-            "brand": "N/A",
-            "store": "Selver",
-            "price": float(f"{product['final_price_incl_tax']:.2f}"),
-            "is_discount": product["prices"][0]["is_discount"],
-            "is_age_restricted": product["product_age_restricted"],
-            "weight": f"{product['product_volume']}",
-            "unit_price": float(f"{product['unit_price']:.2f}"),
-            "url": f"https://www.selver.ee/{product['url_key']}",
-            "category": category_parser(product["category"][0]["name"]),
-            "image_url": self.__image_parser(product),
-            "price_difference_float": 0.0,
-            "price_difference_percentage": 0,
-        }
+        name = parse_name(product["name"])
+        return Product(
+            ean=product["product_main_ean"],
+            store=self.store,
+            name=name.name,
+            other_ean=self.__other_ean_parser(other_ean),
+            price=product["final_price_incl_tax"],
+            is_discount=product["prices"][0]["is_discount"],
+            is_age_restricted=product["product_age_restricted"],
+            weight=self.__weight_parser(product.get("product_volume"), name),
+            unit_price=product["unit_price"],
+            url=f"https://www.selver.ee/{product['url_key']}",
+            category=category_parser(product["category"][0]["name"], self.store),
+            image_url=self.__image_parser(product),
+        )
+
+    def __weight_parser(self, volume: str, name: ParsedName) -> str:
+        if volume:
+            return f"{volume}"
+        return f"{name.quantity:g} {name.unit}" if name.quantity is not None else ""
 
     def __other_ean_parser(self, other_ean: str) -> list[int]:
-        with contextlib.suppress(KeyError):
-            if other_ean is None:
-                return []
-            elif "," in other_ean:
-                return other_ean.split(",")
-            else:
-                return [int(other_ean)]
+        if not other_ean:
+            return []
+        return [int(ean) for ean in str(other_ean).split(",") if ean.strip()]
 
     def __image_parser(self, product: dict) -> str:
         try:
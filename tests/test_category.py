@@ -0,0 +1,27 @@
+"""
+Tests of the category index.
+"""
+
+import unittest
+
+from etc.category import category_parser, unmapped_categories
+
+
+class CategoryParserTest(unittest.TestCase):
+    def tearDown(self) -> None:
+        unmapped_categories("Prisma")
+
+    def test_sub_category_is_mapped(self) -> None:
+        self.assertEqual("Mahlad ja joogid", category_parser("Kohvid", "Prisma"))
+        self.assertEqual("Külmutatud ja jahedad tooted", category_parser("Külmutatud  tooted", "Prisma"))
+
+    def test_parent_category_name_is_not_a_label(self) -> None:
+        self.assertEqual("N/A", category_parser("Mahlad ja joogid", "Prisma"))
+        self.assertEqual("N/A", category_parser("Alkohoolsed joogid", "Prisma"))
+
+    def test_parent_category_listed_as_its_own_sub_category(self) -> None:
+        self.assertEqual("Juust", category_parser("Juust", "Prisma"))
+
+
+if __name__ == "__main__":
+    unittest.main()
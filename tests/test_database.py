@@ -0,0 +1,68 @@
+"""
+Tests of the MySQL database connection, against a cursor that records the statements.
+"""
+
+import unittest
+
+from etc.database import (
+    INSERT_STAGED_EAN, INSERT_STAGED_PRICE, INSERT_STAGED_SEEN, UPDATE_SEEN, DatabaseConnection, _request_hash
+)
+from etc.product import Product
+
+
+class RecordingCursor:
+    """A cursor that keeps the rows of every executemany and fails on a duplicate staged price."""
+
+    def __init__(self) -> None:
+        self.rows: dict = {}
+        self.statements: list = []
+
+    def execute(self, statement: str, params: tuple = None) -> None:
+        self.statements.append(statement)
+
+    def executemany(self, statement: str, rows: list) -> None:
+        self.rows.setdefault(statement, []).extend(rows)
+        if statement == INSERT_STAGED_PRICE:
+            keys = [row[:2] for row in self.rows[statement]]
+            if len(keys) != len(set(keys)):
+                raise AssertionError("1062 (23000): Duplicate entry for key 'PRIMARY' in PriceStage")
+
+
+def product(ean: int, price: float) -> Product:
+    return Product(ean, "Selver", "Piim", price, None, False, False, "1 l", "", "", "")
+
+
+class DatabaseTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.database = DatabaseConnection()
+        self.cursor = RecordingCursor()
+        self.database.local.connection = object()
+        self.database.local.cursor = self.cursor
+
+
+class BulkUpsertTest(DatabaseTest):
+    def test_repeated_product_is_staged_once(self) -> None:
+        self.database.bulk_upsert(
+            [product(4740000000001, 1.0), product(4740000000002, 2.0), product(4740000000001, 1.5)]
+        )
+
+        prices = self.cursor.rows[INSERT_STAGED_PRICE]
+        self.assertEqual([(4740000000001, 150), (4740000000002, 200)], [(row[0], row[2]) for row in prices])
+        self.assertEqual(2, len(self.cursor.rows[INSERT_STAGED_EAN]))
+
+
+
+class MarkSeenTest(DatabaseTest):
+    def test_one_update_for_every_response(self) -> None:
+        responses = [(f"https://example.com/{i}", [(4740000000000 + i, "Prisma")]) for i in range(50)]
+        responses.append(("https://example.com/again", [(4740000000000, "Prisma")]))
+        self.database.mark_seen(responses)
+
+        self.assertEqual(1, self.cursor.statements.count(UPDATE_SEEN))
+        staged = self.cursor.rows[INSERT_STAGED_SEEN]
+        self.assertEqual(50, len(staged))
+        self.assertIn((_request_hash("https://example.com/again"), 4740000000000, "Prisma"), staged)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,28 @@
+"""
+Tests of the product id reader.
+"""
+
+import os
+import tempfile
+import unittest
+
+from etc.ids import IdSource
+
+
+class IdSourceTest(unittest.TestCase):
+    def test_ids_are_deduplicated_as_they_are_requested(self) -> None:
+        self.assertEqual(["42", "0042", "abc"], list(IdSource(ids=["42", " 42", "0042", "abc", "abc", "42"])))
+
+    def test_file_ids_are_deduplicated_across_chunks(self) -> None:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ids.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(str(i % 5000) for i in range(20000)) + ",0042\n042")
+            source = IdSource(path)
+            ids = list(source)
+        self.assertEqual([str(i) for i in range(5000)] + ["0042", "042"], ids)
+        self.assertEqual(15000, source.duplicates)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,25 @@
+"""
+Tests of the command line arguments.
+"""
+
+import time
+import unittest
+from contextlib import redirect_stderr
+from io import StringIO
+
+from main import parse_args
+
+
+class ParseArgsTest(unittest.TestCase):
+    def test_run_id_is_a_unix_time(self) -> None:
+        run_id = int(time.time())
+        self.assertEqual(run_id, parse_args(["--finalize", "--run-id", str(run_id)]).run_id)
+
+    def test_run_id_that_is_not_a_time_is_rejected(self) -> None:
+        for run_id in ("7", str(int(time.time()) + 10 * 86400)):
+            with self.subTest(run_id=run_id), redirect_stderr(StringIO()), self.assertRaises(SystemExit):
+                parse_args(["--finalize", "--run-id", run_id])
+
+
+if __name__ == "__main__":
+    unittest.main()
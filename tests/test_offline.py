@@ -0,0 +1,46 @@
+"""
+Tests that offline runs keep their state away from the state of MySQL runs.
+"""
+
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from etc.cache import CACHE_PATH
+from etc.checkpoint import CHECKPOINT_PATH
+from etc.data import OFFLINE_STATE_DIR, DB_CONNECTOR
+from etc.memory import MemoryDatabase
+from etc.snapshot import SNAPSHOT_PATH
+from main import parse_args, scrape
+
+
+class OfflineStateTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.chdir(self.directory.name)
+        self.environ = mock.patch.dict(os.environ, {"DATABASE_BACKEND": "memory"})
+        self.environ.start()
+        DB_CONNECTOR.use(MemoryDatabase())
+
+    def tearDown(self) -> None:
+        DB_CONNECTOR.use(None)
+        self.environ.stop()
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_default_paths_are_untouched(self) -> None:
+        args = parse_args([])
+        args.stores = []
+        scrape(args)
+        DB_CONNECTOR.write_snapshot()
+
+        for path in (CHECKPOINT_PATH, CACHE_PATH, SNAPSHOT_PATH):
+            self.assertFalse(os.path.exists(path), path)
+        for path in (CHECKPOINT_PATH, CACHE_PATH, SNAPSHOT_PATH):
+            self.assertTrue(os.path.exists(os.path.join(OFFLINE_STATE_DIR, os.path.basename(path))), path)
+
+
+if __name__ == "__main__":
+    unittest.main()
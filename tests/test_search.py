@@ -0,0 +1,31 @@
+"""
+Tests of the product search index.
+"""
+
+import unittest
+
+from etc.search import SearchIndex
+
+
+class SearchTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.index = SearchIndex.build(
+            [
+                ("coffee", "Kohvi Paulig", "Paulig", 0),
+                ("creamer", "Kohvikoor Alma", "Alma", 0),
+                ("milk", "Piim", "Alma", 0),
+            ]
+        )
+
+    def test_exact_word(self) -> None:
+        self.assertEqual(["milk"], self.index.search("piim"))
+
+    def test_prefix_of_last_word(self) -> None:
+        self.assertEqual("creamer", self.index.search("kohviko")[0])
+
+    def test_misspelled_word_that_is_a_prefix_is_matched_fuzzily(self) -> None:
+        # "kohvik" isn't a word of the index but starts "kohvikoor", it still matches "kohvi" by trigrams.
+        self.assertEqual({"coffee", "creamer"}, set(self.index.search("kohvik")))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,27 @@
+"""
+Tests of the Selver response parser.
+"""
+
+import unittest
+
+from etc.decoding import BACKENDS, get_decoder
+from selver import SCHEMA, Selver
+
+
+class ParseTest(unittest.TestCase):
+    def test_response_without_hits_is_an_empty_page(self) -> None:
+        selver = Selver(file_name="resources/selver/sample_skus.txt")
+        for backend in BACKENDS:
+            try:
+                decoder = get_decoder(backend, SCHEMA)
+            except ValueError:
+                continue
+            for body in (b"{}", b'{"error": "timeout"}', b'{"hits": {}}'):
+                with self.subTest(backend=backend, body=body):
+                    selver.missing = []
+                    self.assertEqual([], selver.parse(decoder.decode(body), ["T000000001"]))
+                    self.assertEqual(["T000000001"], selver.missing)
+
+
+if __name__ == "__main__":
+    unittest.main()